@@ -0,0 +1,269 @@
+"""
+Benchmark de la generación del sitio sin conexión.
+
+Ejecuta generate_static_site() de main.py contra proveedores simulados (Yahoo Finance,
+NewsAPI y Gemini) que devuelven historiales, estados financieros, noticias y resúmenes
+sintéticos, con latencia y tasa de fallos configurables. Para cada tamaño de cartera
+(por defecto 16, 200 y 2000 tickers) se lanza un subproceso independiente que construye
+el sitio en una carpeta temporal y mide el rendimiento (tickers/s), la memoria máxima
+(RSS del proceso y del mayor de sus hijos, donde se dibujan los gráficos en modo
+concurrente) y el tiempo por etapa a partir del informe de construcción de main.py.
+
+Uso:
+    python benchmark.py
+    python benchmark.py --sizes 16,200 --concurrent --gemini-latency 0.8 --failure-rate 0.05
+    python benchmark.py --sizes 200 --warm --output resultados.json
+    python benchmark.py --sizes 200 --chart-mode client
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import zlib
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- Proveedores simulados ---
+class FakeProviderError(Exception):
+    pass
+
+class FakeProviders:
+    """Estado compartido de los proveedores simulados: latencias, tasa de fallos y datos sintéticos."""
+    def __init__(self, yahoo_latency=0.0, newsapi_latency=0.0, gemini_latency=0.0,
+                 failure_rate=0.0, history_years=10, seed=0):
+        self.latency = {'yahoo': yahoo_latency, 'newsapi': newsapi_latency, 'gemini': gemini_latency}
+        self.failure_rate = failure_rate
+        self.history_years = history_years
+        self.random = random.Random(seed)
+        self.dates = pd.bdate_range(end=pd.Timestamp.now().normalize(), periods=history_years * 252)
+
+    def call(self, provider):
+        """Simula la latencia de una llamada y, con probabilidad failure_rate, un error del proveedor."""
+        if self.latency[provider]:
+            time.sleep(self.latency[provider])
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise FakeProviderError(f"Fallo simulado de {provider}")
+
+    def closes(self, tickers):
+        """Paseo aleatorio geométrico reproducible por ticker: matriz (fechas x tickers)."""
+        columns = []
+        for ticker in tickers:
+            rng = np.random.default_rng(zlib.crc32(ticker.encode('utf-8')))
+            returns = rng.normal(0.0003, 0.02, len(self.dates))
+            columns.append(rng.uniform(10, 300) * np.exp(np.cumsum(returns)))
+        return np.column_stack(columns) if columns else np.empty((len(self.dates), 0))
+
+    def history_frame(self, tickers, start=None):
+        closes = self.closes(tickers)
+        mask = np.ones(len(self.dates), dtype=bool) if start is None else self.dates >= pd.Timestamp(start)
+        frames = {}
+        for i, ticker in enumerate(tickers):
+            close = closes[mask, i]
+            frames[ticker] = pd.DataFrame({
+                'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                'Volume': np.full(len(close), 1_000_000.0),
+            }, index=self.dates[mask])
+        return frames
+
+def build_fake_yfinance(providers):
+    """Módulo con la misma interfaz que yfinance usa main.py: download() y Ticker."""
+    def download(tickers, period=None, start=None, group_by='ticker', **kwargs):
+        providers.call('yahoo')
+        frames = providers.history_frame(list(tickers), start=start)
+        return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+    class Ticker:
+        def __init__(self, ticker):
+            self.ticker = ticker
+
+        @property
+        def info(self):
+            providers.call('yahoo')
+            last_close = float(providers.closes([self.ticker])[-1, 0])
+            return {
+                'longName': f'{self.ticker} Synthetic Corp',
+                'sector': ['Financial Services', 'Industrials', 'Technology', 'Consumer Cyclical'][zlib.crc32(self.ticker.encode()) % 4],
+                'industry': 'Synthetic',
+                'regularMarketPrice': round(last_close, 2),
+            }
+
+        def history(self, period='max'):
+            providers.call('yahoo')
+            return providers.history_frame([self.ticker])[self.ticker]
+
+        def _statement(self, rows):
+            rng = np.random.default_rng(zlib.crc32(self.ticker.encode('utf-8')))
+            columns = pd.to_datetime([f'{pd.Timestamp.now().year - i}-12-31' for i in range(1, 5)])
+            return pd.DataFrame(rng.uniform(1e8, 5e9, (len(rows), 4)), index=rows, columns=columns)
+
+        @property
+        def financials(self):
+            providers.call('yahoo')
+            return self._statement(['Operating Income', 'Net Income'])
+
+        @property
+        def cashflow(self):
+            providers.call('yahoo')
+            return self._statement(['EBITDA'])
+
+        @property
+        def news(self):
+            providers.call('yahoo')
+            return [{'title': f'{self.ticker} noticia {i}', 'link': f'https://example.com/yf/{self.ticker}/{i}',
+                     'publisher': 'Yahoo Sintético'} for i in range(3)]
+
+    return types.SimpleNamespace(download=download, Ticker=Ticker)
+
+def build_fake_newsapi(providers):
+    class NewsApiClient:
+        def get_everything(self, q, page_size=20, **kwargs):
+            providers.call('newsapi')
+            match = re.search(r'"(\S+) stock"', q)
+            ticker = match.group(1) if match else q
+            published = pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%dT%H:%M:%SZ')
+            articles = [{
+                'title': f'{ticker} headline {i}', 'url': f'https://example.com/news/{ticker}/{i}',
+                'source': {'name': 'Synthetic Wire'}, 'publishedAt': published,
+            } for i in range(page_size)]
+            return {'status': 'ok', 'totalResults': len(articles), 'articles': articles}
+    return NewsApiClient()
+
+def build_fake_genai(providers):
+    class Response:
+        def __init__(self, text):
+            self.text = text
+
+    class GenerativeModel:
+        def __init__(self, model_name, generation_config=None):
+            self.model_name = model_name
+
+        def generate_content(self, prompt):
+            providers.call('gemini')
+            batch_tickers = re.findall(r'^### (\S+) - ', prompt, re.MULTILINE)
+            if batch_tickers:
+                return Response(json.dumps({t: f'Resumen sintético de {t}.' for t in batch_tickers}))
+            return Response(f'Resumen sintético ({len(prompt)} caracteres de prompt).')
+
+    return types.SimpleNamespace(configure=lambda **kwargs: None, GenerativeModel=GenerativeModel)
+
+
+# --- Ejecución de un tamaño de cartera (subproceso) ---
+def run_worker(args):
+    workdir = tempfile.mkdtemp(prefix=f'dashboard-bench-{args.worker}-')
+    try:
+        shutil.copytree(os.path.join(REPO_DIR, 'templates'), os.path.join(workdir, 'templates'))
+        with open(os.path.join(workdir, 'tickers.txt'), 'w') as f:
+            f.write('\n'.join(f'T{i:04d}' for i in range(args.worker)))
+        os.chdir(workdir)
+        os.environ['DASHBOARD_DATA_DIR'] = os.path.join(workdir, 'data')
+        if not args.keep_rate_limits:
+            for provider in ('YAHOO', 'NEWSAPI', 'GEMINI'):
+                os.environ[f'{provider}_CALLS_PER_MINUTE'] = '0'
+
+        sys.path.insert(0, REPO_DIR)
+        import main
+
+        providers = FakeProviders(args.yahoo_latency, args.newsapi_latency, args.gemini_latency,
+                                  args.failure_rate, args.history_years)
+        main.yf = build_fake_yfinance(providers)
+        main.genai = build_fake_genai(providers)
+        main.newsapi = build_fake_newsapi(providers)
+        # Los procesos de gráficos como hijos directos (spawn en lugar de forkserver): así, al
+        # cerrarse el pool, su memoria máxima aparece en RUSAGE_CHILDREN de este proceso
+        main.CHART_POOL_START_METHOD = 'spawn'
+
+        runs = []
+        for run in ('cold', 'warm') if args.warm else ('cold',):
+            start = time.perf_counter()
+            main.generate_static_site(concurrent=args.concurrent, batch_summaries=args.batch_summaries,
+                                      chart_mode=args.chart_mode)
+            elapsed = time.perf_counter() - start
+            with open(os.path.join(main.DATA_DIR, 'build_report.json')) as f:
+                report = json.load(f)
+            runs.append({
+                'run': run,
+                'seconds': round(elapsed, 3),
+                'tickers_per_second': round(args.worker / elapsed, 2) if elapsed else None,
+                'stages': {stage: round(totals['seconds'], 3) for stage, totals in report['stages'].items()},
+            })
+        result = {
+            'tickers': args.worker,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'peak_children_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+            'runs': runs,
+        }
+        print('BENCHMARK_RESULT ' + json.dumps(result))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_size(size, args):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', str(size),
+               '--yahoo-latency', str(args.yahoo_latency), '--newsapi-latency', str(args.newsapi_latency),
+               '--gemini-latency', str(args.gemini_latency), '--failure-rate', str(args.failure_rate),
+               '--history-years', str(args.history_years), '--chart-mode', args.chart_mode]
+    for flag in ('concurrent', 'batch_summaries', 'warm', 'keep_rate_limits'):
+        if getattr(args, flag):
+            command.append('--' + flag.replace('_', '-'))
+    completed = subprocess.run(command, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith('BENCHMARK_RESULT '):
+            return json.loads(line[len('BENCHMARK_RESULT '):])
+    print(completed.stdout[-2000:])
+    print(completed.stderr[-2000:])
+    raise RuntimeError(f"El benchmark de {size} tickers falló (código {completed.returncode}).")
+
+def print_results(results, top_stages=6):
+    print(f"\n{'Tickers':>8}{'Ejecución':>11}{'Tiempo (s)':>12}{'Tickers/s':>11}{'RSS máx (MB)':>14}"
+          f"{'RSS hijos (MB)':>16}  Etapas más lentas (s)")
+    for result in results:
+        for run in result['runs']:
+            stages = sorted(((s, t) for s, t in run['stages'].items() if s != 'total'), key=lambda item: -item[1])
+            slowest = ', '.join(f'{stage}={seconds:.2f}' for stage, seconds in stages[:top_stages])
+            print(f"{result['tickers']:>8}{run['run']:>11}{run['seconds']:>12.2f}{run['tickers_per_second']:>11.2f}"
+                  f"{result['peak_rss_mb']:>14.1f}{result['peak_children_rss_mb']:>16.1f}  {slowest}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark sin conexión de la generación del dashboard.")
+    parser.add_argument('--sizes', default='16,200,2000', help='Tamaños de cartera separados por comas.')
+    parser.add_argument('--concurrent', action='store_true', help='Usa el modo concurrente de main.py.')
+    parser.add_argument('--batch-summaries', action='store_true', help='Usa los resúmenes por lotes de main.py.')
+    parser.add_argument('--chart-mode', choices=('images', 'client'), default='images',
+                        help="Modo de gráficos de main.py: 'images' (matplotlib) o 'client' (datos para el navegador).")
+    parser.add_argument('--warm', action='store_true', help='Repite la construcción con las caches ya cargadas.')
+    parser.add_argument('--yahoo-latency', type=float, default=0.0, help='Latencia simulada por llamada a Yahoo (s).')
+    parser.add_argument('--newsapi-latency', type=float, default=0.0, help='Latencia simulada por llamada a NewsAPI (s).')
+    parser.add_argument('--gemini-latency', type=float, default=0.0, help='Latencia simulada por llamada a Gemini (s).')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Probabilidad de fallo de cada llamada simulada.')
+    parser.add_argument('--history-years', type=int, default=10, help='Años de historial sintético por ticker.')
+    parser.add_argument('--keep-rate-limits', action='store_true',
+                        help='Mantiene los límites de ritmo por proveedor (por defecto se desactivan).')
+    parser.add_argument('--output', help='Guarda los resultados en este archivo JSON.')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        run_worker(args)
+        sys.exit(0)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',') if size.strip()]:
+        print(f"Ejecutando benchmark con {size} tickers...")
+        results.append(run_size(size, args))
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': vars(args), 'results': results}, f, indent=2)
+        print(f"\nResultados guardados en {args.output}")
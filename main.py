@@ -1,29 +1,79 @@
-import yfinance as yf
-import pandas as pd
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 import os
-import requests
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-from matplotlib.ticker import FuncFormatter
-import google.generativeai as genai
-from newsapi import NewsApiClient
-from datetime import datetime, timedelta
+import argparse
+import importlib
+import re
+import gzip
+import posixpath
+import shutil
+from datetime import datetime, timedelta, timezone
+import sqlite3
+import hashlib
+import json
+import pickle
+import builtins
+import zipfile
+import threading
+import multiprocessing
+import time
+import random
+import cProfile
+import pstats
+from contextlib import contextmanager, ExitStack
+from dataclasses import dataclass, field, asdict, fields, replace
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# --- Importaciones diferidas ---
+# yfinance, pandas, numpy, matplotlib y el cliente de Gemini tardan varios segundos en
+# importarse. Cada uno se importa la primera vez que una etapa usa uno de sus atributos,
+# de modo que --render-only (que solo necesita Jinja) arranca sin cargarlos.
+class LazyModule:
+    def __init__(self, name):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_module', None)
+
+    def _load(self):
+        if self._module is None:
+            object.__setattr__(self, '_module', importlib.import_module(self._name))
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+yf = LazyModule('yfinance')
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+matplotlib = LazyModule('matplotlib')
+mdates = LazyModule('matplotlib.dates')
+mpl_figure = LazyModule('matplotlib.figure')
+mpl_backend_agg = LazyModule('matplotlib.backends.backend_agg')
+mpl_ticker = LazyModule('matplotlib.ticker')
+genai = LazyModule('google.generativeai')
 
 # --- Configurar las APIs ---
-try:
-    genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-except KeyError:
-    print("Error: GEMINI_API_KEY no está configurada en los Secrets de Replit.")
-    print("Por favor, ve al icono del candado en Replit y añade GEMINI_API_KEY con tu clave de Gemini.")
-    exit()
-
-try:
-    newsapi = NewsApiClient(api_key=os.environ["NEWSAPI_API_KEY"])
-except KeyError:
-    print("Error: NEWSAPI_API_KEY no está configurada en los Secrets de Replit.")
-    print("Por favor, ve al icono del candado en Replit y añade NEWSAPI_API_KEY con tu clave de NewsAPI.")
-    exit()
+# La configuración se hace al ejecutar el script (configure_providers) y no al importar el
+# módulo, para poder importarlo sin claves (p. ej. desde benchmark.py con proveedores simulados)
+newsapi = None
+
+def configure_providers():
+    global newsapi
+    from newsapi import NewsApiClient
+    try:
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+    except KeyError:
+        print("Error: GEMINI_API_KEY no está configurada en los Secrets de Replit.")
+        print("Por favor, ve al icono del candado en Replit y añade GEMINI_API_KEY con tu clave de Gemini.")
+        exit()
+
+    try:
+        newsapi = NewsApiClient(api_key=os.environ["NEWSAPI_API_KEY"])
+    except KeyError:
+        print("Error: NEWSAPI_API_KEY no está configurada en los Secrets de Replit.")
+        print("Por favor, ve al icono del candado en Replit y añade NEWSAPI_API_KEY con tu clave de NewsAPI.")
+        exit()
 
 # Asegúrate de que estas carpetas existan
 if not os.path.exists('public/img'):
@@ -31,12 +81,640 @@ if not os.path.exists('public/img'):
 if not os.path.exists('public/css'):
     os.makedirs('public/css')
 
-# Configurar el entorno Jinja2
-env = Environment(loader=FileSystemLoader('templates'))
+# Carpeta de datos persistentes (caches e historial). En Cloud Run se puede
+# montar un volumen y apuntar DASHBOARD_DATA_DIR a él para que sobreviva entre despliegues
+DATA_DIR = os.environ.get('DASHBOARD_DATA_DIR', 'data')
+if not os.path.exists(DATA_DIR):
+    os.makedirs(DATA_DIR)
+
+# Reloj de la construcción: las ventanas de precios, noticias y la analítica se calculan
+# respecto a build_now(), que en modo --replay se desplaza a la fecha de la grabación
+BUILD_CLOCK_OFFSET = timedelta(0)
+
+def build_now(tz=None):
+    return datetime.now(tz) - BUILD_CLOCK_OFFSET
+
+# Configurar el entorno Jinja2. Las plantillas compiladas se guardan en DATA_DIR para no
+# volver a compilarlas en cada construcción
+JINJA_CACHE_DIR = os.path.join(DATA_DIR, 'jinja_cache')
+if not os.path.exists(JINJA_CACHE_DIR):
+    os.makedirs(JINJA_CACHE_DIR)
+env = Environment(loader=FileSystemLoader('templates'), bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR))
+
+# --- Límites de concurrencia y de ritmo por proveedor ---
+# Cada proveedor tiene su propio tope de llamadas simultáneas y de llamadas por minuto,
+# para no superar las cuotas gratuitas cuando el sitio se genera en modo concurrente
+class ProviderLimiter:
+    def __init__(self, name, max_concurrent, calls_per_minute):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._min_interval = 60.0 / calls_per_minute if calls_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+    def acquire(self):
+        started = time.perf_counter()
+        self._semaphore.acquire()
+        if self._min_interval:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._next_call - now
+                self._next_call = max(now, self._next_call) + self._min_interval
+            if wait > 0:
+                time.sleep(wait)
+        # La espera (hueco libre y ritmo) se registra aparte de la etapa de la llamada
+        count_metric(f'{self.name}_limiter_wait', seconds=time.perf_counter() - started, calls=1)
+
+    def release(self):
+        self._semaphore.release()
+
+PROVIDER_LIMITERS = {
+    'yahoo': ProviderLimiter('yahoo',
+                             int(os.environ.get('YAHOO_MAX_CONCURRENT', 8)),
+                             int(os.environ.get('YAHOO_CALLS_PER_MINUTE', 600))),
+    'newsapi': ProviderLimiter('newsapi',
+                               int(os.environ.get('NEWSAPI_MAX_CONCURRENT', 2)),
+                               int(os.environ.get('NEWSAPI_CALLS_PER_MINUTE', 30))),
+    'gemini': ProviderLimiter('gemini',
+                              int(os.environ.get('GEMINI_MAX_CONCURRENT', 4)),
+                              int(os.environ.get('GEMINI_CALLS_PER_MINUTE', 15))),
+}
+
+# Hilos para la E/S por ticker y procesos para el renderizado de gráficos (modo concurrente)
+BUILD_IO_WORKERS = int(os.environ.get('BUILD_IO_WORKERS', 8))
+BUILD_CHART_WORKERS = int(os.environ.get('BUILD_CHART_WORKERS', os.cpu_count() or 2))
+# Los procesos de gráficos se crean desde los hilos de E/S, que pueden tener tomados locks
+# (métricas, stdout, sqlite, requests). Con fork el hijo heredaría esos locks cerrados y la
+# construcción podría bloquearse, así que se arrancan con forkserver (o spawn si no existe)
+CHART_POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# --- Métricas de la construcción por ticker y etapa ---
+# Cada etapa (yahoo_info, newsapi, gemini, charts, jinja_render, ...) acumula por ticker el
+# tiempo de reloj, el número de llamadas y contadores opcionales: bytes (tamaño aproximado
+# de la respuesta), retries, cache_hits, cache_misses, prompt_chars y, en 'news_prompt',
+# prompt_tokens, duplicates y tokens_saved (tokens estimados). La espera en el limitador de
+# cada proveedor se registra en su propia etapa (<proveedor>_limiter_wait). Las etapas que no
+# pertenecen a un ticker concreto se registran bajo BUILD_SCOPE.
+BUILD_SCOPE = '_build'
+BUILD_REPORTS_DIR = os.path.join(DATA_DIR, 'build_reports')
+
+class BuildMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.entries = {}  # (ticker, etapa) -> {'seconds': ..., 'calls': ..., ...}
+
+    def add(self, ticker, stage, **values):
+        with self._lock:
+            entry = self.entries.setdefault((ticker, stage), {'seconds': 0.0, 'calls': 0})
+            for key, value in values.items():
+                entry[key] = entry.get(key, 0) + value
+
+    def pop_ticker(self, ticker, stages):
+        """Extrae las métricas de esas etapas de un ticker (para devolverlas desde un proceso del pool)."""
+        with self._lock:
+            keys = [key for key in self.entries if key[0] == ticker and key[1] in stages]
+            return {key[1]: self.entries.pop(key) for key in keys}
+
+    def merge(self, ticker, stages):
+        for stage, values in stages.items():
+            self.add(ticker, stage, **values)
+
+    def report(self, options=None):
+        with self._lock:
+            entries = {key: dict(values) for key, values in self.entries.items()}
+        finished_at = time.time()
+        tickers, stages = {}, {}
+        for (ticker, stage), values in entries.items():
+            tickers.setdefault(ticker, {})[stage] = values
+            totals = stages.setdefault(stage, {})
+            for key, value in values.items():
+                totals[key] = totals.get(key, 0) + value
+        return {
+            'started_at': datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            'finished_at': datetime.fromtimestamp(finished_at, timezone.utc).isoformat(),
+            'total_seconds': round(finished_at - self.started_at, 3),
+            'options': options or {},
+            'stages': stages,
+            'tickers': tickers,
+        }
+
+BUILD_METRICS = BuildMetrics()
+_metrics_context = threading.local()
+
+def current_metrics_ticker():
+    return getattr(_metrics_context, 'ticker', BUILD_SCOPE)
+
+@contextmanager
+def metrics_ticker(ticker):
+    """Atribuye al ticker dado las métricas registradas en este hilo dentro del bloque."""
+    previous = current_metrics_ticker()
+    _metrics_context.ticker = ticker
+    try:
+        yield
+    finally:
+        _metrics_context.ticker = previous
+
+@contextmanager
+def timed_stage(stage, ticker=None, **values):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        BUILD_METRICS.add(ticker or current_metrics_ticker(), stage,
+                          seconds=time.perf_counter() - start, calls=1, **values)
+
+def count_metric(stage, ticker=None, **values):
+    BUILD_METRICS.add(ticker or current_metrics_ticker(), stage, **values)
+
+def payload_size(payload):
+    """Tamaño aproximado en bytes de una respuesta de proveedor (DataFrame, dict/list o texto)."""
+    try:
+        if isinstance(payload, (pd.DataFrame, pd.Series)):
+            return int(payload.memory_usage(deep=True).sum()) if isinstance(payload, pd.DataFrame) else int(payload.memory_usage(deep=True))
+        if isinstance(payload, str):
+            return len(payload.encode('utf-8'))
+        return len(json.dumps(payload, default=str).encode('utf-8'))
+    except Exception:
+        return 0
+
+def write_build_report(options=None, top=5):
+    """Escribe el informe JSON de la construcción y muestra en consola las etapas y tickers más lentos."""
+    report = BUILD_METRICS.report(options)
+    if not os.path.exists(BUILD_REPORTS_DIR):
+        os.makedirs(BUILD_REPORTS_DIR)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    for path in (os.path.join(BUILD_REPORTS_DIR, f'build_report_{stamp}.json'), os.path.join(DATA_DIR, 'build_report.json')):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\nInforme de construcción ({report['total_seconds']:.1f} s) guardado en {os.path.join(DATA_DIR, 'build_report.json')}")
+    print(f"{'Etapa':<20}{'Tiempo (s)':>12}{'Llamadas':>10}{'Cache hit/miss':>16}")
+    for stage, totals in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds'])[:top * 2]:
+        cache = f"{totals.get('cache_hits', 0)}/{totals.get('cache_misses', 0)}"
+        print(f"{stage:<20}{totals['seconds']:>12.2f}{totals['calls']:>10}{cache:>16}")
+    # 'total' es el tiempo de reloj de process_ticker (en modo concurrente no incluye los gráficos)
+    ticker_totals = [
+        (ticker, stages['total']['seconds'] if 'total' in stages else sum(values['seconds'] for values in stages.values()), stages)
+        for ticker, stages in report['tickers'].items() if ticker != BUILD_SCOPE
+    ]
+    if ticker_totals:
+        print(f"\n{'Ticker':<12}{'Tiempo (s)':>12}  Etapa más lenta")
+        for ticker, seconds, stages in sorted(ticker_totals, key=lambda item: -item[1])[:top]:
+            slowest = max((s for s in stages if s != 'total'), key=lambda s: stages[s]['seconds'], default='-')
+            print(f"{ticker:<12}{seconds:>12.2f}  {slowest}")
+    news_prompt = report['stages'].get('news_prompt')
+    if news_prompt:
+        print(f"\nPrompts de noticias: {news_prompt.get('prompt_tokens', 0)} tokens estimados; "
+              f"{news_prompt.get('duplicates', 0)} titulares casi duplicados descartados "
+              f"(~{news_prompt.get('tokens_saved', 0)} tokens ahorrados).")
+    return report
+
+# --- Perfilado opcional de la fase de renderizado (gráficos y plantilla) con cProfile ---
+RENDER_PROFILE_PATH = os.path.join(DATA_DIR, 'render_profile.prof')
+_render_profiler = None
+
+@contextmanager
+def profile_render():
+    """Perfila el bloque si --profile está activo (solo en el proceso principal)."""
+    if _render_profiler is None:
+        yield
+        return
+    _render_profiler.enable()
+    try:
+        yield
+    finally:
+        _render_profiler.disable()
+
+# --- Capa de proveedores: tiempo máximo por llamada, reintentos y cortacircuitos ---
+# call_provider() envuelve cada llamada a NewsAPI, Gemini o Yahoo (noticias):
+#  - espera como máximo <PROVEEDOR>_TIMEOUT_SECONDS por la respuesta;
+#  - reintenta los errores transitorios (tiempo agotado, conexión, 5xx) hasta
+#    PROVIDER_MAX_RETRIES veces con espera exponencial y aleatoria (jitter);
+#  - ante un error de cuota o de autenticación abre el cortacircuitos del proveedor:
+#    durante CIRCUIT_BREAKER_COOLDOWN_SECONDS el resto de tickers no lo llama y usa la
+#    cache o un texto de reemplazo, en lugar de pagar llamadas que van a fallar.
+PROVIDER_TIMEOUTS = {
+    'yahoo': float(os.environ.get('YAHOO_TIMEOUT_SECONDS', 15)),
+    'newsapi': float(os.environ.get('NEWSAPI_TIMEOUT_SECONDS', 10)),
+    'gemini': float(os.environ.get('GEMINI_TIMEOUT_SECONDS', 60)),
+}
+PROVIDER_MAX_RETRIES = int(os.environ.get('PROVIDER_MAX_RETRIES', 2))
+PROVIDER_RETRY_BASE_SECONDS = float(os.environ.get('PROVIDER_RETRY_BASE_SECONDS', 1.0))
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('CIRCUIT_BREAKER_COOLDOWN_SECONDS', 900))
+
+# Errores de cuota/autenticación (google.api_core, newsapi, yfinance) por clase, estado HTTP o
+# código de error de NewsAPI; el texto del mensaje solo se mira para frases inequívocas, nunca
+# para números sueltos (un ticker, un importe o una consulta pueden contener '429' o '500')
+FATAL_PROVIDER_ERROR_NAMES = {'ResourceExhausted', 'PermissionDenied', 'Unauthenticated', 'YFRateLimitError'}
+FATAL_PROVIDER_STATUS_CODES = {401, 403, 429}
+FATAL_NEWSAPI_ERROR_CODES = {'rateLimited', 'apiKeyInvalid', 'apiKeyMissing', 'apiKeyDisabled', 'apiKeyExhausted'}
+FATAL_PROVIDER_ERROR_MARKERS = ('quota', 'rate limit', 'ratelimited', 'too many requests')
+TRANSIENT_PROVIDER_STATUS_CODES = {500, 502, 503, 504}
+TRANSIENT_PROVIDER_ERROR_NAMES = {'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'BadGateway',
+                                  'GatewayTimeout', 'ConnectionError', 'ReadTimeout', 'ConnectTimeout'}
+
+class ProviderUnavailable(Exception):
+    """El cortacircuitos del proveedor está abierto: no se hizo la llamada."""
+
+class CircuitBreaker:
+    def __init__(self, name, cooldown):
+        self.name = name
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.opened_at = None
+        self.reason = None
+
+    def check(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Semiabierto: se deja pasar la siguiente llamada para comprobar si el proveedor se recuperó
+                self.opened_at = None
+                return
+            raise ProviderUnavailable(f"{self.name} desactivado temporalmente: {self.reason}")
+
+    def trip(self, error):
+        with self._lock:
+            if self.opened_at is None:
+                print(f"AVISO: se desactiva {self.name} durante {self.cooldown:.0f} s por un error de cuota o autenticación: {error}")
+            self.opened_at = time.monotonic()
+            self.reason = str(error)[:200]
+
+    def reset(self):
+        with self._lock:
+            self.opened_at = None
+            self.reason = None
+
+PROVIDER_BREAKERS = {name: CircuitBreaker(name, CIRCUIT_BREAKER_COOLDOWN_SECONDS) for name in PROVIDER_LIMITERS}
+
+# Hilos en los que se ejecutan las llamadas para poder abandonarlas al agotar el tiempo
+# (los SDK de NewsAPI y Gemini no aceptan un tiempo máximo común). Una llamada abandonada
+# sigue ocupando su hilo y el hueco de su limitador hasta que termina; con un hilo por hueco
+# de cada limitador, toda llamada admitida por su limitador empieza a ejecutarse en el acto.
+_provider_call_pool = ThreadPoolExecutor(max_workers=sum(limiter.max_concurrent for limiter in PROVIDER_LIMITERS.values()),
+                                         thread_name_prefix='provider')
+
+def _error_class_names(error):
+    return {cls.__name__ for cls in type(error).__mro__}
+
+def provider_error_status(error):
+    """Estado HTTP del error (code, status_code o response.status_code) o None si no lo informa."""
+    for status in (getattr(error, 'status_code', None), getattr(error, 'code', None),
+                   getattr(getattr(error, 'response', None), 'status_code', None)):
+        if isinstance(status, int) and not isinstance(status, bool):
+            return status
+    return None
+
+def _newsapi_error_code(error):
+    """Código de error de NewsAPIException ('rateLimited', 'apiKeyInvalid'...) o None."""
+    get_code = getattr(error, 'get_code', None)
+    try:
+        return get_code() if callable(get_code) else None
+    except Exception:
+        return None
+
+def is_fatal_provider_error(error):
+    if _error_class_names(error) & FATAL_PROVIDER_ERROR_NAMES:
+        return True
+    if provider_error_status(error) in FATAL_PROVIDER_STATUS_CODES:
+        return True
+    if _newsapi_error_code(error) in FATAL_NEWSAPI_ERROR_CODES:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in FATAL_PROVIDER_ERROR_MARKERS)
+
+def is_transient_provider_error(error):
+    if isinstance(error, (TimeoutError, ConnectionError)) or _error_class_names(error) & TRANSIENT_PROVIDER_ERROR_NAMES:
+        return True
+    if provider_error_status(error) in TRANSIENT_PROVIDER_STATUS_CODES:
+        return True
+    return 'timed out' in str(error).lower()
+
+
+# --- Grabación y reproducción de las respuestas de los proveedores (casetes) ---
+# --record CASETE guarda en un zip comprimido cada respuesta de proveedor que consume la
+# construcción: info, history, financials, cashflow y news de Yahoo, la descarga en bloque de
+# precios, get_everything de NewsAPI y generate_content de Gemini, incluidos sus errores. Las
+# respuestas se guardan en el orden de las llamadas, y las que llegan después de que
+# call_provider abandonara la llamada por tiempo se graban como tiempo agotado.
+# --replay CASETE repite la construcción solo con esas respuestas: sin red ni claves, sin las
+# esperas de los limitadores ni de los reintentos y con el reloj de la construcción en la
+# fecha de la grabación.
+# Las respuestas servidas por las caches de DATA_DIR no llegan al proveedor ni al casete: para
+# un casete completo y una reproducción exacta, usa un DASHBOARD_DATA_DIR vacío en ambos modos.
+# Las respuestas se guardan con pickle; reproduce solo casetes grabados por ti.
+CASSETTE_FORMAT_VERSION = 2
+
+class CassetteMiss(Exception):
+    """El casete no tiene ninguna respuesta grabada para la llamada."""
+
+@dataclass(slots=True)
+class RecordedResponse:
+    """Lo que se usa de la respuesta de generate_content de Gemini."""
+    text: str
+
+# Respuesta que terminó después de que call_provider abandonara la llamada por tiempo
+ABANDONED_CALL_ENTRY = {'error': ['TimeoutError'], 'message': 'llamada abandonada por tiempo agotado durante la grabación',
+                        'status': None, 'code': None}
+
+def recorded_error(entry):
+    """
+    Reconstruye un error grabado para que los reintentos y el cortacircuitos lo clasifiquen igual
+    que al grabar: las excepciones estándar (TimeoutError, ConnectionError...) se lanzan con su
+    clase real; las de los SDK, con una jerarquía con los mismos nombres sobre la excepción
+    estándar de la que derivaban, y con su estado HTTP y código de NewsAPI.
+    """
+    names = entry['error']
+    builtin_index = next((i for i, name in enumerate(names)
+                          if isinstance(getattr(builtins, name, None), type) and issubclass(getattr(builtins, name), BaseException)),
+                         len(names))
+    error_class = getattr(builtins, names[builtin_index]) if builtin_index < len(names) else Exception
+    for name in reversed(names[:builtin_index]):
+        error_class = type(name, (error_class,), {})
+    error = error_class(entry['message'])
+    if entry.get('status') is not None:
+        error.status_code = entry['status']
+    if entry.get('code') is not None:
+        error.get_code = lambda code=entry['code']: code
+    return error
+
+class Cassette:
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode  # 'record' o 'replay'
+        self._lock = threading.Lock()
+        self.calls = {}  # clave de la llamada -> [respuesta o error serializado, ...] en orden de llegada
+        self._positions = {}
+        self.recorded_at = build_now(timezone.utc)
+        if mode == 'replay':
+            self._load()
+
+    def call(self, key_parts, function):
+        """
+        Graba function() bajo la clave de key_parts o, en reproducción, devuelve la respuesta
+        grabada (las llamadas repetidas reciben las respuestas en el mismo orden; agotadas, la última).
+        """
+        key = json.dumps(key_parts, default=str, ensure_ascii=False, sort_keys=True)
+        if self.mode == 'replay':
+            return self._replay(key)
+        provider_call = current_provider_call()
+        # El hueco se reserva al empezar: la reproducción sigue el orden de las llamadas, no el de las respuestas
+        with self._lock:
+            slots = self.calls.setdefault(key, [])
+            slots.append(None)
+            position = len(slots) - 1
+        try:
+            response = function()
+        except Exception as e:
+            if provider_call is not None and not provider_call.finish():
+                self._fill(key, position, ABANDONED_CALL_ENTRY)
+            else:
+                self._fill(key, position, {
+                    'error': [cls.__name__ for cls in type(e).__mro__ if cls not in (BaseException, object)],
+                    'message': str(e), 'status': provider_error_status(e), 'code': _newsapi_error_code(e)})
+            raise
+        if provider_call is not None and not provider_call.finish():
+            # call_provider ya la abandonó por tiempo: la construcción grabada no usó esta respuesta
+            self._fill(key, position, ABANDONED_CALL_ENTRY)
+        else:
+            self._fill(key, position, {'response': response})
+        return response
+
+    def _fill(self, key, position, entry):
+        data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)  # Copia del momento de la respuesta
+        with self._lock:
+            self.calls[key][position] = data
+
+    def _replay(self, key):
+        with self._lock:
+            entries = self.calls.get(key)
+            if not entries:
+                raise CassetteMiss(f"El casete {self.path} no tiene respuesta para {key[:300]}")
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            data = entries[min(position, len(entries) - 1)]
+        entry = pickle.loads(data)
+        if 'error' in entry:
+            raise recorded_error(entry)
+        return entry['response']
+
+    def save(self):
+        # Las llamadas que siguen en curso al guardar no llegaron a usarse: se graban como abandonadas
+        abandoned = pickle.dumps(ABANDONED_CALL_ENTRY, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            calls = {key: [data if data is not None else abandoned for data in entries] for key, entries in self.calls.items()}
+        manifest = {'version': CASSETTE_FORMAT_VERSION, 'recorded_at': self.recorded_at.isoformat(), 'calls': []}
+        temporary_path = f'{self.path}.tmp'
+        with zipfile.ZipFile(temporary_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            written = 0
+            for key, entries in calls.items():
+                members = [f'responses/{written + i}.pkl' for i in range(len(entries))]
+                for member, data in zip(members, entries):
+                    archive.writestr(member, data)
+                written += len(entries)
+                manifest['calls'].append({'key': key, 'responses': members})
+            archive.writestr('cassette.json', json.dumps(manifest, ensure_ascii=False, indent=1))
+        os.replace(temporary_path, self.path)
+        total = sum(len(entries) for entries in calls.values())
+        print(f"Casete guardado en {self.path}: {total} respuestas de {len(calls)} llamadas distintas "
+              f"({os.path.getsize(self.path) / 1024:.0f} KB).")
+
+    def _load(self):
+        with zipfile.ZipFile(self.path) as archive:
+            manifest = json.loads(archive.read('cassette.json'))
+            if manifest['version'] != CASSETTE_FORMAT_VERSION:
+                raise ValueError(f"Versión de casete no soportada: {manifest['version']}")
+            for call in manifest['calls']:
+                self.calls[call['key']] = [archive.read(member) for member in call['responses']]
+        self.recorded_at = datetime.fromisoformat(manifest['recorded_at'])
+
+class _CassetteTicker:
+    def __init__(self, cassette, ticker, real_yf):
+        self._cassette = cassette
+        self._ticker = ticker
+        self._stock = real_yf.Ticker(ticker) if real_yf is not None else None
+
+    def _attribute(self, name):
+        return self._cassette.call(['yahoo', name, self._ticker], lambda: getattr(self._stock, name))
+
+    info = property(lambda self: self._attribute('info'))
+    financials = property(lambda self: self._attribute('financials'))
+    cashflow = property(lambda self: self._attribute('cashflow'))
+    news = property(lambda self: self._attribute('news'))
+
+    def history(self, **kwargs):
+        return self._cassette.call(['yahoo', 'history', self._ticker, kwargs], lambda: self._stock.history(**kwargs))
+
+class CassetteYahoo:
+    """Sustituye a yfinance (yf.download y yf.Ticker) grabando o reproduciendo sus respuestas."""
+    def __init__(self, cassette, real_yf=None):
+        self._cassette = cassette
+        self._real = real_yf
+
+    def download(self, tickers, **kwargs):
+        return self._cassette.call(['yahoo', 'download', list(tickers), kwargs],
+                                   lambda: self._real.download(tickers, **kwargs))
+
+    def Ticker(self, ticker):
+        return _CassetteTicker(self._cassette, ticker, self._real)
+
+class CassetteNewsApi:
+    def __init__(self, cassette, real_client=None):
+        self._cassette = cassette
+        self._real = real_client
+
+    def get_everything(self, **params):
+        return self._cassette.call(['newsapi', 'get_everything', params], lambda: self._real.get_everything(**params))
+
+class _CassetteModel:
+    def __init__(self, cassette, real_genai, model_name, options):
+        self._cassette = cassette
+        self._key = ['gemini', 'generate_content', model_name, options]
+        self._model = real_genai.GenerativeModel(model_name, **options) if real_genai is not None else None
+
+    def generate_content(self, prompt):
+        return self._cassette.call(self._key + [prompt],
+                                   lambda: RecordedResponse(self._model.generate_content(prompt).text))
+
+class CassetteGemini:
+    def __init__(self, cassette, real_genai=None):
+        self._cassette = cassette
+        self._real = real_genai
+
+    def GenerativeModel(self, model_name, **options):
+        return _CassetteModel(self._cassette, self._real, model_name, options)
+
+def use_cassette(path, mode):
+    """
+    Sustituye los clientes de Yahoo, NewsAPI y Gemini por los del casete. En 'record' envuelven
+    a los reales (ya configurados); en 'replay' no se importan ni se configuran.
+    Devuelve el Cassette (en 'record' hay que llamar a save() al terminar).
+    """
+    global yf, newsapi, genai, BUILD_CLOCK_OFFSET, PROVIDER_RETRY_BASE_SECONDS
+    cassette = Cassette(path, mode)
+    recording = mode == 'record'
+    yf = CassetteYahoo(cassette, yf if recording else None)
+    newsapi = CassetteNewsApi(cassette, newsapi if recording else None)
+    genai = CassetteGemini(cassette, genai if recording else None)
+    if not recording:
+        BUILD_CLOCK_OFFSET = datetime.now(timezone.utc) - cassette.recorded_at
+        for limiter in PROVIDER_LIMITERS.values():
+            limiter._min_interval = 0.0  # Sin cuotas que respetar: a toda la velocidad local
+        PROVIDER_RETRY_BASE_SECONDS = 0.0  # Los reintentos se repiten igual, pero sin esperas
+        print(f"Reproduciendo {sum(len(entries) for entries in cassette.calls.values())} respuestas grabadas "
+              f"el {cassette.recorded_at.isoformat(timespec='seconds')} desde {path}.")
+    return cassette
+
+class _ProviderCall:
+    """
+    Estado de una llamada de call_provider compartido con el hilo que la ejecuta: decide de
+    forma atómica si la llamada terminó a tiempo o fue abandonada (lo consulta el casete).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._finished = False
+        self._abandoned = False
+
+    def finish(self):
+        """Marca la llamada como terminada; False si call_provider ya la había abandonado."""
+        with self._lock:
+            if self._abandoned:
+                return False
+            self._finished = True
+            return True
+
+    def abandon(self):
+        """Marca la llamada como abandonada; False si ya había terminado."""
+        with self._lock:
+            if self._finished:
+                return False
+            self._abandoned = True
+            return True
+
+_provider_call_context = threading.local()
+
+def current_provider_call():
+    return getattr(_provider_call_context, 'call', None)
+
+def _run_provider_call(provider_call, function, args, kwargs):
+    _provider_call_context.call = provider_call
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _provider_call_context.call = None
+        provider_call.finish()
+
+def call_provider(provider, stage, function, *args, **kwargs):
+    """
+    Ejecuta function(*args, **kwargs) contra el proveedor con su limitador de ritmo, su tiempo
+    máximo, reintentos con jitter y su cortacircuitos. Lanza ProviderUnavailable si el
+    cortacircuitos está abierto y la última excepción si se agotan los reintentos.
+    """
+    breaker = PROVIDER_BREAKERS[provider]
+    for attempt in range(PROVIDER_MAX_RETRIES + 1):
+        try:
+            breaker.check()
+        except ProviderUnavailable:
+            count_metric(stage, circuit_open=1)
+            raise
+        try:
+            limiter = PROVIDER_LIMITERS[provider]
+            limiter.acquire()
+            provider_call = _ProviderCall()
+            try:
+                future = _provider_call_pool.submit(_run_provider_call, provider_call, function, args, kwargs)
+            except BaseException:
+                limiter.release()
+                raise
+            # El hueco se libera cuando la llamada termina de verdad, no al abandonarla por tiempo
+            future.add_done_callback(lambda _: limiter.release())
+            with timed_stage(stage):
+                try:
+                    return future.result(timeout=PROVIDER_TIMEOUTS[provider] or None)
+                except TimeoutError:
+                    if not provider_call.abandon():
+                        return future.result()  # Terminó justo al agotarse el plazo
+                    count_metric(stage, timeouts=1)
+                    raise TimeoutError(f"{provider} no respondió en {PROVIDER_TIMEOUTS[provider]:g} s")
+        except Exception as e:
+            if is_fatal_provider_error(e):
+                breaker.trip(e)
+                raise
+            if attempt >= PROVIDER_MAX_RETRIES or not is_transient_provider_error(e):
+                raise
+            delay = PROVIDER_RETRY_BASE_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+            print(f"DEBUG: Error transitorio de {provider} ({e}); reintento {attempt + 1} en {delay:.1f} s.")
+            count_metric(stage, retries=1)
+            time.sleep(delay)
+
+
+# --- Valores ausentes (None o NaN) sin importar pandas, para poder renderizar sin él ---
+def is_missing(value):
+    if value is None:
+        return True
+    try:
+        return bool(value != value)  # NaN es el único valor distinto de sí mismo
+    except TypeError:
+        return True  # pd.NA
 
 # --- Función para formatear valores financieros ---
 def format_financial_value(value):
-    if value is None or pd.isna(value):
+    if is_missing(value):
         return "N/A"
     if abs(value) >= 1_000_000_000:
         return f"${value / 1_000_000_000:,.2f}B"
@@ -47,398 +725,1786 @@ def format_financial_value(value):
     else:
         return f"${value:,.2f}"
 
+# --- Motor de gráficos (API orientada a objetos de Matplotlib con backend Agg) ---
+# Las figuras se crean y se estilizan una sola vez por hilo/proceso y se reutilizan:
+# en cada gráfico solo se actualizan los datos, el título y los límites de los ejes.
+# Además, cada PNG se registra en el manifiesto de construcción con el hash de sus
+# datos de entrada y no se vuelve a renderizar si el archivo existe y el hash no cambió.
+CHART_STYLE_VERSION = 1  # Incrementar al cambiar el estilo para invalidar los PNG guardados
+_chart_templates = threading.local()
+
+def _style_chart_axes(fig, ax, y_label, xlabel):
+    fig.set_facecolor('#FFFFFF')
+    ax.set_facecolor('#F9F9F9')
+    ax.set_xlabel(xlabel, color='#555555')
+    ax.set_ylabel(y_label, color='#555555')
+    ax.tick_params(axis='x', labelrotation=45, colors='#555555')
+    ax.tick_params(axis='y', colors='#555555')
+    # Márgenes fijos en lugar de tight_layout() en cada guardado
+    fig.subplots_adjust(left=0.1, right=0.97, top=0.92, bottom=0.2)
+
+def _get_price_chart_template(y_label):
+    templates = getattr(_chart_templates, 'price', None)
+    if templates is None:
+        templates = _chart_templates.price = {}
+    if y_label not in templates:
+        fig = mpl_figure.Figure(figsize=(10, 6))
+        mpl_backend_agg.FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        _style_chart_axes(fig, ax, y_label, 'Fecha')
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.xaxis_date()
+        ax.yaxis.set_major_formatter(mpl_ticker.FuncFormatter(lambda x, p: f'${x:,.0f}'))
+        line, = ax.plot([], [], color='#4CAF50')
+        templates[y_label] = (fig, ax, line)
+    return templates[y_label]
+
+def _get_financial_chart_template():
+    template = getattr(_chart_templates, 'financial', None)
+    if template is None:
+        fig = mpl_figure.Figure(figsize=(10, 6))
+        mpl_backend_agg.FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        _style_chart_axes(fig, ax, 'Valor ($)', 'Año')
+        ax.grid(axis='y', linestyle='--', alpha=0.7)
+        ax.set_axisbelow(True)
+        ax.yaxis.set_major_formatter(mpl_ticker.FuncFormatter(lambda x, p: format_financial_value(x)))
+        template = _chart_templates.financial = (fig, ax)
+    return template
+
+def _align_xticklabels_right(ax):
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment('right')
+
+def chart_input_hash(*parts):
+    """Hash de los datos de entrada de un gráfico (PriceSeries, Series/DataFrames de pandas o valores simples)."""
+    digest = hashlib.sha256(f"v{CHART_STYLE_VERSION}".encode('utf-8'))
+    for part in parts:
+        if isinstance(part, PriceSeries):
+            digest.update(np.ascontiguousarray(part.days).tobytes())
+            digest.update(np.ascontiguousarray(part.close).tobytes())
+        elif isinstance(part, (pd.Series, pd.DataFrame)):
+            digest.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+            digest.update(repr(list(part.columns) if isinstance(part, pd.DataFrame) else part.name).encode('utf-8'))
+        else:
+            digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+# --- Manifiesto de construcción incremental ---
+# Registra, para cada artefacto de 'public/' (PNG, CSS, HTML) y para los datos de cada
+# ticker, el hash de las entradas con las que se generó. Un artefacto solo se regenera
+# y se escribe si su hash cambió o el archivo no existe, de modo que los archivos sin
+# cambios conservan su fecha de modificación y el despliegue sube solo la diferencia.
+BUILD_MANIFEST_PATH = os.path.join(DATA_DIR, 'build_manifest.sqlite')
+
+def _open_build_manifest(path=BUILD_MANIFEST_PATH):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS artifacts (path TEXT PRIMARY KEY, input_hash TEXT NOT NULL)")
+    return conn
+
+def get_artifact_hash(path):
+    conn = _open_build_manifest()
+    try:
+        row = conn.execute("SELECT input_hash FROM artifacts WHERE path = ?", (path,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def artifact_is_unchanged(path, input_hash, check_file=True):
+    """True si el artefacto ya existe y se generó con exactamente las mismas entradas."""
+    if check_file and not os.path.exists(path):
+        return False
+    return get_artifact_hash(path) == input_hash
+
+def record_artifact_hash(path, input_hash):
+    conn = _open_build_manifest()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?)", (path, input_hash))
+    finally:
+        conn.close()
+
+def _json_default(value):
+    # Registros (dataclasses como CompanyRecord) como dict; el resto como texto
+    if hasattr(value, '__dataclass_fields__'):
+        return asdict(value)
+    return str(value)
+
+def build_input_hash(*parts):
+    """Hash estable de datos serializables en JSON (dicts, listas, textos, números y registros)."""
+    payload = json.dumps(parts, sort_keys=True, default=_json_default, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def write_if_changed(path, content):
+    """Escribe el archivo (texto o bytes) solo si su contenido cambió; devuelve True si se escribió."""
+    encoded = content.encode('utf-8') if isinstance(content, str) else content
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == encoded:
+                return False
+    with open(path, 'wb') as f:
+        f.write(encoded)
+    return True
+
+# --- Formatos de salida de los gráficos ---
+# CHART_FORMATS lista los formatos a generar en orden de preferencia; el último es el
+# que usa <img> y los anteriores se ofrecen como <source> dentro de <picture>.
+# Ej.: CHART_FORMATS=webp,png genera ambos y el navegador elige WebP si lo soporta.
+SUPPORTED_CHART_FORMATS = ('png', 'webp', 'svg')
+# CHART_MODE=client no genera imágenes: escribe los precios de cada ticker en public/data/
+# y los gráficos se dibujan en el navegador con public/js/charts.js
+CHART_MODES = ('images', 'client')
+CHART_MODE = os.environ.get('CHART_MODE', 'images')
+CHART_MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+CHART_FORMATS = [fmt.strip() for fmt in os.environ.get('CHART_FORMATS', 'png').split(',') if fmt.strip()]
+
+def save_chart_figure(fig, chart_name, input_hash, formats=None, force=False):
+    """Guarda la figura en cada formato cuyo archivo falte o tenga otro hash de entrada."""
+    for fmt in formats or CHART_FORMATS:
+        output_path = f'public/img/{chart_name}.{fmt}'
+        if not force and artifact_is_unchanged(output_path, input_hash):
+            continue
+        if fmt == 'svg':
+            # Texto como <text> en lugar de trazos y sin fecha ni ids aleatorios: SVG compacto y reproducible
+            with matplotlib.rc_context({'svg.fonttype': 'none', 'svg.hashsalt': chart_name}):
+                fig.savefig(output_path, format='svg', metadata={'Date': None})
+        elif fmt == 'webp':
+            fig.savefig(output_path, format='webp', pil_kwargs={'quality': 85, 'method': 6})
+        else:
+            fig.savefig(output_path, format=fmt)
+        record_artifact_hash(output_path, input_hash)
+
+# --- Decimación de series (Largest-Triangle-Three-Buckets) ---
+def lttb_downsample(x, y, threshold):
+    """
+    Reduce la serie (x, y) a 'threshold' puntos conservando su forma: en cada tramo se
+    elige el punto que forma el triángulo de mayor área con el punto elegido en el tramo
+    anterior y el promedio del tramo siguiente. Devuelve las series sin cambios si ya
+    tienen 'threshold' puntos o menos.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    # threshold - 2 tramos entre el primer y el último punto (que siempre se conservan)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+def _axes_pixel_width(fig, ax):
+    return int(fig.get_figwidth() * fig.dpi * ax.get_position().width)
+
 # --- Función para generar gráficos ---
-def generate_chart(data, title, filename, y_label='Precio de Cierre', period='1y'):
+def generate_chart(data, title, chart_name, y_label='Precio de Cierre', period='1y', force=False, formats=None):
+    """
+    data: PriceSeries con los cierres a dibujar.
+    chart_name: nombre del archivo sin extensión; se genera public/img/<chart_name>.<formato>
+                para cada formato de 'formats' (por defecto CHART_FORMATS).
+    """
     if data is None or data.empty:
         print(f"No hay datos para generar el gráfico: {title}")
         return False
 
-    plt.figure(figsize=(10, 6))
-    plt.plot(data.index, data['Close'], color='#4CAF50')
-    plt.title(title, color='#333333', fontsize=16)
-    plt.xlabel('Fecha', color='#555555')
-    plt.ylabel(y_label, color='#555555')
-    plt.grid(True, linestyle='--', alpha=0.7)
+    input_hash = chart_input_hash(data, title, y_label)
+    if not force and all(
+        artifact_is_unchanged(f'public/img/{chart_name}.{fmt}', input_hash) for fmt in formats or CHART_FORMATS
+    ):
+        count_metric('charts', cache_hits=1)
+        return True
+    count_metric('charts', cache_misses=1)
+
+    fig, ax, line = _get_price_chart_template(y_label)
+    # No tiene sentido dibujar más puntos que píxeles tiene el eje X
+    x, y = lttb_downsample(mdates.date2num(data.days.astype('datetime64[D]')), data.close.astype(float),
+                           _axes_pixel_width(fig, ax))
+    line.set_data(x, y)
+    ax.set_title(title, color='#333333', fontsize=16)
+    ax.relim()
+    ax.autoscale_view()
+    _align_xticklabels_right(ax)
+
+    save_chart_figure(fig, chart_name, input_hash, formats, force)
+    return True
 
-    plt.gca().set_facecolor('#F9F9F9')
-    plt.gcf().set_facecolor('#FFFFFF')
+# --- Carga de precios: una sola descarga en bloque por grupo de tickers ---
+# Desplazamientos (argumentos de pd.DateOffset) equivalentes a los períodos de yfinance usados en los gráficos
+PERIOD_OFFSETS = {
+    '6mo': {'months': 6},
+    '1y': {'years': 1},
+    '5y': {'years': 5},
+}
+# Tickers por descarga en bloque y por grupo de procesamiento: la memoria máxima depende de
+# este tamaño y no del número total de tickers
+PRICE_CHUNK_SIZE = int(os.environ.get('PRICE_CHUNK_SIZE', 100))
+
+def chunked(items, size=PRICE_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# --- Historial compacto: solo cierres, float32, con fechas como días int32 ---
+# Del historial el dashboard solo usa el cierre. Cada ticker se representa con dos arrays
+# contiguos, días desde 1970-01-01 (int32) y cierres (float32): 8 bytes por sesión frente a
+# los ~56 de un DataFrame OHLCV en float64 con índice de fechas.
+@dataclass(slots=True)
+class PriceSeries:
+    days: object  # np.ndarray int32, ordenado y sin repetidos
+    close: object  # np.ndarray float32
+
+    @classmethod
+    def from_frame(cls, hist):
+        """Desde un DataFrame con columna 'Close' (o una Series de cierres) con índice de fechas."""
+        close = hist['Close'] if isinstance(hist, pd.DataFrame) else hist
+        close = close.dropna()
+        index = pd.DatetimeIndex(close.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        close = pd.Series(close.to_numpy(dtype=np.float32), index=index.normalize())
+        close = close[~close.index.duplicated(keep='last')].sort_index()
+        return cls(close.index.values.astype('datetime64[D]').astype(np.int32), close.to_numpy(dtype=np.float32))
+
+    @property
+    def empty(self):
+        return len(self.days) == 0
+
+    def __len__(self):
+        return len(self.days)
+
+    def since(self, day):
+        """Copia en memoria de las sesiones desde 'day' (días desde 1970-01-01) inclusive."""
+        start = int(np.searchsorted(self.days, day, side='left'))
+        return PriceSeries(np.array(self.days[start:]), np.array(self.close[start:]))
+
+    def last_close(self):
+        """
+        Precio actual del dashboard: el último cierre (la barra del día se actualiza durante la
+        sesión). Lo usan tanto la construcción completa como la actualización de precios.
+        """
+        return None if self.empty else round(float(self.close[-1]), 4)
+
+    def to_series(self):
+        """Series de pandas (float64, índice de fechas) para las operaciones que la necesitan."""
+        return pd.Series(self.close.astype(float), index=pd.DatetimeIndex(self.days.astype('datetime64[D]')), name='Close')
+
+def download_price_history(tickers, period="max", start=None):
+    """
+    Descarga el historial de precios de todos los tickers en una única petición
+    multi-ticker (yf.download con columnas agrupadas por ticker).
+    Si se indica 'start' (fecha), se descargan solo las barras desde esa fecha.
+    Devuelve un diccionario {ticker: PriceSeries}; la respuesta OHLCV completa solo vive
+    durante esta función. Los tickers sin datos no aparecen en el diccionario,
+    de modo que el llamador puede recurrir a stock.history() para ellos.
+    """
+    histories = {}
+    if not tickers:
+        return histories
 
-    formatter = FuncFormatter(lambda x, p: f'${x:,.0f}')
-    plt.gca().yaxis.set_major_formatter(formatter)
+    try:
+        with PROVIDER_LIMITERS['yahoo'], timed_stage('yahoo_prices'):
+            data = yf.download(
+                tickers,
+                period=None if start else period,
+                start=start,
+                group_by='ticker',
+                auto_adjust=True,  # Igual que stock.history()
+                actions=False,
+                threads=True,
+                progress=False
+            )
+    except Exception as e:
+        print(f"Error en la descarga en bloque de precios: {e}")
+        return histories
 
-    plt.xticks(rotation=45, ha='right', color='#555555')
-    plt.yticks(color='#555555')
+    if data is None or data.empty:
+        print("La descarga en bloque de precios no devolvió datos.")
+        return histories
+    count_metric('yahoo_prices', bytes=payload_size(data))
 
-    plt.tight_layout()
-    plt.savefig(f'public/img/{filename}')
-    plt.close()
-    return True
+    for ticker in tickers:
+        try:
+            if isinstance(data.columns, pd.MultiIndex):
+                close = data[(ticker, 'Close')]
+            else:
+                close = data['Close']  # Un solo ticker: yfinance puede devolver columnas planas
+        except KeyError:
+            continue
+        series = PriceSeries.from_frame(close)
+        if not series.empty:
+            histories[ticker] = series
+
+    print(f"Historial de precios descargado en bloque para {len(histories)}/{len(tickers)} tickers.")
+    return histories
 
-# --- NUEVA FUNCIÓN: Obtener precio promedio en un rango de fechas ---
-def get_average_price_around_date(historical_data, target_date, days_window=5):
+def slice_history(hist, period):
     """
-    Obtiene el precio promedio de cierre de los días hábiles
-    en un rango alrededor de una fecha objetivo.
-    historical_data: DataFrame de Yahoo Finance con índice de fecha y columna 'Close'.
-    target_date: Objeto datetime.date o pandas.Timestamp para la fecha central.
-    days_window: Número de días calendario a cada lado de la fecha objetivo
-                 para formar la ventana de búsqueda.
+    Recorta en memoria un historial completo al período indicado ('6mo', '1y', '5y'),
+    equivalente a stock.history(period=...) pero sin volver a consultar Yahoo.
     """
-    if historical_data.empty:
+    if hist is None or hist.empty:
+        return hist
+    start = pd.Timestamp(build_now().date()) - pd.DateOffset(**PERIOD_OFFSETS[period])
+    return hist.since(np.datetime64(start.date(), 'D').astype(np.int64))
+
+
+# --- Almacén persistente de historial de precios (arrays en disco con mmap) ---
+# Por ticker, PRICE_STORE_DIR/<ticker>.days.npy y <ticker>.close.npy. Se abren con
+# np.load(mmap_mode='r'): el sistema solo carga las páginas que se leen y puede descartarlas,
+# y cada serie se abre al pedirla (PriceHistories) en lugar de tenerlas todas en memoria.
+PRICE_STORE_DIR = os.path.join(DATA_DIR, 'price_arrays')
+# Días hábiles que se vuelven a pedir en cada actualización para detectar
+# splits o dividendos que reescriben el historial ajustado
+PRICE_OVERLAP_DAYS = 10
+# Diferencia relativa máxima aceptada entre el cierre guardado y el nuevo
+PRICE_RESTATEMENT_TOLERANCE = 1e-4
+
+def _price_array_paths(ticker, directory=PRICE_STORE_DIR):
+    return os.path.join(directory, f'{ticker}.days.npy'), os.path.join(directory, f'{ticker}.close.npy')
+
+def read_price_series(ticker, directory=PRICE_STORE_DIR):
+    """PriceSeries del ticker con los arrays mapeados en memoria (solo lectura), o None si no está guardado."""
+    days_path, close_path = _price_array_paths(ticker, directory)
+    if not (os.path.exists(days_path) and os.path.exists(close_path)):
         return None
+    days, close = np.load(days_path, mmap_mode='r'), np.load(close_path, mmap_mode='r')
+    if len(days) != len(close):
+        return None  # Escritura interrumpida entre los dos archivos: se vuelve a descargar
+    return PriceSeries(days, close)
+
+def write_price_series(ticker, series, directory=PRICE_STORE_DIR):
+    """Reemplaza de forma atómica los arrays del ticker (las series ya abiertas siguen siendo válidas)."""
+    os.makedirs(directory, exist_ok=True)
+    for path, values in zip(_price_array_paths(ticker, directory),
+                            (np.asarray(series.days, dtype='<i4'), np.asarray(series.close, dtype='<f4'))):
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as f:
+            np.save(f, values)
+        os.replace(temporary, path)
+
+def merge_price_series(stored, fresh):
+    """Historial guardado hasta el primer día de 'fresh' seguido de 'fresh'."""
+    keep = int(np.searchsorted(stored.days, fresh.days[0], side='left'))
+    return PriceSeries(np.concatenate([stored.days[:keep], fresh.days]), np.concatenate([stored.close[:keep], fresh.close]))
+
+def _history_was_restated(stored, fresh):
+    """
+    True si los cierres de la ventana de solape no coinciden (split o dividendo ajustado).
+    La última barra guardada no se compara: si se guardó durante la sesión es un precio
+    intradía que cambia hasta el cierre, y merge_price_series la sustituye por la de 'fresh'.
+    """
+    common_days, stored_positions, fresh_positions = np.intersect1d(stored.days, fresh.days, assume_unique=True,
+                                                                   return_indices=True)
+    if len(stored_positions) == 0:
+        return True
+    settled = common_days < stored.days[-1]
+    stored_positions, fresh_positions = stored_positions[settled], fresh_positions[settled]
+    old = stored.close[stored_positions].astype(float)
+    new = fresh.close[fresh_positions].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        relative_diff = np.abs(old - new) / np.abs(old)
+    relative_diff = relative_diff[np.isfinite(relative_diff)]
+    return bool(len(relative_diff) and relative_diff.max() > PRICE_RESTATEMENT_TOLERANCE)
+
+class PriceHistories:
+    """
+    {ticker: PriceSeries} del almacén que abre cada serie al pedirla y no la retiene:
+    la memoria de los historiales queda acotada por los tickers en proceso en cada momento.
+    """
+    def __init__(self, tickers, directory=PRICE_STORE_DIR):
+        self.directory = directory
+        self.tickers = [ticker for ticker in tickers if all(os.path.exists(p) for p in _price_array_paths(ticker, directory))]
+        self._available = set(self.tickers)
+
+    def get(self, ticker, default=None):
+        if ticker not in self._available:
+            return default
+        series = read_price_series(ticker, self.directory)
+        return default if series is None or series.empty else series
+
+    def __contains__(self, ticker):
+        return ticker in self._available
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def items(self):
+        for ticker in self.tickers:
+            series = self.get(ticker)
+            if series is not None:
+                yield ticker, series
+
+def load_price_history(tickers, directory=PRICE_STORE_DIR):
+    """
+    Actualiza el almacén y devuelve un PriceHistories con los tickers disponibles.
+    Solo se descargan las barras posteriores a la última fecha guardada (más una
+    ventana de solape); si el solape revela un historial reajustado, o el ticker
+    no estaba guardado, se vuelve a descargar su historial "max" completo.
+    Las descargas se hacen en bloques de PRICE_CHUNK_SIZE tickers con el mismo último día guardado.
+    """
+    os.makedirs(directory, exist_ok=True)
+    last_days = {}
+    for ticker in tickers:
+        stored = read_price_series(ticker, directory)
+        if stored is not None and not stored.empty:
+            last_days[ticker] = int(stored.days[-1])
+    to_update = [ticker for ticker in tickers if ticker in last_days]
+    to_full_download = [ticker for ticker in tickers if ticker not in last_days]
+    count_metric('price_store', cache_hits=len(to_update), cache_misses=len(to_full_download))
+
+    # Los tickers se agrupan por su último día guardado: uno desactualizado (deslistado o con
+    # descargas fallidas) no arrastra al resto de su bloque a una descarga de varios años
+    by_last_day = {}
+    for ticker in to_update:
+        by_last_day.setdefault(last_days[ticker], []).append(ticker)
+    incremental_chunks = [(last_day, chunk) for last_day, group in sorted(by_last_day.items()) for chunk in chunked(group)]
+
+    for last_day, chunk in incremental_chunks:
+        # Una sola petición incremental por bloque desde el último día guardado de sus tickers
+        start = pd.Timestamp(np.datetime64(last_day, 'D')) - pd.tseries.offsets.BDay(PRICE_OVERLAP_DAYS)
+        fresh_data = download_price_history(chunk, start=start.strftime('%Y-%m-%d'))
+        for ticker, fresh in fresh_data.items():
+            stored = read_price_series(ticker, directory)
+            if _history_was_restated(stored, fresh):
+                print(f"Historial reajustado detectado para {ticker}; se descargará completo.")
+                to_full_download.append(ticker)
+                continue
+            write_price_series(ticker, merge_price_series(stored, fresh), directory)
+
+    for chunk in chunked(to_full_download):
+        for ticker, series in download_price_history(chunk).items():
+            write_price_series(ticker, series, directory)
+
+    return PriceHistories(tickers, directory)
+
+
+# --- Cache de estados financieros (fundamentales) por ticker ---
+# Operating Income, Net Income y EBITDA anuales solo cambian cuando la empresa publica
+# resultados. Se guardan con su fecha de descarga y se vuelven a pedir a Yahoo solo si
+# desde entonces pasó una fecha de resultados (más unos días de margen para que Yahoo los
+# publique) o cuando superan FUNDAMENTALS_MAX_AGE_DAYS. Se comprueba tanto la fecha que
+# informa 'info' ahora como la que informaba al descargarlos, porque tras publicar
+# resultados Yahoo suele pasar a mostrar directamente la fecha de los siguientes.
+FUNDAMENTALS_CACHE_PATH = os.path.join(DATA_DIR, 'fundamentals_cache.sqlite')
+FUNDAMENTALS_MAX_AGE_DAYS = float(os.environ.get('FUNDAMENTALS_MAX_AGE_DAYS', 90))
+FUNDAMENTALS_EARNINGS_GRACE_DAYS = float(os.environ.get('FUNDAMENTALS_EARNINGS_GRACE_DAYS', 2))
+FINANCIALS_ROWS = ('Operating Income', 'Net Income')
+CASHFLOW_ROWS = ('EBITDA',)
+EARNINGS_INFO_KEYS = ('earningsTimestamp', 'earningsTimestampStart')
+
+def open_fundamentals_cache(path=FUNDAMENTALS_CACHE_PATH):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS fundamentals ("
+        " ticker TEXT PRIMARY KEY, financials TEXT NOT NULL, cashflow TEXT NOT NULL,"
+        " fetched_at REAL NOT NULL, earnings_at REAL)"
+    )
+    return conn
+
+def statement_to_json(statement, rows):
+    """Solo las filas que usa el dashboard: {'columns': [fechas], 'rows': {fila: [valores]}}."""
+    rows = [row for row in rows if row in statement.index]
+    return json.dumps({
+        'columns': [column.isoformat() if hasattr(column, 'isoformat') else str(column) for column in statement.columns],
+        'rows': {row: [None if pd.isna(value) else float(value) for value in statement.loc[row]] for row in rows},
+    })
+
+def statement_from_json(text):
+    data = json.loads(text)
+    if not data['rows']:
+        return pd.DataFrame()
+    return pd.DataFrame(list(data['rows'].values()), index=list(data['rows']),
+                        columns=pd.to_datetime(data['columns']), dtype=float)
+
+def earnings_timestamp(info):
+    """Fecha (epoch) de los últimos o próximos resultados según 'info', o None si no se informa."""
+    for key in EARNINGS_INFO_KEYS:
+        value = info.get(key) if info else None
+        if isinstance(value, (int, float)) and value > 0:
+            return float(value)
+    return None
 
-    # Convertir target_date a datetime si no lo es
-    if isinstance(target_date, pd.Timestamp):
-        target_date = target_date.date()
-    elif isinstance(target_date, datetime):
-        target_date = target_date.date()
+def fundamentals_are_stale(fetched_at, earnings_dates, now=None):
+    now = now or time.time()
+    for earnings_ts in earnings_dates:
+        if earnings_ts is None:
+            continue
+        # Resultados publicados después de la descarga y ya disponibles en Yahoo
+        available_at = earnings_ts + FUNDAMENTALS_EARNINGS_GRACE_DAYS * 86400
+        if fetched_at < available_at <= now:
+            return True
+    return now - fetched_at > FUNDAMENTALS_MAX_AGE_DAYS * 86400
+
+def _fetch_statement(ticker, stock, attribute, stage, description):
+    try:
+        with PROVIDER_LIMITERS['yahoo'], timed_stage(stage):
+            statement = getattr(stock, attribute)
+        count_metric(stage, bytes=payload_size(statement))
+        return statement
+    except Exception as e:
+        print(f"Error al obtener {description} para {ticker}: {e}")
+        return None
 
-    start_search_date = target_date - timedelta(days=days_window)
-    end_search_date = target_date + timedelta(days=days_window)
+def load_fundamentals(ticker, stock, info=None, path=FUNDAMENTALS_CACHE_PATH):
+    """
+    Devuelve (financials, cashflow) del ticker desde la cache o, si están desactualizados,
+    desde Yahoo. Si Yahoo falla se usa la copia guardada aunque esté desactualizada.
+    """
+    conn = open_fundamentals_cache(path)
+    try:
+        current_earnings = earnings_timestamp(info)
+        row = conn.execute("SELECT financials, cashflow, fetched_at, earnings_at FROM fundamentals WHERE ticker = ?", (ticker,)).fetchone()
+        if row is not None and not fundamentals_are_stale(row[2], (current_earnings, row[3])):
+            count_metric('fundamentals', cache_hits=1)
+            return statement_from_json(row[0]), statement_from_json(row[1])
+        count_metric('fundamentals', cache_misses=1)
+
+        financials = _fetch_statement(ticker, stock, 'financials', 'yahoo_financials', 'datos financieros (Operating/Net Income)')
+        cashflow = _fetch_statement(ticker, stock, 'cashflow', 'yahoo_cashflow', 'datos de flujo de caja (EBITDA)')
+        if financials is not None and cashflow is not None:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO fundamentals VALUES (?, ?, ?, ?, ?)", (
+                    ticker, statement_to_json(financials, FINANCIALS_ROWS),
+                    statement_to_json(cashflow, CASHFLOW_ROWS), time.time(), current_earnings))
+        if row is not None:
+            financials = financials if financials is not None else statement_from_json(row[0])
+            cashflow = cashflow if cashflow is not None else statement_from_json(row[1])
+        return (financials if financials is not None else pd.DataFrame(),
+                cashflow if cashflow is not None else pd.DataFrame())
+    finally:
+        conn.close()
+
+def latest_statement_value(statement, row):
+    """Valor más reciente (primera columna) de una fila del estado, o None."""
+    if statement is None or row not in statement.index or statement.loc[row].empty:
+        return None
+    return statement.loc[row].iloc[0]
+
+
+# --- Motor de rentabilidades vectorizado ---
+# Los cierres de todos los tickers se alinean en una matriz (fechas x tickers) y los precios
+# de referencia de cada horizonte se obtienen de una sola vez: el promedio de los cierres en
+# una ventana de días calendario alrededor de la fecha objetivo, calculado con searchsorted
+# sobre las fechas y sumas acumuladas por columna (sin filtrar el DataFrame por cada ticker).
+RETURN_HORIZONS = ['6m', '1y', '5y']  # Horizontes que se muestran en el dashboard (change_<horizonte>)
+ANCHOR_WINDOW_DAYS = 7  # Ventana de 7 días (aprox. 1 semana calendario) a cada lado de la fecha objetivo
+HORIZON_DAYS = {
+    '1m': 30,
+    '3m': 90,
+    '6m': 6*30,   # Aprox. 6 meses calendario
+    '1y': 365,    # Aprox. 1 año calendario
+    '3y': 3*365,
+    '5y': 5*365,  # Aprox. 5 años calendario
+}
+
+def horizon_target_date(horizon, today):
+    """Fecha central del horizonte ('1m', '3m', 'ytd', '6m', '1y', '3y', '5y'); None para 'max'."""
+    if horizon in HORIZON_DAYS:
+        return today - timedelta(days=HORIZON_DAYS[horizon])
+    if horizon == 'ytd':
+        return today.replace(month=1, day=1)
+    if horizon == 'max':
+        return None
+    raise ValueError(f"Horizonte desconocido: {horizon}")
 
-    # Filtrar los datos históricos para el rango de búsqueda
-    # Asegúrate de que el índice sea de tipo datetime
-    if not isinstance(historical_data.index, pd.DatetimeIndex):
-        historical_data.index = pd.to_datetime(historical_data.index)
+def build_close_matrix(price_histories, tickers, since_day=None):
+    """
+    Matriz de cierres alineada por fecha (sin zona horaria), una columna por ticker en el orden dado.
+    since_day: si se indica (días desde 1970-01-01), solo se incluyen las sesiones desde ese día.
+    """
+    closes = {}
+    for ticker in tickers:
+        hist = price_histories.get(ticker)
+        if hist is None or hist.empty:
+            continue
+        closes[ticker] = (hist if since_day is None else hist.since(since_day)).to_series()
+    if not closes:
+        return pd.DataFrame(columns=tickers, index=pd.DatetimeIndex([]), dtype=float)
+    return pd.DataFrame(closes, columns=tickers).sort_index()
+
+def compute_anchor_prices(close_matrix, horizons=RETURN_HORIZONS, days_window=ANCHOR_WINDOW_DAYS, today=None):
+    """
+    Devuelve un DataFrame (tickers x horizontes) con el precio de cierre promedio en la
+    ventana [objetivo - days_window, objetivo + days_window] de cada horizonte, o NaN si
+    no hay cierres en esa ventana. Para 'max' la ventana se centra en el primer cierre de cada ticker.
+    """
+    today = today or build_now().date()
+    tickers = list(close_matrix.columns)
+    values = close_matrix.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    n_dates, n_tickers = values.shape
+
+    # Sumas y conteos acumulados con una fila inicial de ceros: la suma de las filas
+    # [lo, hi) de una columna es cum[hi] - cum[lo]
+    cum_sums = np.zeros((n_dates + 1, n_tickers))
+    cum_counts = np.zeros((n_dates + 1, n_tickers))
+    np.cumsum(np.where(valid, values, 0.0), axis=0, out=cum_sums[1:])
+    np.cumsum(valid, axis=0, out=cum_counts[1:])
+
+    days = close_matrix.index.values.astype('datetime64[D]').astype(np.int64)
+    first_days = days[valid.argmax(axis=0)] if n_dates else np.zeros(n_tickers, dtype=np.int64)
+
+    # Fecha central por horizonte y ticker: matriz (horizontes x tickers)
+    centers = np.empty((len(horizons), n_tickers), dtype=np.int64)
+    for i, horizon in enumerate(horizons):
+        target = horizon_target_date(horizon, today)
+        centers[i] = first_days if target is None else np.datetime64(target, 'D').astype(np.int64)
+
+    lo = np.searchsorted(days, centers - days_window, side='left')
+    hi = np.searchsorted(days, centers + days_window, side='right')
+    columns = np.arange(n_tickers)[np.newaxis, :]
+    window_sums = cum_sums[hi, columns] - cum_sums[lo, columns]
+    window_counts = cum_counts[hi, columns] - cum_counts[lo, columns]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        anchors = np.where(window_counts > 0, window_sums / window_counts, np.nan)
+    return pd.DataFrame(anchors.T, index=tickers, columns=list(horizons))
+
+def compute_percentage_changes(anchor_prices, current_prices):
+    """
+    Variaciones porcentuales (tickers x horizontes) del precio actual respecto a cada precio de
+    referencia. current_prices: Series indexada por ticker. NaN donde falte alguno de los dos o
+    el precio de referencia sea 0.
+    """
+    current = pd.to_numeric(current_prices.reindex(anchor_prices.index), errors='coerce').to_numpy(dtype=float)[:, np.newaxis]
+    anchors = anchor_prices.to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        changes = np.where((anchors != 0) & (current != 0), (current - anchors) / anchors * 100, np.nan)
+    return pd.DataFrame(changes, index=anchor_prices.index, columns=anchor_prices.columns)
+
+
+# --- Analítica de la cartera (matriz de cierres y una pasada vectorizada) ---
+# Volatilidad anualizada, caída máxima, señal de la media móvil de 200 sesiones, beta frente a
+# PORTFOLIO_BENCHMARK y correlaciones de todos los tickers a la vez, más los agregados por
+# sector e industria. Todo se calcula con operaciones por columnas sobre la matriz fechas x
+# tickers; el único bucle por ticker es el que arma la matriz con los últimos ~2 años.
+PORTFOLIO_BENCHMARK = os.environ.get('PORTFOLIO_BENCHMARK', 'SPY')
+TRADING_DAYS_PER_YEAR = 252
+PORTFOLIO_WINDOW_SESSIONS = TRADING_DAYS_PER_YEAR  # Ventana de volatilidad, caída, beta y correlaciones (1 año)
+MOVING_AVERAGE_SESSIONS = 200
+PORTFOLIO_HISTORY_DAYS = 700  # Días naturales de historial: cubren la ventana más la media móvil
+PORTFOLIO_MIN_SESSIONS = 60  # Sesiones mínimas con datos para dar volatilidad, beta o correlación
+PORTFOLIO_HEATMAP_MAX_TICKERS = int(os.environ.get('PORTFOLIO_HEATMAP_MAX_TICKERS', 40))
+PORTFOLIO_PAGE = 'cartera.html'
+
+def _paired_beta(returns, benchmark_returns, min_sessions=PORTFOLIO_MIN_SESSIONS):
+    """Beta de cada columna de 'returns' (sesiones x tickers) usando solo las sesiones con ambos datos."""
+    returns = returns.reshape(len(returns), -1)
+    mask = ~np.isnan(returns) & ~np.isnan(benchmark_returns)[:, np.newaxis]
+    r = np.where(mask, returns, 0.0)
+    b = np.where(mask, benchmark_returns[:, np.newaxis], 0.0)
+    n = mask.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_r, mean_b = r.sum(axis=0) / n, b.sum(axis=0) / n
+        covariance = (r * b).sum(axis=0) / n - mean_r * mean_b
+        variance = (b * b).sum(axis=0) / n - mean_b * mean_b
+        beta = covariance / variance
+    return np.where(n >= min_sessions, beta, np.nan)
+
+def _window_statistics(prices, benchmark_returns):
+    """Volatilidad anualizada (%), caída máxima (%) y beta de cada columna de 'prices' (sesiones x columnas)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = prices[1:] / prices[:-1] - 1
+        present = ~np.isnan(returns)
+        n = present.sum(axis=0)
+        mean = np.where(present, returns, 0.0).sum(axis=0) / n
+        variance = np.where(present, (returns - mean) ** 2, 0.0).sum(axis=0) / (n - 1)
+        volatility = np.where(n >= PORTFOLIO_MIN_SESSIONS, np.sqrt(variance * TRADING_DAYS_PER_YEAR) * 100, np.nan)
+        drawdowns = prices / np.fmax.accumulate(prices, axis=0) - 1
+        max_drawdown = np.where(np.isnan(drawdowns), np.inf, drawdowns).min(axis=0, initial=np.inf)
+        max_drawdown = np.where(np.isinf(max_drawdown), np.nan, max_drawdown * 100)
+    beta = _paired_beta(returns, benchmark_returns) if benchmark_returns is not None else np.full(prices.shape[1], np.nan)
+    return returns, volatility, max_drawdown, beta
+
+def _group_correlation(correlation, labels):
+    """Correlación media entre los tickers de cada par de grupos (sin contar la de cada ticker consigo mismo)."""
+    groups = list(dict.fromkeys(labels))
+    membership = (np.array(labels)[:, np.newaxis] == np.array(groups)[np.newaxis, :]).astype(float)
+    valid = ~np.isnan(correlation)
+    np.fill_diagonal(valid, False)
+    sums = membership.T @ np.where(valid, correlation, 0.0) @ membership
+    counts = membership.T @ valid.astype(float) @ membership
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return groups, sums / counts
+
+def _aggregate_by(frame, column):
+    grouped = frame.groupby(column, sort=True)
+    aggregates = grouped.agg(count=('ticker', 'size'), change_1y=('change_1y', 'mean'), volatility=('volatility', 'mean'),
+                             max_drawdown=('max_drawdown', 'mean'), beta=('beta', 'mean'), above_ma200=('above_ma200', 'mean'))
+    aggregates['above_ma200'] *= 100
+    return [{'name': name, 'count': int(row['count']),
+             **{key: _optional_float(row[key]) for key in ('change_1y', 'volatility', 'max_drawdown', 'beta', 'above_ma200')}}
+            for name, row in aggregates.iterrows()]
+
+def load_benchmark_series(benchmark=PORTFOLIO_BENCHMARK):
+    """Historial del índice de referencia para las betas (None si no se pudo obtener)."""
+    if not benchmark:
+        return None
+    try:
+        return load_price_history([benchmark]).get(benchmark)
+    except Exception as e:
+        print(f"No se pudo obtener el historial del índice de referencia {benchmark}: {e}")
+        return None
 
-    window_data = historical_data.loc[str(start_search_date):str(end_search_date), 'Close']
+def compute_portfolio_analytics(price_histories, companies, benchmark_series=None, today=None):
+    """
+    Analítica de la cartera formada por 'companies' (CompanyRecord) como dict serializable en
+    JSON, o None si ningún ticker tiene historial.
+    """
+    today = today or build_now().date()
+    since_day = int(np.datetime64(today - timedelta(days=PORTFOLIO_HISTORY_DAYS), 'D').astype(np.int64))
+    tickers = [record.ticker for record in companies]
+    close_matrix = build_close_matrix(price_histories, tickers, since_day=since_day)
+    if close_matrix.empty or close_matrix.notna().sum().sum() == 0:
+        return None
+    # Mercados con distintos festivos: se arrastra el último cierre de cada ticker
+    prices = close_matrix.ffill().to_numpy(dtype=float)
+    window = prices[-(PORTFOLIO_WINDOW_SESSIONS + 1):]
+
+    benchmark_returns = None
+    if benchmark_series is not None and not benchmark_series.empty:
+        benchmark = build_close_matrix({'benchmark': benchmark_series}, ['benchmark'], since_day=since_day)['benchmark']
+        benchmark = benchmark.reindex(close_matrix.index).ffill().to_numpy(dtype=float)[-(PORTFOLIO_WINDOW_SESSIONS + 1):]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            benchmark_returns = benchmark[1:] / benchmark[:-1] - 1
+
+    returns, volatility, max_drawdown, beta = _window_statistics(window, benchmark_returns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        moving_average = close_matrix.ffill().rolling(MOVING_AVERAGE_SESSIONS, min_periods=MOVING_AVERAGE_SESSIONS).mean().to_numpy()[-1]
+        ma200_gap = (prices[-1] / moving_average - 1) * 100
+
+    # Cartera con pesos iguales (rebalanceo diario): media de los rendimientos de cada sesión
+    with np.errstate(invalid='ignore'):
+        portfolio_returns = np.nanmean(np.where(np.isnan(returns).all(axis=1, keepdims=True), 0.0, returns), axis=1)
+    portfolio_index = np.concatenate([[1.0], np.cumprod(1 + portfolio_returns)])[:, np.newaxis]
+    _, portfolio_volatility, portfolio_drawdown, portfolio_beta = _window_statistics(portfolio_index, benchmark_returns)
+
+    frame = pd.DataFrame({
+        'ticker': tickers,
+        'name': [record.name for record in companies],
+        'sector': [record.sector or 'N/A' for record in companies],
+        'industry': [record.industry or 'N/A' for record in companies],
+        'change_1y': [record.changes.get('1y') for record in companies],
+        'volatility': volatility, 'max_drawdown': max_drawdown, 'beta': beta, 'ma200_gap': ma200_gap,
+    })
+    frame['change_1y'] = pd.to_numeric(frame['change_1y'], errors='coerce')
+    frame['above_ma200'] = np.where(np.isnan(ma200_gap), np.nan, (ma200_gap > 0).astype(float))
+
+    correlation = pd.DataFrame(returns).corr(min_periods=PORTFOLIO_MIN_SESSIONS).to_numpy()
+    if len(tickers) <= PORTFOLIO_HEATMAP_MAX_TICKERS:
+        heatmap = {'level': 'ticker', 'labels': tickers, 'values': correlation}
+    else:
+        labels, values = _group_correlation(correlation, list(frame['sector']))
+        heatmap = {'level': 'sector', 'labels': labels, 'values': values}
+    heatmap['values'] = [[_optional_float(value) for value in row] for row in heatmap['values']]
+
+    return {
+        'as_of': str(close_matrix.index[-1].date()),
+        'benchmark': PORTFOLIO_BENCHMARK if benchmark_returns is not None else None,
+        'window_sessions': len(window) - 1,
+        'portfolio': {
+            'volatility': _optional_float(portfolio_volatility[0]),
+            'max_drawdown': _optional_float(portfolio_drawdown[0]),
+            'beta': _optional_float(portfolio_beta[0]),
+            'above_ma200': _optional_float(np.nanmean(frame['above_ma200']) * 100) if frame['above_ma200'].notna().any() else None,
+        },
+        'tickers': [{key: (_optional_float(row[key]) if key not in ('ticker', 'name', 'sector', 'industry') else row[key])
+                     for key in ('ticker', 'name', 'sector', 'industry', 'volatility', 'max_drawdown', 'beta', 'ma200_gap')}
+                    for row in frame.to_dict('records')],
+        'sectors': _aggregate_by(frame, 'sector'),
+        'industries': _aggregate_by(frame, 'industry'),
+        'correlation': heatmap,
+    }
 
-    if not window_data.empty:
-        return window_data.mean()
-    return None
 
+# --- Cache de resúmenes de Gemini direccionada por contenido ---
+# La clave es el hash del prompt exacto (titulares, enlaces e información financiera),
+# de modo que si nada cambió entre dos ejecuciones se reutiliza el resumen sin llamar a Gemini
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+SUMMARY_CACHE_PATH = os.path.join(DATA_DIR, 'summary_cache.sqlite')
+SUMMARY_CACHE_TTL_HOURS = float(os.environ.get('SUMMARY_CACHE_TTL_HOURS', 24))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get('SUMMARY_CACHE_MAX_ENTRIES', 1000))
+
+def open_summary_cache(path=SUMMARY_CACHE_PATH):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS summaries ("
+        " key TEXT PRIMARY KEY, summary TEXT NOT NULL,"
+        " created_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+    )
+    return conn
 
-# --- Función para obtener noticias con NewsAPI y resumir con Gemini ---
-def get_news_summary_with_gemini(company_name, ticker, max_links=3, current_price=None, change_1y=None, operating_income=None, net_income=None):
-    model = genai.GenerativeModel('gemini-1.5-flash')
+def summary_cache_key(prompt, model_name=GEMINI_MODEL_NAME):
+    return hashlib.sha256(f"{model_name}\n{prompt}".encode('utf-8')).hexdigest()
 
-    news_links = []
+def get_cached_summary(prompt, path=SUMMARY_CACHE_PATH):
+    """Devuelve el resumen guardado para este prompt, o None si no existe o expiró."""
+    key = summary_cache_key(prompt)
+    now = time.time()
+    conn = open_summary_cache(path)
+    try:
+        row = conn.execute("SELECT summary, created_at FROM summaries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        summary, created_at = row
+        with conn:
+            if now - created_at > SUMMARY_CACHE_TTL_HOURS * 3600:
+                conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE summaries SET last_used_at = ? WHERE key = ?", (now, key))
+        return summary
+    finally:
+        conn.close()
+
+def store_cached_summary(prompt, summary, path=SUMMARY_CACHE_PATH):
+    """Guarda el resumen y expulsa las entradas expiradas y, si se supera el tamaño máximo, las menos usadas."""
+    now = time.time()
+    conn = open_summary_cache(path)
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)", (summary_cache_key(prompt), summary, now, now))
+            conn.execute("DELETE FROM summaries WHERE created_at < ?", (now - SUMMARY_CACHE_TTL_HOURS * 3600,))
+            conn.execute(
+                "DELETE FROM summaries WHERE key IN ("
+                " SELECT key FROM summaries ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (SUMMARY_CACHE_MAX_ENTRIES,)
+            )
+    finally:
+        conn.close()
 
+def generate_summary(model, prompt):
+    """
+    Resumen para el prompt: de la cache si existe, si no llamando a Gemini y guardándolo.
+    Lanza ProviderUnavailable sin llamar a Gemini si su cortacircuitos está abierto.
+    """
+    summary = get_cached_summary(prompt)
+    if summary is not None:
+        print("DEBUG: Resumen reutilizado desde la cache (sin llamar a Gemini).")
+        count_metric('gemini', cache_hits=1)
+        return summary
+    count_metric('gemini', cache_misses=1, prompt_chars=len(prompt))
+    response = call_provider('gemini', 'gemini', model.generate_content, prompt)
+    summary = response.text
+    count_metric('gemini', bytes=payload_size(summary))
+    store_cached_summary(prompt, summary)
+    return summary
+
+
+# --- Cache de respuestas de NewsAPI ---
+# Cada consulta guarda la hora de su última petición y el inicio de la ventana de fechas que
+# cubren sus artículos; mientras sea reciente se responde desde disco, y al caducar solo se
+# piden los artículos publicados desde esa hora. La ventana avanza con los días: al leer se
+# descartan los artículos anteriores a los últimos NEWS_WINDOW_DAYS días.
+# Los artículos se guardan una sola vez por URL, aunque aparezcan en varias consultas
+# (p. ej. bancos como SAN y BNP.PA que comparten noticias)
+NEWS_CACHE_PATH = os.path.join(DATA_DIR, 'news_cache.sqlite')
+NEWS_CACHE_MAX_AGE_HOURS = float(os.environ.get('NEWS_CACHE_MAX_AGE_HOURS', 6))
+NEWS_WINDOW_DAYS = int(os.environ.get('NEWS_WINDOW_DAYS', 30))
+# Margen de solape para la consulta incremental (artículos indexados con retraso)
+NEWS_INCREMENTAL_OVERLAP_HOURS = 1
+
+def open_news_cache(path=NEWS_CACHE_PATH):
+    conn = sqlite3.connect(path, timeout=30)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(news_queries)")]
+    if columns and 'window_start' not in columns:
+        # Cache de una versión anterior (sin la ventana cubierta): se descarta y se vuelve a llenar
+        conn.executescript("DROP TABLE news_queries; DROP TABLE IF EXISTS news_query_articles;"
+                           " DROP TABLE IF EXISTS news_articles;")
+    conn.executescript(
+        "CREATE TABLE IF NOT EXISTS news_queries ("
+        " query TEXT PRIMARY KEY, fetched_at REAL NOT NULL, window_start TEXT NOT NULL);"
+        "CREATE TABLE IF NOT EXISTS news_articles ("
+        " url TEXT PRIMARY KEY, title TEXT NOT NULL, publisher TEXT, published_at TEXT);"
+        "CREATE TABLE IF NOT EXISTS news_query_articles ("
+        " query TEXT NOT NULL, url TEXT NOT NULL, position INTEGER NOT NULL,"
+        " PRIMARY KEY (query, url));"
+    )
+    return conn
+
+def _read_cached_news(conn, key):
+    rows = conn.execute(
+        "SELECT a.url, a.title, a.publisher, a.published_at FROM news_query_articles qa"
+        " JOIN news_articles a ON a.url = qa.url WHERE qa.query = ? ORDER BY qa.position",
+        (key,)
+    ).fetchall()
+    return [
+        {'url': url, 'title': title, 'source': {'name': publisher}, 'publishedAt': published_at}
+        for url, title, publisher, published_at in rows
+    ]
+
+def get_everything_cached(q, language='en', sort_by='relevancy', page_size=20):
+    """
+    Igual que newsapi.get_everything pero pasando por la cache en disco.
+    Devuelve un dict con la misma forma ('totalResults', 'articles').
+    Solo se devuelven artículos de los últimos NEWS_WINDOW_DAYS días hasta la fecha de la
+    construcción. La ventana cubierta se guarda con la consulta: la consulta incremental la
+    extiende hasta hoy, y solo se repite completa si la guardada empieza después de la pedida.
+    """
+    window_start = (build_now(timezone.utc).date() - timedelta(days=NEWS_WINDOW_DAYS)).isoformat()
+    key = f"{language}|{sort_by}|{q}"
+    now = time.time()
+    conn = open_news_cache()
     try:
-        # Búsqueda de noticias usando NewsAPI
-        articles = newsapi.get_everything(
-            q=f'"{company_name}" OR "{ticker} stock"',
-            language='en', # Noticas en inglés
-            sort_by='relevancy',
-            page_size=max_links * 5 # Traemos más por si filtramos algunos
-        )
+        row = conn.execute("SELECT fetched_at, window_start FROM news_queries WHERE query = ?", (key,)).fetchone()
+        if row is not None and row[1] > window_start:
+            row = None  # La ventana guardada no cubre la pedida (NEWS_WINDOW_DAYS aumentó): consulta completa
+        # Recorte a la ventana al leer: los artículos que ya salieron de ella no se devuelven
+        cached_articles = [article for article in _read_cached_news(conn, key)
+                           if not article['publishedAt'] or article['publishedAt'] >= window_start]
+        if row is not None and now - row[0] < NEWS_CACHE_MAX_AGE_HOURS * 3600:
+            print(f"DEBUG: Noticias de NewsAPI reutilizadas desde la cache para la consulta {q}.")
+            count_metric('newsapi', cache_hits=1)
+            return {'status': 'ok', 'totalResults': len(cached_articles), 'articles': cached_articles}
+
+        params = dict(q=q, language=language, sort_by=sort_by, page_size=page_size, from_param=window_start)
+        if row is not None:
+            # Consulta incremental: solo lo publicado desde la última petición (dentro de la ventana)
+            since = datetime.fromtimestamp(row[0] - NEWS_INCREMENTAL_OVERLAP_HOURS * 3600, timezone.utc)
+            params['from_param'] = max(since.strftime('%Y-%m-%dT%H:%M:%S'), window_start)
+        count_metric('newsapi', cache_misses=1)
+        try:
+            response = call_provider('newsapi', 'newsapi', newsapi.get_everything, **params)
+        except Exception as e:
+            if not cached_articles:
+                raise
+            # Proveedor caído o sin cuota: mejor las noticias guardadas que ninguna
+            print(f"DEBUG: NewsAPI no disponible ({e}); se usan las noticias guardadas para la consulta {q}.")
+            return {'status': 'ok', 'totalResults': len(cached_articles), 'articles': cached_articles}
+        count_metric('newsapi', bytes=payload_size(response))
+
+        # Fusionar: primero los nuevos (en orden de relevancia), luego los guardados,
+        # sin URLs repetidas y descartando los que salen de la ventana de NEWS_WINDOW_DAYS
+        merged = []
+        seen_urls = set()
+        for article in (response.get('articles') or []) + cached_articles:
+            url = article.get('url')
+            if not url or not article.get('title') or url in seen_urls:
+                continue
+            if article.get('publishedAt') and article['publishedAt'] < window_start:
+                continue
+            seen_urls.add(url)
+            merged.append(article)
+
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO news_queries VALUES (?, ?, ?)", (key, now, window_start))
+            conn.execute("DELETE FROM news_query_articles WHERE query = ?", (key,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO news_articles VALUES (?, ?, ?, ?)",
+                [(a['url'], a['title'], a.get('source', {}).get('name', 'N/A'), a.get('publishedAt')) for a in merged]
+            )
+            conn.executemany(
+                "INSERT INTO news_query_articles VALUES (?, ?, ?)",
+                [(key, a['url'], position) for position, a in enumerate(merged)]
+            )
+            # Artículos que ya no pertenecen a ninguna consulta
+            conn.execute("DELETE FROM news_articles WHERE url NOT IN (SELECT url FROM news_query_articles)")
+        return {'status': 'ok', 'totalResults': len(merged), 'articles': merged}
+    finally:
+        conn.close()
+
+
+# --- Presupuesto del prompt: titulares casi duplicados y límite de tokens ---
+# Las agencias replican la misma noticia con titulares casi idénticos. Los titulares se
+# agrupan por similitud (MinHash sobre shingles de caracteres) y, en orden de relevancia,
+# se toma un artículo por grupo mientras quepa en PROMPT_NEWS_TOKEN_BUDGET: si hay muchas
+# noticias distintas el prompt lleva más, y nunca se paga dos veces la misma historia.
+# Los tokens se estiman (~4 caracteres por token), sin llamar al tokenizador de Gemini.
+PROMPT_NEWS_TOKEN_BUDGET = int(os.environ.get('PROMPT_NEWS_TOKEN_BUDGET', 350))
+PROMPT_MAX_ARTICLES = int(os.environ.get('PROMPT_MAX_ARTICLES', 8))
+HEADLINE_SIMILARITY_THRESHOLD = float(os.environ.get('HEADLINE_SIMILARITY_THRESHOLD', 0.5))
+HEADLINE_SHINGLE_SIZE = 4
+MINHASH_PERMUTATIONS = 64
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(1729)  # Semilla fija: mismas firmas (y mismos prompts en cache) en cada construcción
+_MINHASH_COEFFICIENTS = [(_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(_MINHASH_PRIME))
+                         for _ in range(MINHASH_PERMUTATIONS)]
+
+def estimate_tokens(text):
+    return max(1, (len(text) + 3) // 4)
+
+def headline_shingles(title):
+    normalized = ' '.join(re.findall(r'\w+', title.lower()))
+    if len(normalized) <= HEADLINE_SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + HEADLINE_SHINGLE_SIZE] for i in range(len(normalized) - HEADLINE_SHINGLE_SIZE + 1)}
+
+def minhash_signature(shingles):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+              for shingle in shingles]
+    return tuple(min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_COEFFICIENTS)
+
+def signature_similarity(signature, other):
+    """Estimación de la similitud de Jaccard entre los shingles de dos titulares."""
+    return sum(x == y for x, y in zip(signature, other)) / MINHASH_PERMUTATIONS
+
+def select_prompt_articles(articles, format_article, max_links=3, token_budget=None, max_articles=None):
+    """
+    articles: dicts con 'title', 'url' y 'publisher' en orden de relevancia.
+    format_article: article -> texto del artículo en el prompt.
+    Devuelve (líneas para el prompt, enlaces para la página), con un artículo por grupo de
+    titulares casi duplicados. Los artículos que no caben en token_budget se saltan y se
+    prueban los siguientes, más cortos (siempre se incluye al menos uno).
+    El ahorro se mide contra el prompt sin deduplicar con el mismo presupuesto: solo cuentan
+    los duplicados que ese prompt habría incluido. La página cita los max_links primeros
+    artículos enviados en el prompt.
+    """
+    token_budget = PROMPT_NEWS_TOKEN_BUDGET if token_budget is None else token_budget
+    max_articles = PROMPT_MAX_ARTICLES if max_articles is None else max_articles
+
+    def fits(count, used, tokens):
+        return count == 0 or (count < max_articles and used + tokens <= token_budget)
+
+    prompt_lines, selected, signatures = [], [], []
+    used_tokens = duplicates = tokens_saved = 0
+    naive_count = naive_tokens = 0  # Prompt sin deduplicar, para estimar el ahorro
+    for article in articles:
+        line = format_article(article)
+        tokens = estimate_tokens(line)
+        naive_fits = fits(naive_count, naive_tokens, tokens)
+        if naive_fits:
+            naive_count += 1
+            naive_tokens += tokens
+        # Primero la deduplicación: un duplicado demasiado largo no debe cortar la selección
+        signature = minhash_signature(headline_shingles(article['title']))
+        if any(signature_similarity(signature, other) >= HEADLINE_SIMILARITY_THRESHOLD for other in signatures):
+            if naive_fits:
+                duplicates += 1
+                tokens_saved += tokens
+            continue
+        if not fits(len(prompt_lines), used_tokens, tokens):
+            continue
+        signatures.append(signature)
+        prompt_lines.append(line)
+        selected.append(article)
+        used_tokens += tokens
+    if prompt_lines:
+        print(f"DEBUG: Prompt con {len(prompt_lines)} artículos (~{used_tokens} tokens); {duplicates} casi duplicados "
+              f"descartados (~{tokens_saved} tokens ahorrados).")
+        count_metric('news_prompt', calls=1, prompt_tokens=used_tokens, duplicates=duplicates, tokens_saved=tokens_saved)
+    news_links = selected[:max_links]
+    return prompt_lines, news_links
+
+
+# --- Búsqueda de noticias con NewsAPI ---
+def _format_newsapi_article(article):
+    return f"Título: {article['title']}\nFuente: {article['publisher']}\nEnlace: {article['url']}"
+
+def fetch_newsapi_news(company_name, ticker, max_links=3):
+    """
+    Devuelve (relevant_news_for_gemini_prompt, news_links): los artículos de NewsAPI elegidos
+    por select_prompt_articles, con hasta max_links enlaces. Lanza ValueError si no hay
+    artículos utilizables.
+    """
+    # Búsqueda de noticias usando NewsAPI (a través de la cache en disco)
+    articles = get_everything_cached(
+        q=f'"{company_name}" OR "{ticker} stock"',
+        language='en', # Noticas en inglés
+        sort_by='relevancy',
+        page_size=max(max_links, PROMPT_MAX_ARTICLES) * 3 # Traemos más por si filtramos algunos
+    )
 
-        # --- DEBUGGING NEWSAPI ---
-        print(f"DEBUG: NewsAPI encontró {articles['totalResults']} artículos para {company_name} ({ticker}).")
-        if articles['totalResults'] == 0:
-            print(f"DEBUG: NewsAPI no encontró ningún artículo. No hay nada para filtrar.")
-        else:
-            print(f"DEBUG: Primeros 5 títulos de NewsAPI:")
-            for i, article in enumerate(articles['articles'][:5]):
-                print(f"  - {i+1}: {article.get('title', 'Sin título')} (Fuente: {article.get('source', {}).get('name', 'N/A')})")
-        # --- FIN DEBUGGING NEWSAPI ---
-
-        relevant_news_for_gemini_prompt = []
-        count = 0
-        if articles and articles['articles']:
-            for article in articles['articles']:
-                if count >= max_links:
-                    break
-                # Filtramos artículos sin título o URL
-                if article.get('title') and article.get('url'):
-                    relevant_news_for_gemini_prompt.append(f"Título: {article['title']}\nFuente: {article.get('source', {}).get('name', 'N/A')}\nEnlace: {article['url']}")
-                    news_links.append({
-                        'title': article['title'],
-                        'url': article['url'],
-                        'publisher': article.get('source', {}).get('name', 'N/A')
-                    })
-                    count += 1
-
-        if not relevant_news_for_gemini_prompt:
-            raise ValueError("NewsAPI no encontró artículos relevantes después de filtrar.")
-
-        # Construir la información financiera para el prompt
-        financial_info_for_prompt = []
-        if current_price is not None:
-            financial_info_for_prompt.append(f"Precio actual de la acción: ${current_price:.2f}")
-        if change_1y is not None:
-            financial_info_for_prompt.append(f"Cambio porcentual en el último año: {change_1y:.2f}%")
-        if operating_income is not None:
-            financial_info_for_prompt.append(f"Ingresos operativos más recientes: {format_financial_value(operating_income)}")
-        if net_income is not None:
-            financial_info_for_prompt.append(f"Ingreso neto más reciente: {format_financial_value(net_income)}")
-
-        financial_info_text = ""
-        if financial_info_for_prompt:
-            financial_info_text = "\n\nInformación financiera clave:\n- " + "\n- ".join(financial_info_for_prompt)
-
-
-        # Construir el prompt para Gemini (ahora en español y con datos financieros)
-        prompt = (
-            f"Basado en los siguientes titulares de noticias y la información financiera proporcionada sobre {company_name} ({ticker}), "
-            f"genera un resumen conciso y objetivo en **español**. "
-            f"El resumen debe tener entre 3 y 5 oraciones. "
-            f"El resumen debe primero incluir noticias sobre expansion/reduccion del negocio o unidades del negocio, como compra o venta de activos o fusiones con otras empresas. Debe incluir si hubo algun cambio en su rating de credito. Debe incluir algun analisis de la accion y la comparacion de su precio contra en consenso. Debe cubrir las noticias más relevantes, en caso de encontrar noticias sobre deuda/solvenica incluirla en el resumen y, si la información está disponible, incluir un breve análisis del rendimiento de las acciones y/o los ingresos y/o deuda y capacidad de repago en relación con las noticias.\n"
-            f"No menciones la fuente específica de las noticias en el resumen final. Si no hay noticias, o no hay información financiera, simplemente omite esa parte del análisis.\n\n"
-            f"Noticias:\n"
-            + "\n\n".join(relevant_news_for_gemini_prompt)
-            + financial_info_text
-        )
+    # --- DEBUGGING NEWSAPI ---
+    print(f"DEBUG: NewsAPI encontró {articles['totalResults']} artículos para {company_name} ({ticker}).")
+    if articles['totalResults'] == 0:
+        print(f"DEBUG: NewsAPI no encontró ningún artículo. No hay nada para filtrar.")
+    else:
+        print(f"DEBUG: Primeros 5 títulos de NewsAPI:")
+        for i, article in enumerate(articles['articles'][:5]):
+            print(f"  - {i+1}: {article.get('title', 'Sin título')} (Fuente: {article.get('source', {}).get('name', 'N/A')})")
+    # --- FIN DEBUGGING NEWSAPI ---
+
+    # Filtramos artículos sin título o URL
+    candidates = [
+        {'title': article['title'], 'url': article['url'], 'publisher': article.get('source', {}).get('name', 'N/A')}
+        for article in (articles['articles'] if articles else None) or []
+        if article.get('title') and article.get('url')
+    ]
+    relevant_news_for_gemini_prompt, news_links = select_prompt_articles(candidates, _format_newsapi_article, max_links)
+
+    if not relevant_news_for_gemini_prompt:
+        raise ValueError("NewsAPI no encontró artículos relevantes después de filtrar.")
+
+    return relevant_news_for_gemini_prompt, news_links
+
+# --- Noticias de Yahoo Finance (alternativa a NewsAPI) ---
+def fetch_yahoo_news(ticker, max_links=3, stock=None):
+    """Devuelve (titulares para el prompt, enlaces) de Yahoo Finance, elegidos por select_prompt_articles."""
+    stock_yf = stock if stock is not None else yf.Ticker(ticker)
+    yf_news_items = call_provider('yahoo', 'yahoo_news', lambda: stock_yf.news)
+    count_metric('yahoo_news', bytes=payload_size(yf_news_items))
+    candidates = [
+        {'title': news_item['title'], 'url': news_item['link'], 'publisher': news_item.get('publisher', 'N/A')}
+        for news_item in yf_news_items or []
+        if news_item.get('title') and news_item.get('link')
+    ]
+    return select_prompt_articles(candidates, lambda article: f"Título: {article['title']}\nEnlace: {article['url']}",
+                                  max_links)
+
+# --- Búsqueda de noticias con cobertura: NewsAPI y, si tarda o falla, Yahoo en paralelo ---
+# NewsAPI es la fuente preferida. Si no respondió en NEWS_HEDGE_DELAY_SECONDS (0 = lanzar
+# ambas a la vez) o falló, se pide también a Yahoo, y se espera como mucho
+# NEWS_DEADLINE_SECONDS en total por alguna de las dos.
+NEWS_HEDGE_DELAY_SECONDS = float(os.environ.get('NEWS_HEDGE_DELAY_SECONDS', 1.0))
+NEWS_DEADLINE_SECONDS = float(os.environ.get('NEWS_DEADLINE_SECONDS', 20))
+_news_pool = ThreadPoolExecutor(max_workers=2 * BUILD_IO_WORKERS, thread_name_prefix='news')
+
+def fetch_news_hedged(company_name, ticker, max_links=3, stock=None):
+    """
+    Devuelve ((titulares, enlaces), fuente) con fuente 'newsapi' o 'yahoo', o
+    (([], []), None) si ninguna de las dos devolvió noticias antes del plazo.
+    """
+    deadline = time.monotonic() + NEWS_DEADLINE_SECONDS
+    scope = current_metrics_ticker()
+
+    def in_scope(function, *args):
+        # Las métricas de los hilos auxiliares se atribuyen al ticker que las pidió
+        with metrics_ticker(scope):
+            return function(*args)
+
+    newsapi_future = _news_pool.submit(in_scope, fetch_newsapi_news, company_name, ticker, max_links)
+    futures = {newsapi_future: 'newsapi'}
+    done, _ = wait([newsapi_future], timeout=NEWS_HEDGE_DELAY_SECONDS)
+    if not done or newsapi_future.exception() is not None:
+        futures[_news_pool.submit(in_scope, fetch_yahoo_news, ticker, max_links, stock)] = 'yahoo'
+
+    results = {}
+    pending = set(futures)
+    while pending and 'newsapi' not in results:
+        if 'yahoo' in results and newsapi_future not in pending:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            if not results:
+                print(f"DEBUG: Plazo de {NEWS_DEADLINE_SECONDS:.0f} s agotado esperando noticias para {company_name}.")
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            source = futures[future]
+            try:
+                news = future.result()
+            except Exception as e:
+                print(f"ERROR AL OBTENER NOTICIAS DE {source.upper()} PARA {company_name}: {e}")
+                continue
+            if news[0]:
+                results[source] = news
+
+    for source in ('newsapi', 'yahoo'):
+        if source in results:
+            return results[source], source
+    return ([], []), None
+
+# --- Información financiera para los prompts ---
+def build_financial_info_text(current_price=None, change_1y=None, operating_income=None, net_income=None):
+    # Construir la información financiera para el prompt
+    financial_info_for_prompt = []
+    if current_price is not None:
+        financial_info_for_prompt.append(f"Precio actual de la acción: ${current_price:.2f}")
+    if change_1y is not None:
+        financial_info_for_prompt.append(f"Cambio porcentual en el último año: {change_1y:.2f}%")
+    if operating_income is not None:
+        financial_info_for_prompt.append(f"Ingresos operativos más recientes: {format_financial_value(operating_income)}")
+    if net_income is not None:
+        financial_info_for_prompt.append(f"Ingreso neto más reciente: {format_financial_value(net_income)}")
+
+    financial_info_text = ""
+    if financial_info_for_prompt:
+        financial_info_text = "\n\nInformación financiera clave:\n- " + "\n- ".join(financial_info_for_prompt)
+    return financial_info_text
+
+# Instrucciones comunes a los prompts individuales y por lotes
+SUMMARY_INSTRUCTIONS = (
+    f"El resumen debe tener entre 3 y 5 oraciones. "
+    f"El resumen debe primero incluir noticias sobre expansion/reduccion del negocio o unidades del negocio, como compra o venta de activos o fusiones con otras empresas. Debe incluir si hubo algun cambio en su rating de credito. Debe incluir algun analisis de la accion y la comparacion de su precio contra en consenso. Debe cubrir las noticias más relevantes, en caso de encontrar noticias sobre deuda/solvenica incluirla en el resumen y, si la información está disponible, incluir un breve análisis del rendimiento de las acciones y/o los ingresos y/o deuda y capacidad de repago en relación con las noticias.\n"
+    f"No menciones la fuente específica de las noticias en el resumen final. Si no hay noticias, o no hay información financiera, simplemente omite esa parte del análisis.\n\n"
+)
+
+def build_summary_prompt(company_name, ticker, relevant_news_for_gemini_prompt, financial_info_text):
+    # Construir el prompt para Gemini (ahora en español y con datos financieros)
+    return (
+        f"Basado en los siguientes titulares de noticias y la información financiera proporcionada sobre {company_name} ({ticker}), "
+        f"genera un resumen conciso y objetivo en **español**. "
+        + SUMMARY_INSTRUCTIONS
+        + f"Noticias:\n"
+        + "\n\n".join(relevant_news_for_gemini_prompt)
+        + financial_info_text
+    )
 
-        # --- NUEVOS DEBUG PARA GEMINI ---
-        print(f"DEBUG: Enviando prompt a Gemini para {company_name}. Longitud del prompt: {len(prompt)} caracteres.")
-        print(f"DEBUG: Contenido del prompt (primeras 500 caracteres):\n{prompt[:500]}...")
 
-        response = model.generate_content(prompt)
-        summary = response.text
-        print(f"DEBUG: Gemini generó resumen para {company_name}.")
-        # --- FIN NUEVOS DEBUG PARA GEMINI ---
+def build_yahoo_summary_prompt(company_name, ticker, yf_news_for_gemini_prompt, financial_info_text):
+    # Prompt para las noticias de Yahoo Finance (también en español y con datos financieros)
+    return (
+        f"Basado en los siguientes titulares de noticias y la información financiera proporcionada sobre {company_name} ({ticker}), "
+        f"genera un resumen conciso y objetivo en **español**. "
+        f"El resumen debe tener entre 2 y 4 oraciones. "
+        f"Debe cubrir las noticias más relevantes y, si la información está disponible, incluir un breve análisis del rendimiento de las acciones y/o los ingresos en relación con las noticias.\n"
+        f"A continuación, se listan los titulares:\n\n"
+        + "\n\n".join(yf_news_for_gemini_prompt)
+        + financial_info_text # Incluir info financiera también en el fallback
+    )
 
-        return summary, news_links
 
-    except Exception as e:
-        # AQUI AGREGAMOS UN PRINT MAS ESPECIFICO PARA CAPTURAR EL ERROR COMPLETO
-        print(f"ERROR FATAL AL OBTENER NOTICIAS O GENERAR RESUMEN CON GEMINI PARA {company_name}: {e}")
+# --- Función para obtener noticias (NewsAPI o Yahoo) y resumir con Gemini ---
+NO_NEWS_SUMMARY = "No se pudieron obtener noticias de la web ni de Yahoo Finance para esta empresa."
+SUMMARY_UNAVAILABLE = "Resumen no disponible temporalmente: se alcanzó el límite de uso del servicio de resúmenes."
+SUMMARY_ERROR = "No se pudieron obtener noticias o generar un resumen para esta empresa."
 
-        # En caso de error, intentamos un último fallback con Yahoo Finance (solo si el primer intento falló)
-        try:
-            stock_yf = yf.Ticker(ticker)
-            yf_news_items = stock_yf.news
-            yf_news_for_gemini_prompt = []
-            yf_news_links = []
-            count_yf = 0
-            for news_item in yf_news_items:
-                if count_yf >= max_links:
-                    break
-                if news_item.get('title') and news_item.get('link'):
-                    yf_news_for_gemini_prompt.append(f"Título: {news_item['title']}\nEnlace: {news_item['link']}")
-                    yf_news_links.append({'title': news_item['title'], 'url': news_item['link'], 'publisher': news_item.get('publisher', 'N/A')})
-                    count_yf += 1
-
-            if yf_news_for_gemini_prompt:
-                # Prompt de fallback para Yahoo Finance (también en español y con datos financieros)
-                prompt_yf = (
-                    f"Basado en los siguientes titulares de noticias y la información financiera proporcionada sobre {company_name} ({ticker}), "
-                    f"genera un resumen conciso y objetivo en **español**. "
-                    f"El resumen debe tener entre 2 y 4 oraciones. "
-                    f"Debe cubrir las noticias más relevantes y, si la información está disponible, incluir un breve análisis del rendimiento de las acciones y/o los ingresos en relación con las noticias.\n"
-                    f"A continuación, se listan los titulares:\n\n"
-                    + "\n\n".join(yf_news_for_gemini_prompt)
-                    + financial_info_text # Incluir info financiera también en el fallback
-                )
-
-                # --- NUEVOS DEBUG PARA GEMINI (FALLBACK) ---
-                print(f"DEBUG: Enviando prompt de FALLBACK a Gemini para {company_name}. Longitud del prompt: {len(prompt_yf)} caracteres.")
-                print(f"DEBUG: Contenido del prompt de FALLBACK (primeras 500 caracteres):\n{prompt_yf[:500]}...")
-                # --- FIN NUEVOS DEBUG PARA GEMINI (FALLBACK) ---
-
-                response_yf = model.generate_content(prompt_yf)
-                summary_yf = response_yf.text
-                print(f"DEBUG: Gemini generó resumen de FALLBACK para {company_name}.")
-                return summary_yf, yf_news_links
-            else:
-                return "No se pudieron obtener noticias de la web ni de Yahoo Finance para esta empresa.", []
+def get_news_summary_with_gemini(company_name, ticker, max_links=3, current_price=None, change_1y=None, operating_income=None, net_income=None, news=None, stock=None, news_source='newsapi'):
+    """
+    news: (relevant_news_for_gemini_prompt, news_links) ya obtenidas con fetch_news_hedged;
+          si es None, se consultan aquí.
+    news_source: fuente de 'news' ('newsapi' o 'yahoo'), que determina el prompt.
+    stock: objeto yf.Ticker ya creado, reutilizado para las noticias de Yahoo.
+    Si Gemini falla no se repite la llamada con otras noticias (fallaría por la misma causa):
+    se devuelve un texto de reemplazo junto con los enlaces.
+    """
+    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
 
-        except Exception as fallback_e:
-            print(f"ERROR EN FALLBACK DE YAHOO FINANCE PARA {company_name}: {fallback_e}")
-            return "No se pudieron obtener noticias o generar un resumen para esta empresa.", []
+    financial_info_text = build_financial_info_text(current_price, change_1y, operating_income, net_income)
 
+    if news is None:
+        news, news_source = fetch_news_hedged(company_name, ticker, max_links, stock)
+    relevant_news_for_gemini_prompt, news_links = news
+    if not relevant_news_for_gemini_prompt:
+        return NO_NEWS_SUMMARY, []
 
-# --- Función principal para generar el sitio estático ---
-def generate_static_site():
-    print("Iniciando la generación del sitio estático...")
+    if news_source == 'yahoo':
+        prompt = build_yahoo_summary_prompt(company_name, ticker, relevant_news_for_gemini_prompt, financial_info_text)
+    else:
+        prompt = build_summary_prompt(company_name, ticker, relevant_news_for_gemini_prompt, financial_info_text)
 
-    # --- Título de la página ---
-    page_title = "<b>Public Tenants Urbana</b>" # Aquí se define el título
+    # --- NUEVOS DEBUG PARA GEMINI ---
+    print(f"DEBUG: Enviando prompt a Gemini para {company_name} (noticias de {news_source}). Longitud del prompt: {len(prompt)} caracteres.")
+    print(f"DEBUG: Contenido del prompt (primeras 500 caracteres):\n{prompt[:500]}...")
 
-    with open('tickers.txt', 'r') as f:
-        tickers = [line.strip() for line in f if line.strip()]
+    try:
+        summary = generate_summary(model, prompt)
+    except Exception as e:
+        if isinstance(e, ProviderUnavailable) or is_fatal_provider_error(e):
+            print(f"DEBUG: Gemini no disponible para {company_name}; se usa un texto de reemplazo. ({e})")
+            return SUMMARY_UNAVAILABLE, news_links
+        print(f"ERROR FATAL AL GENERAR RESUMEN CON GEMINI PARA {company_name}: {e}")
+        return SUMMARY_ERROR, news_links
+    print(f"DEBUG: Gemini generó resumen para {company_name}.")
+    # --- FIN NUEVOS DEBUG PARA GEMINI ---
 
-    all_company_data = []
-    all_companies_summary = []
+    return summary, news_links
 
-    for ticker in tickers:
-        print(f"Procesando {ticker}...")
-        try:
-            stock = yf.Ticker(ticker)
-            info = stock.info
 
-            # Obtener historial de precios para un período más largo y completo
-            # Usamos "max" para asegurar que tenemos todos los datos posibles para los cálculos
-            hist = stock.history(period="max") 
+# --- Resúmenes por lotes: varias empresas en una sola petición a Gemini ---
+SUMMARY_BATCH_SIZE = int(os.environ.get('SUMMARY_BATCH_SIZE', 6))
 
-            # Asegúrate de que el índice de 'hist' sea DatetimeIndex para la función get_average_price_around_date
-            if not isinstance(hist.index, pd.DatetimeIndex):
-                hist.index = pd.to_datetime(hist.index)
+def build_batch_summary_prompt(entries):
+    """
+    entries: lista de dicts con 'ticker', 'company_name', 'news' y 'financial_info_text'.
+    Las instrucciones se envían una sola vez y se pide un objeto JSON con un resumen por ticker.
+    """
+    sections = []
+    for entry in entries:
+        relevant_news_for_gemini_prompt, _ = entry['news']
+        sections.append(
+            f"### {entry['ticker']} - {entry['company_name']}\n"
+            f"Noticias:\n"
+            + "\n\n".join(relevant_news_for_gemini_prompt)
+            + entry['financial_info_text']
+        )
+    tickers_list = ", ".join(f'"{entry["ticker"]}"' for entry in entries)
+    return (
+        f"Para cada una de las siguientes empresas, basado en sus titulares de noticias y la información financiera proporcionada, "
+        f"genera un resumen conciso y objetivo en **español**. "
+        + SUMMARY_INSTRUCTIONS
+        + f"Responde únicamente con un objeto JSON cuyas claves sean exactamente los tickers {tickers_list} "
+        f"y cuyos valores sean el resumen de cada empresa como texto.\n\n"
+        + "\n\n".join(sections)
+    )
 
+def parse_batch_summary_response(text, tickers):
+    """Devuelve {ticker: resumen} con las entradas válidas de la respuesta JSON; ignora las que falten o estén mal formadas."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find('{'):]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {
+        ticker: data[ticker].strip()
+        for ticker in tickers
+        if isinstance(data.get(ticker), str) and data[ticker].strip()
+    }
 
-            company_name = info.get('longName', ticker)
-            sector = info.get('sector', 'N/A')
-            industry = info.get('industry', 'N/A')
-            current_price = info.get('regularMarketPrice')
+def summarize_news_in_batches(summary_requests, batch_size=SUMMARY_BATCH_SIZE, executor=None):
+    """
+    summary_requests: lista de kwargs para get_news_summary_with_gemini (con 'news' ya obtenidas).
+    Devuelve {ticker: (news_summary, news_links)} en el mismo formato que la función individual.
+    Las empresas con resumen en cache no se envían; las que falten o vengan mal formadas
+    en la respuesta del lote se reintentan individualmente, y las que no entran en ningún
+    lote (noticias de Yahoo o sin noticias) se resumen con la llamada individual.
+    """
+    model = genai.GenerativeModel(
+        GEMINI_MODEL_NAME,
+        generation_config={'response_mime_type': 'application/json'}
+    )
+    results = {}
+    pending = []
+    for request in summary_requests:
+        relevant_news_for_gemini_prompt, news_links = request['news']
+        if not relevant_news_for_gemini_prompt or request.get('news_source') != 'newsapi':
+            continue  # Sin noticias o noticias de Yahoo: irá por el camino individual
+        entry = {
+            'ticker': request['ticker'],
+            'company_name': request['company_name'],
+            'news': request['news'],
+            'financial_info_text': build_financial_info_text(
+                request['current_price'], request['change_1y'], request['operating_income'], request['net_income']),
+        }
+        entry['prompt'] = build_summary_prompt(entry['company_name'], entry['ticker'], relevant_news_for_gemini_prompt, entry['financial_info_text'])
+        cached = get_cached_summary(entry['prompt'])
+        if cached is not None:
+            count_metric('gemini', ticker=entry['ticker'], cache_hits=1)
+            results[entry['ticker']] = (cached, news_links)
+        else:
+            pending.append(entry)
 
-            # --- Precios históricos para variación (ahora con promedios) ---
-            today = datetime.now().date()
+    def run_batch(batch):
+        prompt = build_batch_summary_prompt(batch)
+        tickers = [entry['ticker'] for entry in batch]
+        print(f"DEBUG: Enviando lote a Gemini para {', '.join(tickers)}. Longitud del prompt: {len(prompt)} caracteres.")
+        try:
+            with metrics_ticker(BUILD_SCOPE):
+                count_metric('gemini_batch', prompt_chars=len(prompt))
+                response = call_provider('gemini', 'gemini_batch', model.generate_content, prompt)
+                count_metric('gemini_batch', bytes=payload_size(response.text))
+            parsed = parse_batch_summary_response(response.text, tickers)
+        except Exception as e:
+            print(f"ERROR AL GENERAR RESUMEN POR LOTES PARA {', '.join(tickers)}: {e}")
+            parsed = {}
+        for entry in batch:
+            if entry['ticker'] in parsed:
+                # Se guarda bajo la clave del prompt individual para que la cache sirva a ambos modos
+                store_cached_summary(entry['prompt'], parsed[entry['ticker']])
+        return parsed
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    if executor is not None:
+        batch_results = list(executor.map(run_batch, batches))
+    else:
+        batch_results = [run_batch(batch) for batch in batches]
+
+    for batch, parsed in zip(batches, batch_results):
+        for entry in batch:
+            if entry['ticker'] in parsed:
+                results[entry['ticker']] = (parsed[entry['ticker']], entry['news'][1])
+
+    # Reintento individual para las empresas enviadas en un lote sin un resumen válido; las
+    # que no entraron en ningún lote (noticias de Yahoo o sin noticias) van por el camino individual
+    batched_tickers = {entry['ticker'] for entry in pending}
+    for request in summary_requests:
+        if request['ticker'] in results:
+            continue
+        with metrics_ticker(request['ticker']):
+            if request['ticker'] in batched_tickers:
+                print(f"DEBUG: Sin resumen válido en el lote para {request['ticker']}; se reintenta individualmente.")
+                count_metric('gemini', retries=1)
+            results[request['ticker']] = get_news_summary_with_gemini(**request)
+    return results
+
+
+# --- Generación del gráfico financiero (Ingresos Operativos y Beneficio Neto) ---
+FINANCIAL_CHART_COLORS = ['#66BB6A', '#FFA726']
+
+def financial_plot_frame(financials, ticker):
+    """Últimos 4 años de 'Operating Income' y 'Net Income' (años x columnas) o None si no hay datos."""
+    if financials is None or financials.empty:
+        print(f"No hay datos financieros para generar el gráfico: {ticker}")
+        return None
 
-            target_date_6m_ago = today - timedelta(days=6*30) # Aprox. 6 meses calendario
-            target_date_1y_ago = today - timedelta(days=365)   # Aprox. 1 año calendario
-            target_date_5y_ago = today - timedelta(days=5*365) # Aprox. 5 años calendario
+    # Verificamos si las columnas existen antes de intentar graficarlas
+    columns_to_plot = []
+    if 'Operating Income' in financials.index:
+        columns_to_plot.append('Operating Income')
+    if 'Net Income' in financials.index:
+        columns_to_plot.append('Net Income')
 
-            price_6m_ago = get_average_price_around_date(hist, target_date_6m_ago, days_window=7) # Ventana de 7 días (aprox. 1 semana calendario)
-            price_1y_ago = get_average_price_around_date(hist, target_date_1y_ago, days_window=7)
-            price_5y_ago = get_average_price_around_date(hist, target_date_5y_ago, days_window=7)
+    if not columns_to_plot:
+        print(f"No se encontraron 'Operating Income' o 'Net Income' para graficar para {ticker}.")
+        return None
 
+    financial_data_for_plot = financials.loc[columns_to_plot].transpose().iloc[:4]
+    if financial_data_for_plot.empty:
+        print(f"No hay datos financieros suficientes para el gráfico: {ticker}")
+        return None
+    return financial_data_for_plot
 
-            # --- Variaciones porcentuales ---
-            change_6m = None
-            if current_price and price_6m_ago is not None and price_6m_ago != 0:
-                change_6m = ((current_price - price_6m_ago) / price_6m_ago) * 100
+def _financial_period_label(label):
+    return label.strftime('%Y-%m-%d') if hasattr(label, 'strftime') else str(label)
 
-            change_1y = None
-            if current_price and price_1y_ago is not None and price_1y_ago != 0:
-                change_1y = ((current_price - price_1y_ago) / price_1y_ago) * 100
+def generate_financial_chart(financials, ticker, force=False, formats=None):
+    financial_data_for_plot = financial_plot_frame(financials, ticker)
+    if financial_data_for_plot is None:
+        return False
+    columns_to_plot = list(financial_data_for_plot.columns)
+
+    chart_name = f'{ticker}_financial'
+    title = f'Ingresos y Beneficios Netos - {ticker}'
+    input_hash = chart_input_hash(financial_data_for_plot.astype(float), title)
+    if not force and all(
+        artifact_is_unchanged(f'public/img/{chart_name}.{fmt}', input_hash) for fmt in formats or CHART_FORMATS
+    ):
+        count_metric('charts', cache_hits=1)
+        return True
+    count_metric('charts', cache_misses=1)
+
+    fig, ax = _get_financial_chart_template()
+    # Quitar las barras y la leyenda del gráfico anterior; el estilo de la figura se conserva
+    for container in list(ax.containers):
+        container.remove()
+    if ax.get_legend() is not None:
+        ax.get_legend().remove()
+
+    positions = np.arange(len(financial_data_for_plot))
+    width = 0.5 / len(columns_to_plot)
+    for i, column in enumerate(columns_to_plot):
+        offset = (i - (len(columns_to_plot) - 1) / 2) * width
+        values = financial_data_for_plot[column].astype(float).fillna(0).to_numpy()
+        ax.bar(positions + offset, values, width, label=column, color=FINANCIAL_CHART_COLORS[i])
+    ax.set_xticks(positions)
+    ax.set_xticklabels([_financial_period_label(label) for label in financial_data_for_plot.index])
+    ax.set_xlim(-0.5, len(positions) - 0.5)
+    ax.relim()
+    ax.autoscale_view(scalex=False)
+    ax.legend()
+    ax.set_title(title, color='#333333', fontsize=16)
+    _align_xticklabels_right(ax)
+
+    save_chart_figure(fig, chart_name, input_hash, formats, force)
+    return True
 
-            change_5y = None
-            if current_price and price_5y_ago is not None and price_5y_ago != 0:
-                change_5y = ((current_price - price_5y_ago) / price_5y_ago) * 100
+# --- Datos de precios para los gráficos en el navegador (CHART_MODE=client) ---
+# Formato binario little-endian de public/data/<ticker>.bin (lo decodifica static/charts.js):
+#   0  'PXS1'               identificador del formato
+#   4  uint32 n             número de cierres
+#   8  int32  first_day     días desde 1970-01-01 del primer cierre
+#   12 int32  scale         unidades por dólar (100 = centavos; 10000 para precios < $10)
+#   16 int32  first_value   primer cierre en unidades enteras
+#   20 int32[n-1]           diferencias entre cierres consecutivos
+#   .. uint16[n-1]          días transcurridos entre cierres consecutivos
+# Unos 6 bytes por cierre, frente a los ~100 KB de cada PNG.
+PRICE_DATA_DIR = 'public/data'
+PRICE_DATA_MAGIC = b'PXS1'
+CHART_SCRIPT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'charts.js')
+
+def encode_price_series(series):
+    """Codifica un PriceSeries en el formato binario PXS1."""
+    values = series.close.astype(float)
+    scale = 10000 if len(values) and np.nanmax(np.abs(values)) < 10 else 100
+    units = np.rint(values * scale).astype(np.int64)
+    days = series.days.astype(np.int64)
+    header = PRICE_DATA_MAGIC + np.array([len(units)], dtype='<u4').tobytes()
+    if not len(units):
+        return header + np.zeros(3, dtype='<i4').tobytes()
+    header += np.array([days[0], scale, units[0]], dtype='<i4').tobytes()
+    value_deltas = np.diff(units).astype('<i4')
+    day_deltas = np.clip(np.diff(days), 0, np.iinfo(np.uint16).max).astype('<u2')
+    return header + value_deltas.tobytes() + day_deltas.tobytes()
+
+def write_price_data(ticker, hist, force=False):
+    """Escribe public/data/<ticker>.bin con el historial completo de cierres si cambió."""
+    if hist is None or hist.empty:
+        print(f"No hay datos para generar los precios del gráfico: {ticker}")
+        return False
+    path = f'{PRICE_DATA_DIR}/{ticker}.bin'
+    input_hash = chart_input_hash(hist)
+    if not force and artifact_is_unchanged(path, input_hash):
+        count_metric('chart_data', cache_hits=1)
+        return True
+    count_metric('chart_data', cache_misses=1)
+    payload = encode_price_series(hist)
+    write_if_changed(path, payload)
+    count_metric('chart_data', bytes=len(payload))
+    record_artifact_hash(path, input_hash)
+    return True
 
-            # --- Datos financieros ---
-            try:
-                financials = stock.financials
-                # Usamos .iloc[0] para acceder a la primera columna por posición, que es el dato más reciente
-                # y verificamos si la Serie no está vacía
-                operating_income = financials.loc['Operating Income'].iloc[0] if 'Operating Income' in financials.index and not financials.loc['Operating Income'].empty else None
-                net_income = financials.loc['Net Income'].iloc[0] if 'Net Income' in financials.index and not financials.loc['Net Income'].empty else None
-            except Exception as e:
-                print(f"Error al obtener datos financieros (Operating/Net Income) para {ticker}: {e}")
-                operating_income = None
-                net_income = None
+def financial_chart_data(financials, ticker):
+    """Datos del gráfico financiero para dibujarlo en el navegador: {'labels', 'series'} o None."""
+    financial_data_for_plot = financial_plot_frame(financials, ticker)
+    if financial_data_for_plot is None:
+        return None
+    return {
+        'title': f'Ingresos y Beneficios Netos - {ticker}',
+        'labels': [_financial_period_label(label) for label in financial_data_for_plot.index],
+        'series': [
+            {'name': column, 'color': FINANCIAL_CHART_COLORS[i],
+             'values': [None if pd.isna(v) else float(v) for v in financial_data_for_plot[column]]}
+            for i, column in enumerate(financial_data_for_plot.columns)
+        ],
+    }
 
-            try:
-                cash_flow = stock.cashflow
-                # Usamos .iloc[0] para acceder a la primera columna por posición
-                ebitda = cash_flow.loc['EBITDA'].iloc[0] if 'EBITDA' in cash_flow.index and not cash_flow.loc['EBITDA'].empty else None
-            except Exception as e:
-                print(f"Error al obtener datos de flujo de caja (EBITDA) para {ticker}: {e}")
-                ebitda = None
-
-            # --- OBTENER RESUMEN DE NOTICIAS DE LA WEB (NewsAPI + Gemini) ---
-            # PASAMOS LOS DATOS FINANCIEROS Y DE PRECIOS A LA FUNCIÓN DE RESUMEN
-            news_summary, news_articles_list = get_news_summary_with_gemini(
-                company_name=company_name,
-                ticker=ticker,
-                max_links=3,
-                current_price=current_price,
-                change_1y=change_1y, # Usamos el cambio_1y para el análisis de Gemini
-                operating_income=operating_income,
-                net_income=net_income
-            )
+def write_chart_script(output_dir='public'):
+    """Copia el dibujante de gráficos del navegador a <output_dir>/js/charts.js."""
+    os.makedirs(f'{output_dir}/js', exist_ok=True)
+    with open(CHART_SCRIPT_SOURCE, 'r', encoding='utf-8') as f:
+        return write_if_changed(f'{output_dir}/js/charts.js', f.read())
+
+
+# --- Renderizado de los cuatro gráficos de un ticker ---
+# Función de nivel de módulo para poder enviarla a un ProcessPoolExecutor
+# Devuelve las métricas de la etapa 'charts' para que el proceso principal las incorpore
+def render_ticker_charts(ticker, hist_6m, hist_1y, hist_5y, financials, force=False, formats=None):
+    with metrics_ticker(ticker), timed_stage('charts'), profile_render():
+        generate_chart(hist_6m, f'Precio de Cierre (6 Meses) - {ticker}', f'{ticker}_6m', period='6mo', force=force, formats=formats)
+        generate_chart(hist_1y, f'Precio de Cierre (1 Año) - {ticker}', f'{ticker}_1y', period='1y', force=force, formats=formats)
+        generate_chart(hist_5y, f'Precio de Cierre (5 Años) - {ticker}', f'{ticker}_5y', period='5y', force=force, formats=formats)
+        generate_financial_chart(financials, ticker, force=force, formats=formats)
+    return BUILD_METRICS.pop_ticker(ticker, ('charts',))
+
+
+# --- Registro de datos de una empresa ---
+# Los valores se guardan sin formato (float o None). El formato ("$12.34", "12.34%",
+# "$1.50B") se aplica una sola vez al renderizar con los filtros de Jinja, y las clases
+# CSS de las variaciones y el color del semáforo se calculan al crear el registro.
+def _optional_float(value):
+    return None if is_missing(value) else float(value)
+
+def change_css_class(change):
+    """Clase CSS de una variación porcentual ('' si no hay dato), según su valor redondeado a 2 decimales."""
+    if change is None:
+        return ''
+    rounded = round(change, 2)
+    if rounded > 0:
+        return 'change-positive'
+    if rounded < 0:
+        return 'change-negative'
+    return 'change-neutral'
+
+def semaphore_color_for(change_1y):
+    # --- Determinar el color del semáforo para la tabla ---
+    if change_1y is None:
+        return 'gray'
+    if change_1y >= 20:
+        return 'green'
+    if change_1y >= 0:
+        return 'yellow'
+    return 'red'
+
+@dataclass(slots=True)
+class CompanyRecord:
+    ticker: str
+    name: str
+    sector: str = 'N/A'
+    industry: str = 'N/A'
+    current_price: float | None = None
+    changes: dict = field(default_factory=dict)  # horizonte ('6m', '1y', '5y') -> variación en % o None
+    operating_income: float | None = None
+    net_income: float | None = None
+    ebitda: float | None = None
+    news_summary: str | None = None
+    news_articles: list = field(default_factory=list)
+    financial_chart: dict | None = None  # Solo en CHART_MODE=client (ver financial_chart_data)
+    # Derivados de 'changes'
+    change_classes: dict = field(init=False)
+    semaphore_color: str = field(init=False)
+
+    def __post_init__(self):
+        self.current_price = _optional_float(self.current_price)
+        self.operating_income = _optional_float(self.operating_income)
+        self.net_income = _optional_float(self.net_income)
+        self.ebitda = _optional_float(self.ebitda)
+        self.changes = {horizon: _optional_float(self.changes.get(horizon)) for horizon in RETURN_HORIZONS}
+        self.change_classes = {horizon: change_css_class(change) for horizon, change in self.changes.items()}
+        self.semaphore_color = semaphore_color_for(self.changes.get('1y'))
+
+    def updated(self, **changes):
+        """Copia del registro con esos campos cambiados (los derivados se recalculan)."""
+        return replace(self, **changes)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{f.name: data[f.name] for f in fields(cls) if f.init and f.name in data})
+
+    def summary_fields(self):
+        """Campos que muestra la tabla resumen (para el hash de la página índice)."""
+        return (self.ticker, self.name, self.current_price, self.changes, self.semaphore_color)
+
+# --- Filtros de Jinja para dar formato a los registros ---
+def format_price(value):
+    return f"${value:.2f}" if value else "N/A"
+
+def format_percent(value):
+    return f"{value:.2f}%" if value is not None else "N/A"
+
+def format_ratio(value):
+    return f"{value:.2f}" if value is not None else "N/A"
+
+def correlation_color(value):
+    """Fondo de una celda del mapa de correlaciones: rojo si es positiva, verde si es negativa."""
+    if value is None:
+        return '#F0F0F0'
+    red, green, blue = (220, 53, 69) if value >= 0 else (40, 167, 69)
+    return f"rgba({red}, {green}, {blue}, {min(abs(value), 1) * 0.6:.2f})"
+
+env.filters['price'] = format_price
+env.filters['percent'] = format_percent
+env.filters['financial'] = format_financial_value
+env.filters['ratio'] = format_ratio
+env.filters['change_class'] = change_css_class
+env.filters['correlation_color'] = correlation_color
+
+
+# --- Procesamiento de un ticker: datos, noticias, resumen y gráficos ---
+def process_ticker(ticker, *args, **kwargs):
+    """Ejecuta _process_ticker atribuyendo al ticker sus métricas y su tiempo total ('total')."""
+    with metrics_ticker(ticker), timed_stage('total'):
+        return _process_ticker(ticker, *args, **kwargs)
+
+def _process_ticker(ticker, hist=None, chart_executor=None, defer_summary=False, full_rebuild=False, anchor_prices=None,
+                    chart_formats=None, chart_mode='images'):
+    """
+    Obtiene todos los datos de un ticker y devuelve (record, chart_future, summary_request), con record un CompanyRecord.
+    hist: historial "max" ya cargado (si es None se pide a Yahoo).
+    chart_executor: si se indica, los gráficos se renderizan en ese executor y se devuelve
+                    el Future correspondiente; si no, se renderizan aquí y chart_future es None.
+    defer_summary: si es True, solo se buscan las noticias y el resumen de Gemini queda
+                   pendiente en summary_request (kwargs para get_news_summary_with_gemini),
+                   para resumirlo por lotes; si no, summary_request es None.
+    full_rebuild: si es True, los gráficos se regeneran aunque el manifiesto indique que no cambiaron.
+    anchor_prices: Series (horizonte -> precio de referencia) calculada por compute_anchor_prices
+                   para todos los tickers; si es None se calcula aquí a partir de 'hist'.
+    chart_formats: formatos de imagen de los gráficos (por defecto CHART_FORMATS).
+    chart_mode: 'images' renderiza los gráficos con matplotlib; 'client' solo escribe los
+                precios en public/data/ y los datos financieros en record.financial_chart.
+    """
+    print(f"Procesando {ticker}...")
+    chart_future = None
+    summary_request = None
+    try:
+        stock = yf.Ticker(ticker)
+        with PROVIDER_LIMITERS['yahoo'], timed_stage('yahoo_info'):
+            info = stock.info
+        count_metric('yahoo_info', bytes=payload_size(info))
+
+        # Historial de precios completo ("max") de la descarga en bloque.
+        # Si el ticker no vino en el bloque, lo pedimos individualmente
+        if hist is None or hist.empty:
+            with PROVIDER_LIMITERS['yahoo'], timed_stage('yahoo_history'):
+                history_frame = stock.history(period="max")
+            count_metric('yahoo_history', bytes=payload_size(history_frame))
+            hist = PriceSeries.from_frame(history_frame)
+            del history_frame
+            if not hist.empty:
+                write_price_series(ticker, hist)
+
+        company_name = info.get('longName', ticker)
+        sector = info.get('sector', 'N/A')
+        industry = info.get('industry', 'N/A')
+        # Misma fuente que refresh_prices; 'regularMarketPrice' solo si Yahoo no tiene historial
+        current_price = hist.last_close() if not hist.empty else info.get('regularMarketPrice')
+
+        # --- Variaciones porcentuales respecto a precios promedio de referencia ---
+        if anchor_prices is None:
+            anchor_prices = compute_anchor_prices(build_close_matrix({ticker: hist}, [ticker])).loc[ticker]
+        changes_row = compute_percentage_changes(anchor_prices.to_frame(ticker).T, pd.Series({ticker: current_price})).loc[ticker]
+        changes = {horizon: (None if pd.isna(value) else float(value)) for horizon, value in changes_row.items()}
+        change_1y = changes.get('1y')
+
+        # --- Datos financieros (desde la cache de fundamentales salvo que haya nuevos resultados) ---
+        financials, cash_flow = load_fundamentals(ticker, stock, info)
+        # La primera columna es el dato más reciente
+        operating_income = latest_statement_value(financials, 'Operating Income')
+        net_income = latest_statement_value(financials, 'Net Income')
+        ebitda = latest_statement_value(cash_flow, 'EBITDA')
+
+        # --- Generación de gráficos ---
+        # Las ventanas se recortan del historial completo, sin nuevas peticiones a Yahoo.
+        # En modo concurrente se envían al pool de procesos mientras seguimos con las noticias.
+        # En modo 'client' solo se escriben los datos y el navegador dibuja los gráficos
+        chart_args = None
+        financial_chart = None
+        if chart_mode == 'client':
+            with timed_stage('chart_data'):
+                write_price_data(ticker, hist, force=full_rebuild)
+            financial_chart = financial_chart_data(financials, ticker)
+        else:
+            chart_args = (ticker, slice_history(hist, '6mo'), slice_history(hist, '1y'), slice_history(hist, '5y'), financials, full_rebuild, chart_formats)
+            if chart_executor is not None:
+                chart_future = chart_executor.submit(render_ticker_charts, *chart_args)
+
+        # --- OBTENER RESUMEN DE NOTICIAS DE LA WEB (NewsAPI + Gemini) ---
+        # PASAMOS LOS DATOS FINANCIEROS Y DE PRECIOS A LA FUNCIÓN DE RESUMEN
+        summary_kwargs = dict(
+            company_name=company_name,
+            ticker=ticker,
+            max_links=3,
+            current_price=current_price,
+            change_1y=change_1y, # Usamos el cambio_1y para el análisis de Gemini
+            operating_income=operating_income,
+            net_income=net_income,
+            stock=stock
+        )
+        if defer_summary:
+            summary_kwargs['news'], summary_kwargs['news_source'] = fetch_news_hedged(company_name, ticker, max_links=3, stock=stock)
+            summary_request = summary_kwargs
+            news_summary, news_articles_list = None, []  # Se completan tras el resumen por lotes
+        else:
+            news_summary, news_articles_list = get_news_summary_with_gemini(**summary_kwargs)
+
+        if chart_args is not None and chart_executor is None:
+            BUILD_METRICS.merge(ticker, render_ticker_charts(*chart_args))
+
+
+        # --- Almacenar todos los datos de la empresa para la plantilla ---
+        record = CompanyRecord(
+            ticker=ticker,
+            name=company_name,
+            sector=sector,
+            industry=industry,
+            current_price=current_price,
+            changes=changes,
+            operating_income=operating_income,
+            net_income=net_income,
+            ebitda=ebitda,
+            news_summary=news_summary,
+            news_articles=news_articles_list,
+            financial_chart=financial_chart,
+        )
+        return record, chart_future, summary_request
 
-            # --- Generación de gráficos ---
-            # Estos aún usan períodos directos de yfinance, lo cual es apropiado para un gráfico
-            hist_1y = stock.history(period="1y")
-            hist_6m = stock.history(period="6mo")
-            hist_5y = stock.history(period="5y")
-
-            generate_chart(hist_6m, f'Precio de Cierre (6 Meses) - {ticker}', f'{ticker}_6m.png', period='6mo')
-            generate_chart(hist_1y, f'Precio de Cierre (1 Año) - {ticker}', f'{ticker}_1y.png', period='1y')
-            generate_chart(hist_5y, f'Precio de Cierre (5 Años) - {ticker}', f'{ticker}_5y.png', period='5y')
-
-            # Generación de gráfico financiero (si hay datos disponibles)
-            if not financials.empty:
-                # Verificamos si las columnas existen antes de intentar graficarlas
-                columns_to_plot = []
-                if 'Operating Income' in financials.index:
-                    columns_to_plot.append('Operating Income')
-                if 'Net Income' in financials.index:
-                    columns_to_plot.append('Net Income')
-
-                if columns_to_plot:
-                    financial_data_for_plot = financials.loc[columns_to_plot].transpose().iloc[:4]
-                    if not financial_data_for_plot.empty:
-                        plt.figure(figsize=(10, 6))
-                        financial_data_for_plot.plot(kind='bar', ax=plt.gca(), color=['#66BB6A', '#FFA726'][:len(columns_to_plot)])
-                        plt.title(f'Ingresos y Beneficios Netos - {ticker}', color='#333333', fontsize=16)
-                        plt.xlabel('Año', color='#555555')
-                        plt.ylabel('Valor ($)', color='#555555')
-
-                        formatter = FuncFormatter(lambda x, p: format_financial_value(x))
-                        plt.gca().yaxis.set_major_formatter(formatter)
-
-                        plt.xticks(rotation=45, ha='right', color='#555555')
-                        plt.yticks(color='#555555')
-                        plt.grid(axis='y', linestyle='--', alpha=0.7)
-                        plt.gca().set_facecolor('#F9F9F9')
-                        plt.gcf().set_facecolor('#FFFFFF')
-                        plt.tight_layout()
-                        plt.savefig(f'public/img/{ticker}_financial.png')
-                        plt.close()
-                    else:
-                        print(f"No hay datos financieros suficientes para el gráfico: {ticker}")
-                else:
-                    print(f"No se encontraron 'Operating Income' o 'Net Income' para graficar para {ticker}.")
-            else:
-                print(f"No hay datos financieros para generar el gráfico: {ticker}")
-
-
-            # --- Determinar el color del semáforo para la tabla ---
-            semaphore_color = "gray"
-            if change_1y is not None:
-                if change_1y >= 20:
-                    semaphore_color = "green"
-                elif change_1y >= 0:
-                    semaphore_color = "yellow"
-                else:
-                    semaphore_color = "red"
-
-            # --- Almacenar todos los datos de la empresa para la plantilla ---
-            all_company_data.append({
-                'ticker': ticker,
-                'name': company_name,
-                'sector': sector,
-                'industry': industry,
-                'current_price': f"${current_price:.2f}" if current_price else "N/A",
-                'change_6m': f"{change_6m:.2f}%" if change_6m is not None else "N/A",
-                'change_1y': f"{change_1y:.2f}%" if change_1y is not None else "N/A",
-                'change_5y': f"{change_5y:.2f}%" if change_5y is not None else "N/A",
-                'operating_income': format_financial_value(operating_income),
-                'net_income': format_financial_value(net_income),
-                'ebitda': format_financial_value(ebitda),
-                'news_summary': news_summary,
-                'news_articles': news_articles_list
-            })
-
-            # --- Datos específicos para la tabla resumen ---
-            all_companies_summary.append({
-                'ticker': ticker,
-                'name': company_name,
-                'current_price': f"${current_price:.2f}" if current_price else "N/A",
-                'change_6m': f"{change_6m:.2f}%" if change_6m is not None else "N/A",
-                'change_1y': f"{change_1y:.2f}%" if change_1y is not None else "N/A",
-                'change_5y': f"{change_5y:.2f}%" if change_5y is not None else "N/A",
-                'semaphore_color': semaphore_color
-            })
+    except Exception as e:
+        # Captura cualquier error en el procesamiento de un ticker y registra en la consola
+        print(f"ERROR GENERAL PROCESANDO {ticker}: {e}")
+        # Asegura que el ticker siempre aparezca en la tabla de resumen y en la sección de detalles
+        record = CompanyRecord(
+            ticker=ticker,
+            name=f"{ticker} (Error)",
+            news_summary=f'No se pudieron obtener datos completos o un resumen de noticias para esta empresa debido a un error: {e}',
+        )
+        return record, chart_future, None
 
-        except Exception as e:
-            # Captura cualquier error en el procesamiento de un ticker y registra en la consola
-            print(f"ERROR GENERAL PROCESANDO {ticker}: {e}")
-            # Asegura que el ticker siempre aparezca en la tabla de resumen y en la sección de detalles
-            all_company_data.append({
-                'ticker': ticker,
-                'name': f"{ticker} (Error)",
-                'sector': 'N/A', 'industry': 'N/A',
-                'current_price': 'N/A', 'change_6m': 'N/A',
-                'change_1y': 'N/A', 'change_5y': 'N/A',
-                'operating_income': 'N/A', 'net_income': 'N/A', 'ebitda': 'N/A',
-                'news_summary': f'No se pudieron obtener datos completos o un resumen de noticias para esta empresa debido a un error: {e}',
-                'news_articles': []
-            })
-            all_companies_summary.append({
-                'ticker': ticker,
-                'name': f"{ticker} (Error)",
-                'current_price': 'N/A', 'change_6m': 'N/A',
-                'change_1y': 'N/A', 'change_5y': 'N/A',
-                'semaphore_color': 'gray'
-            })
-
-
-    # --- Generar el archivo CSS principal (sin cambios aquí) ---
-    css_content = """
+
+# --- Completa los resúmenes pendientes de process_ticker(defer_summary=True) ---
+def fill_batched_summaries(results, executor=None):
+    summary_requests = [summary_request for _, _, summary_request in results if summary_request]
+    summaries = summarize_news_in_batches(summary_requests, executor=executor)
+    for record, _, summary_request in results:
+        if summary_request:
+            record.news_summary, record.news_articles = summaries[summary_request['ticker']]
+
+
+# --- Archivos estáticos del sitio: hoja de estilos y script de los gráficos ---
+SITE_CSS = """
     body {
         font-family: 'Helvetica Neue', Arial, sans-serif;
         margin: 0;
@@ -523,6 +2589,39 @@ def generate_static_site():
         border-left: 5px solid #cccccc;
     }
 
+    .portfolio-link {
+        text-align: center;
+        margin-top: -10px;
+    }
+
+    .portfolio-note {
+        color: #555555;
+        text-align: center;
+    }
+
+    .heatmap-wrapper {
+        overflow-x: auto;
+        margin-bottom: 40px;
+    }
+
+    .heatmap {
+        border-collapse: collapse;
+        font-size: 0.75em;
+        margin: 0 auto;
+    }
+
+    .heatmap th, .heatmap td {
+        padding: 4px 6px;
+        border: 1px solid #FFFFFF;
+        text-align: center;
+        white-space: nowrap;
+    }
+
+    .heatmap th {
+        color: #555555;
+        font-weight: 600;
+    }
+
     .company-section {
         background-color: #FFFFFF;
         padding: 30px;
@@ -564,6 +2663,36 @@ def generate_static_site():
         box-shadow: 0 1px 3px rgba(0,0,0,0.05);
     }
 
+    .chart-item canvas {
+        width: 100%;
+        aspect-ratio: 5 / 3;
+        display: block;
+        border: 1px solid #EEEEEE;
+        border-radius: 4px;
+        box-shadow: 0 1px 3px rgba(0,0,0,0.05);
+        cursor: crosshair;
+    }
+
+    .chart-ranges {
+        margin-bottom: 8px;
+    }
+
+    .chart-ranges button {
+        border: 1px solid #DDDDDD;
+        background-color: #FFFFFF;
+        color: #555555;
+        padding: 4px 10px;
+        margin-right: 4px;
+        border-radius: 4px;
+        cursor: pointer;
+    }
+
+    .chart-ranges button.active {
+        background-color: #4CAF50;
+        border-color: #4CAF50;
+        color: #FFFFFF;
+    }
+
     .news-section, .wikipedia-summary-section {
         background-color: #FDFDFD;
         padding: 20px;
@@ -617,24 +2746,974 @@ def generate_static_site():
         font-size: 0.9em;
     }
     """
-    with open('public/css/style.css', 'w') as f:
-        f.write(css_content)
-    print("Archivo CSS generado en public/css/style.css")
 
+def write_site_assets(chart_mode='images', output_dir='public'):
+    """Escribe <output_dir>/css/style.css y, en CHART_MODE=client, <output_dir>/js/charts.js si cambiaron."""
+    os.makedirs(f'{output_dir}/css', exist_ok=True)
+    with timed_stage('css', ticker=BUILD_SCOPE):
+        css_written = write_if_changed(f'{output_dir}/css/style.css', SITE_CSS)
+    if css_written:
+        print(f"Archivo CSS generado en {output_dir}/css/style.css")
+    else:
+        print(f"Archivo CSS sin cambios en {output_dir}/css/style.css")
+    if chart_mode == 'client':
+        with timed_stage('assets', ticker=BUILD_SCOPE):
+            write_chart_script(output_dir)
 
-    # --- Renderizar la plantilla HTML ---
-    template = env.get_template('index.html')
-    output = template.render(
-        companies=all_company_data,
-        all_companies_summary=all_companies_summary,
-        page_title=page_title # Pasamos el título a la plantilla
-    )
 
-    with open('public/index.html', 'w') as f:
-        f.write(output)
+# --- Páginas HTML ---
+# Plantillas de las que dependen las páginas; si cambia cualquiera se vuelven a renderizar
+PAGE_TEMPLATES = ('base.html', '_macros.html', '_summary_table.html', '_company_section.html')
+COMPANY_PAGES_SUBDIR = 'empresas'  # Páginas de detalle dentro del directorio de salida
+
+def template_sources(*names):
+    return [env.loader.get_source(env, name)[0] for name in PAGE_TEMPLATES + names]
+
+def stream_template_to_file(template_name, path, **context):
+    """
+    Renderiza la plantilla por partes con stream().dump() en un archivo temporal, sin
+    armar la página completa en memoria. El archivo final solo se reemplaza si cambió,
+    para conservar su fecha de modificación. Devuelve True si se escribió.
+    """
+    tmp_path = path + '.tmp'
+    env.get_template(template_name).stream(**context).dump(tmp_path, encoding='utf-8')
+    if os.path.exists(path) and os.path.getsize(path) == os.path.getsize(tmp_path):
+        with open(path, 'rb') as current, open(tmp_path, 'rb') as new:
+            if current.read() == new.read():
+                os.remove(tmp_path)
+                return False
+    os.replace(tmp_path, path)
+    return True
+
+def render_page(template_name, path, input_hash, full_rebuild=False, **context):
+    """Renderiza una página solo si cambió el hash de sus entradas (plantillas y datos)."""
+    if not full_rebuild and artifact_is_unchanged(path, input_hash):
+        return False
+    with timed_stage('jinja_render', ticker=BUILD_SCOPE), profile_render():
+        stream_template_to_file(template_name, path, chart_mime_types=CHART_MIME_TYPES, **context)
+    record_artifact_hash(path, input_hash)
+    return True
+
+def render_portfolio_page(portfolio, page_title, output_dir='public', full_rebuild=False, company_pages=False):
+    """<output_dir>/cartera.html con la analítica de la cartera; si no hay analítica se elimina la página anterior."""
+    path = f'{output_dir}/{PORTFOLIO_PAGE}'
+    if portfolio is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    page_hash = build_input_hash(template_sources('portfolio.html'), page_title, portfolio, company_pages)
+    return render_page('portfolio.html', path, page_hash, full_rebuild, portfolio=portfolio, page_title=page_title,
+                       base_path='', company_pages=company_pages)
+
+def render_site_pages(companies, page_title, chart_formats, multi_page=False, full_rebuild=False, chart_mode='images',
+                      output_dir='public', portfolio=None):
+    """
+    Modo de una página: <output_dir>/index.html con la tabla resumen y todas las empresas.
+    Modo multipágina: <output_dir>/index.html solo con la tabla resumen y una página de
+    detalle por ticker en <output_dir>/empresas/<ticker>.html.
+    portfolio: analítica de compute_portfolio_analytics; si se indica, se genera
+    <output_dir>/cartera.html y el índice enlaza a ella.
+    """
+    index_path = f'{output_dir}/index.html'
+    portfolio_page = portfolio is not None
+    if render_portfolio_page(portfolio, page_title, output_dir, full_rebuild, company_pages=multi_page):
+        print(f"Página generada en {output_dir}/{PORTFOLIO_PAGE}")
+    if not multi_page:
+        html_hash = build_input_hash(template_sources('index.html'), page_title, companies, chart_formats, chart_mode,
+                                     portfolio_page)
+        if render_page('index.html', index_path, html_hash, full_rebuild, companies=companies,
+                       page_title=page_title, chart_formats=chart_formats, chart_mode=chart_mode,
+                       base_path='', company_pages=False, portfolio_page=portfolio_page):
+            print(f"Página generada en {index_path}")
+        else:
+            print(f"{index_path} sin cambios; no se vuelve a renderizar.")
+        return
+
+    company_pages_dir = f'{output_dir}/{COMPANY_PAGES_SUBDIR}'
+    os.makedirs(company_pages_dir, exist_ok=True)
+    summary_hash = build_input_hash(template_sources('summary.html'), page_title,
+                                    [record.summary_fields() for record in companies], portfolio_page)
+    render_page('summary.html', index_path, summary_hash, full_rebuild, companies=companies, page_title=page_title,
+                base_path='', company_pages=True, portfolio_page=portfolio_page)
+
+    company_sources = template_sources('company.html')
+    rendered = 0
+    for company in companies:
+        path = f"{company_pages_dir}/{company.ticker}.html"
+        page_hash = build_input_hash(company_sources, page_title, company, chart_formats, chart_mode)
+        rendered += render_page('company.html', path, page_hash, full_rebuild,
+                                company=company, page_title=page_title, chart_formats=chart_formats,
+                                chart_mode=chart_mode, base_path='../', company_pages=True)
+
+    # Páginas de tickers que ya no están en la lista
+    current_pages = {f"{company.ticker}.html" for company in companies}
+    for filename in os.listdir(company_pages_dir):
+        if filename.endswith('.html') and filename not in current_pages:
+            os.remove(os.path.join(company_pages_dir, filename))
+    print(f"Páginas generadas: {index_path} y {rendered} de {len(companies)} páginas en {company_pages_dir}/")
+
+
+# --- Salida optimizada para el despliegue: nombres con hash, precompresión y cabeceras de cache ---
+# Con --optimize-assets, public/ se copia a DEPLOY_DIR con los recursos (imágenes, CSS, JS y
+# datos de precios) renombrados con el hash de su contenido y las referencias de las páginas
+# reescritas. Así los recursos se pueden cachear para siempre y solo cambia el HTML, que lleva
+# un TTL corto. public/ no se modifica, de modo que las construcciones incrementales siguen
+# comparando nombres estables. Los archivos de texto llevan además sus versiones .gz y .br.
+DEPLOY_DIR = os.environ.get('DEPLOY_DIR', 'dist')
+FINGERPRINT_EXTENSIONS = ('.css', '.js', '.png', '.webp', '.svg', '.bin')
+PRECOMPRESS_EXTENSIONS = ('.html', '.css', '.js', '.svg', '.json')
+FINGERPRINT_LENGTH = 12
+HTML_CACHE_MAX_AGE_SECONDS = int(os.environ.get('HTML_CACHE_MAX_AGE_SECONDS', 300))
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CACHE_MANIFEST_NAME = 'cache_headers.json'
+HEADERS_FILE_NAME = '_headers'  # Formato de Netlify y Cloudflare Pages
+ASSET_REFERENCE_RE = re.compile(r'\b(src|href|srcset|data-src)="([^"]*)"')
+CSS_URL_RE = re.compile(r'url\(\s*[\'"]?([^\'")]+)')
+
+def _local_reference(url, page_dir):
+    """Ruta relativa a la raíz del sitio de una referencia local, o None si es externa o un ancla."""
+    if not url or url.startswith(('#', '/', 'data:')) or '://' in url:
+        return None
+    return posixpath.normpath(posixpath.join(page_dir, url.split('#', 1)[0].split('?', 1)[0]))
+
+def referenced_assets(html, page_path):
+    """Rutas (relativas a la raíz del sitio) de los recursos locales que referencia una página."""
+    page_dir = posixpath.dirname(page_path)
+    references = set()
+    for attribute, value in ASSET_REFERENCE_RE.findall(html):
+        urls = [candidate.strip().split(' ', 1)[0] for candidate in value.split(',')] if attribute == 'srcset' else [value]
+        references.update(filter(None, (_local_reference(url, page_dir) for url in urls)))
+    return references
+
+def fingerprinted_path(path, content):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]}{ext}"
+
+def rewrite_asset_references(html, page_path, asset_paths):
+    """Reescribe src/href/srcset/data-src de una página que apunten a recursos con hash."""
+    page_dir = posixpath.dirname(page_path)
+
+    def rewrite_url(url):
+        source = _local_reference(url, page_dir)
+        target = asset_paths.get(source) if source is not None else None
+        return url if target is None else posixpath.relpath(target, page_dir or '.')
+
+    def replace_reference(match):
+        attribute, value = match.groups()
+        if attribute == 'srcset':
+            candidates = [candidate.strip().split(' ', 1) for candidate in value.split(',')]
+            value = ', '.join(' '.join([rewrite_url(parts[0])] + parts[1:]) for parts in candidates)
+        else:
+            value = rewrite_url(value)
+        return f'{attribute}="{value}"'
+
+    return ASSET_REFERENCE_RE.sub(replace_reference, html)
+
+def _brotli_compressor():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return lambda data: brotli.compress(data, quality=11)
+
+def precompress_file(path, brotli_compress=None, force=False):
+    """Escribe path.gz (y path.br si hay brotli) cuando faltan o force; se omiten si no reducen el tamaño."""
+    variants = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli_compress is not None:
+        variants.append(('.br', brotli_compress))
+    encodings = []
+    data = None
+    for suffix, compress in variants:
+        compressed_path = path + suffix
+        if force or not os.path.exists(compressed_path):
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            compressed = compress(data)
+            if len(compressed) >= len(data):
+                if os.path.exists(compressed_path):
+                    os.remove(compressed_path)
+                continue
+            with open(compressed_path, 'wb') as f:
+                f.write(compressed)
+        encodings.append('br' if suffix == '.br' else 'gzip')
+    return encodings
+
+def build_deploy_output(source_dir='public', deploy_dir=DEPLOY_DIR):
+    """
+    Copia source_dir a deploy_dir con recursos renombrados por contenido, páginas reescritas,
+    versiones precomprimidas y el manifiesto de cabeceras de cache. Devuelve ese manifiesto.
+    Solo se publican las páginas y los recursos que referencian (y los que referencian sus
+    hojas de estilo): los gráficos de tickers retirados que queden en source_dir no se suben.
+    """
+    pages, files = [], set()
+    for root, _, filenames in os.walk(source_dir):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), source_dir).replace(os.sep, '/')
+            if filename.endswith('.html'):
+                pages.append(path)
+            else:
+                files.add(path)
+
+    referenced = set()
+    for path in pages:
+        with open(os.path.join(source_dir, path), 'r', encoding='utf-8') as f:
+            referenced |= referenced_assets(f.read(), path)
+    for path in [path for path in referenced if path.endswith('.css') and path in files]:
+        with open(os.path.join(source_dir, path), 'r', encoding='utf-8') as f:
+            css_dir = posixpath.dirname(path)
+            referenced.update(filter(None, (_local_reference(url.strip(), css_dir) for url in CSS_URL_RE.findall(f.read()))))
+    published = files & referenced
+    assets = [path for path in published if path.endswith(FINGERPRINT_EXTENSIONS)]
+    others = [path for path in published if not path.endswith(FINGERPRINT_EXTENSIONS)]
+
+    brotli_compress = _brotli_compressor()
+    if brotli_compress is None:
+        print("Aviso: el paquete 'brotli' no está instalado; solo se generan versiones .gz.")
+    asset_paths = {}  # ruta en source_dir -> ruta con hash en deploy_dir
+    cache_headers = {}
+
+    def publish(path, changed, cache_control):
+        full_path = os.path.join(deploy_dir, path)
+        encodings = precompress_file(full_path, brotli_compress, force=changed) if path.endswith(PRECOMPRESS_EXTENSIONS) else []
+        cache_headers['/' + path] = {'Cache-Control': cache_control, 'encodings': encodings}
+
+    for path in sorted(assets):
+        with open(os.path.join(source_dir, path), 'rb') as f:
+            content = f.read()
+        target = asset_paths[path] = fingerprinted_path(path, content)
+        full_target = os.path.join(deploy_dir, target)
+        changed = not os.path.exists(full_target)  # El nombre ya identifica el contenido
+        if changed:
+            os.makedirs(os.path.dirname(full_target), exist_ok=True)
+            with open(full_target, 'wb') as f:
+                f.write(content)
+        publish(target, changed, IMMUTABLE_CACHE_CONTROL)
+
+    html_cache_control = f'public, max-age={HTML_CACHE_MAX_AGE_SECONDS}, must-revalidate'
+    for path in sorted(pages) + sorted(others):
+        with open(os.path.join(source_dir, path), 'rb') as f:
+            content = f.read()
+        if path.endswith('.html'):
+            content = rewrite_asset_references(content.decode('utf-8'), path, asset_paths).encode('utf-8')
+        full_path = os.path.join(deploy_dir, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        publish(path, write_if_changed(full_path, content), html_cache_control)
+
+    # Archivos de construcciones anteriores que ya no se referencian (p. ej. gráficos con otro hash)
+    manifest_files = {CACHE_MANIFEST_NAME, HEADERS_FILE_NAME}
+    for root, _, filenames in os.walk(deploy_dir):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), deploy_dir).replace(os.sep, '/')
+            published_path = path[:-3] if path.endswith(('.gz', '.br')) else path
+            if path not in manifest_files and '/' + published_path not in cache_headers:
+                os.remove(os.path.join(root, filename))
+
+    write_if_changed(os.path.join(deploy_dir, CACHE_MANIFEST_NAME), json.dumps(cache_headers, indent=1, sort_keys=True))
+    headers_lines = []
+    for path, headers in sorted(cache_headers.items()):
+        headers_lines += [path, f"  Cache-Control: {headers['Cache-Control']}"]
+    write_if_changed(os.path.join(deploy_dir, HEADERS_FILE_NAME), '\n'.join(headers_lines) + '\n')
+    print(f"Salida de despliegue en {deploy_dir}/: {len(asset_paths)} recursos con hash y {len(pages)} páginas "
+          f"({len(files) - len(published)} archivos sin referencias omitidos).")
+    return cache_headers
+
+
+# --- Datos de las empresas de la última construcción (para --render-only) ---
+# Al final de cada construcción se guardan los registros y las opciones de los gráficos con
+# las que se generaron los archivos de public/, de modo que las páginas se puedan volver a
+# renderizar (p. ej. tras cambiar una plantilla) sin proveedores, claves ni pandas/matplotlib
+COMPANY_DATA_PATH = os.path.join(DATA_DIR, 'company_data.json')
+
+def save_company_data(companies, chart_formats, chart_mode, path=COMPANY_DATA_PATH, portfolios=None):
+    """portfolios: analítica de la cartera por dashboard ('default' para el sitio único)."""
+    payload = {
+        'saved_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'chart_formats': list(chart_formats),
+        'chart_mode': chart_mode,
+        'companies': [record.to_dict() for record in companies],
+        'portfolios': portfolios or {},
+    }
+    write_if_changed(path, json.dumps(payload, ensure_ascii=False, indent=1, default=_json_default))
+
+def load_company_data(path=COMPANY_DATA_PATH):
+    """
+    Devuelve (companies, chart_formats, chart_mode, saved_at, portfolios) de la última
+    construcción guardada.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+    companies = [CompanyRecord.from_dict(data) for data in payload['companies']]
+    return (companies, payload['chart_formats'], payload['chart_mode'], payload.get('saved_at'),
+            payload.get('portfolios', {}))
+
+
+# --- Opciones de los gráficos (formatos y modo) con sus valores por defecto ---
+def resolve_chart_options(chart_formats=None, chart_mode=None):
+    chart_formats = chart_formats or CHART_FORMATS
+    unsupported_formats = [fmt for fmt in chart_formats if fmt not in SUPPORTED_CHART_FORMATS]
+    if unsupported_formats:
+        raise ValueError(f"Formatos de gráfico no soportados: {', '.join(unsupported_formats)}")
+    chart_mode = chart_mode or CHART_MODE
+    if chart_mode not in CHART_MODES:
+        raise ValueError(f"Modo de gráficos no soportado: {chart_mode}")
+    if chart_mode == 'client':
+        os.makedirs(PRICE_DATA_DIR, exist_ok=True)
+    return chart_formats, chart_mode
+
+
+# --- Registrar en el manifiesto los datos de cada ticker (precios, financieros y resumen) ---
+def record_ticker_data_hashes(companies):
+    changed_tickers = []
+    for record in companies:
+        data_hash = build_input_hash(record)
+        manifest_key = f"ticker:{record.ticker}"
+        if get_artifact_hash(manifest_key) != data_hash:
+            changed_tickers.append(record.ticker)
+            record_artifact_hash(manifest_key, data_hash)
+    print(f"Tickers con datos nuevos respecto a la última construcción: {len(changed_tickers)}/{len(companies)}"
+          + (f" ({', '.join(changed_tickers)})" if changed_tickers else ""))
+    return changed_tickers
+
+
+# --- Título de la página y lista de tickers ---
+PAGE_TITLE = "<b>Public Tenants Urbana</b>" # Aquí se define el título
+
+def read_tickers(path='tickers.txt'):
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+# --- Datos de todas las empresas (secuencial o concurrente) ---
+def collect_company_records(tickers, price_histories, concurrent=False, batch_summaries=False, full_rebuild=False,
+                            chart_formats=None, chart_mode='images'):
+    """
+    Procesa todos los tickers con process_ticker y devuelve sus CompanyRecord en el orden
+    de 'tickers' (la tabla resumen y las secciones de detalle usan los mismos registros).
+    Los tickers se procesan por bloques de PRICE_CHUNK_SIZE: solo los historiales del bloque
+    en curso están abiertos, y sus gráficos terminan antes de empezar el siguiente bloque.
+    """
+    results = []
+    with ExitStack() as stack:
+        io_pool = chart_pool = None
+        if concurrent:
+            io_pool = stack.enter_context(ThreadPoolExecutor(max_workers=BUILD_IO_WORKERS))
+            chart_pool = stack.enter_context(ProcessPoolExecutor(
+                max_workers=BUILD_CHART_WORKERS, mp_context=multiprocessing.get_context(CHART_POOL_START_METHOD)))
+        for chunk in chunked(tickers):
+            # Precios de referencia de todos los horizontes y tickers del bloque en una sola pasada vectorizada
+            anchor_prices = compute_anchor_prices(build_close_matrix(price_histories, chunk))
+            if concurrent:
+                futures = [io_pool.submit(process_ticker, ticker, price_histories.get(ticker), chart_pool, batch_summaries, full_rebuild,
+                                          anchor_prices.loc[ticker] if ticker in price_histories else None,
+                                          chart_formats, chart_mode) for ticker in chunk]
+                # Recorremos los futures en el orden de tickers.txt para que la salida sea determinista
+                chunk_results = [future.result() for future in futures]
+                for record, chart_future, _ in chunk_results:
+                    if chart_future is None:
+                        continue
+                    try:
+                        BUILD_METRICS.merge(record.ticker, chart_future.result())
+                    except Exception as e:
+                        print(f"Error al generar los gráficos de {record.ticker}: {e}")
+            else:
+                chunk_results = [process_ticker(ticker, price_histories.get(ticker), defer_summary=batch_summaries, full_rebuild=full_rebuild,
+                                                anchor_prices=anchor_prices.loc[ticker] if ticker in price_histories else None,
+                                                chart_formats=chart_formats, chart_mode=chart_mode) for ticker in chunk]
+            results.extend(chunk_results)
+        if batch_summaries:
+            fill_batched_summaries(results, executor=io_pool)
+
+    return [record for record, _, _ in results]
+
+
+# --- Función principal para generar el sitio estático ---
+def generate_static_site(concurrent=False, batch_summaries=False, full_rebuild=False, chart_formats=None, profile=False,
+                         multi_page=False, chart_mode=None, optimize_assets=False):
+    """
+    concurrent: si es True, los tickers se procesan en paralelo (hilos para la E/S
+    contra Yahoo, NewsAPI y Gemini, procesos para los gráficos de matplotlib).
+    El orden de salida sigue siendo el de tickers.txt.
+    batch_summaries: si es True, los resúmenes de Gemini se piden por lotes de
+    SUMMARY_BATCH_SIZE empresas con respuesta JSON.
+    full_rebuild: si es True, se ignora el manifiesto de construcción y se regeneran
+    todos los artefactos; por defecto solo se reescriben los que cambiaron.
+    chart_formats: formatos de los gráficos ('png', 'webp', 'svg'); por defecto CHART_FORMATS.
+    profile: si es True, se perfila con cProfile la fase de renderizado (gráficos en este
+    proceso y plantilla) y se guardan las estadísticas en RENDER_PROFILE_PATH.
+    multi_page: si es True, index.html solo lleva la tabla resumen y cada empresa tiene
+    su propia página en public/empresas/<ticker>.html.
+    chart_mode: 'images' (gráficos PNG/WebP/SVG con matplotlib) o 'client' (precios en
+    public/data/ y gráficos interactivos dibujados en el navegador); por defecto CHART_MODE.
+    optimize_assets: si es True, se genera además DEPLOY_DIR con recursos con hash en el
+    nombre, versiones precomprimidas y cabeceras de cache (ver build_deploy_output).
+    Al terminar se escribe un informe JSON con las métricas por ticker y etapa.
+    """
+    global _render_profiler
+    print("Iniciando la generación del sitio estático...")
+    BUILD_METRICS.reset()
+    _render_profiler = cProfile.Profile() if profile else None
+
+    chart_formats, chart_mode = resolve_chart_options(chart_formats, chart_mode)
+
+    page_title = PAGE_TITLE
+    tickers = read_tickers()
+
+    # Historial "max" de todos los tickers desde el almacén en disco, actualizado con
+    # una sola petición incremental; las ventanas de 6m/1y/5y y los promedios se
+    # recortan en memoria a partir de este marco
+    price_histories = load_price_history(tickers)
+
+    companies = collect_company_records(tickers, price_histories, concurrent=concurrent, batch_summaries=batch_summaries,
+                                        full_rebuild=full_rebuild, chart_formats=chart_formats, chart_mode=chart_mode)
+
+    record_ticker_data_hashes(companies)
+
+    # --- Analítica de la cartera (volatilidad, beta, correlaciones...) ---
+    with timed_stage('portfolio_analytics', ticker=BUILD_SCOPE):
+        portfolio = compute_portfolio_analytics(price_histories, companies, load_benchmark_series())
+
+
+    # --- Hoja de estilos y script de los gráficos ---
+    write_site_assets(chart_mode)
+
+
+    # --- Renderizar las páginas HTML ---
+    # Solo se renderizan las páginas cuyas plantillas o datos cambiaron
+    render_site_pages(companies, page_title, chart_formats,
+                      multi_page=multi_page, full_rebuild=full_rebuild, chart_mode=chart_mode, portfolio=portfolio)
+    save_company_data(companies, chart_formats, chart_mode, portfolios={'default': portfolio})
     print("Sitio estático generado en la carpeta 'public/'")
-    print("Ahora puedes subir el contenido de la carpeta 'public' a Netlify o Vercel.")
+    if optimize_assets:
+        with timed_stage('deploy_assets', ticker=BUILD_SCOPE):
+            build_deploy_output()
+        print(f"Ahora puedes subir el contenido de la carpeta '{DEPLOY_DIR}' a Netlify o Vercel.")
+    else:
+        print("Ahora puedes subir el contenido de la carpeta 'public' a Netlify o Vercel.")
+
+    write_build_report(options={
+        'concurrent': concurrent, 'batch_summaries': batch_summaries, 'full_rebuild': full_rebuild,
+        'chart_formats': chart_formats, 'chart_mode': chart_mode, 'multi_page': multi_page,
+        'optimize_assets': optimize_assets, 'tickers': len(tickers),
+    })
+    if _render_profiler is not None:
+        _render_profiler.dump_stats(RENDER_PROFILE_PATH)
+        print(f"\nPerfil de la fase de renderizado guardado en {RENDER_PROFILE_PATH}")
+        pstats.Stats(_render_profiler).sort_stats('cumulative').print_stats(20)
+        _render_profiler = None
+
+
+# --- Renderizado sin proveedores a partir de los datos guardados ---
+def render_only_site(multi_page=False, full_rebuild=False, optimize_assets=False, path=COMPANY_DATA_PATH,
+                     dashboards_config=None):
+    """
+    Vuelve a renderizar las páginas HTML y la hoja de estilos con los datos guardados por la
+    última construcción, sin consultar proveedores ni importar pandas, matplotlib o yfinance.
+    Los gráficos no se regeneran: se usan los de public/ con las opciones con que se crearon.
+    dashboards_config: si se indica, se renderizan los dashboards de ese archivo con los datos
+    guardados por la última construcción de varios dashboards.
+    """
+    if dashboards_config is not None and path == COMPANY_DATA_PATH:
+        path = DASHBOARDS_DATA_PATH
+    if not os.path.exists(path):
+        print(f"Error: no hay datos guardados en {path}. Ejecuta antes una construcción completa.")
+        raise SystemExit(1)
+    companies, chart_formats, chart_mode, saved_at, portfolios = load_company_data(path)
+    print(f"Renderizando {len(companies)} empresas con los datos guardados el {saved_at}...")
+    BUILD_METRICS.reset()
+    if dashboards_config is not None:
+        render_dashboards(load_dashboard_configs(dashboards_config), {record.ticker: record for record in companies},
+                          chart_formats, chart_mode, full_rebuild=full_rebuild, optimize_assets=optimize_assets,
+                          portfolios=portfolios)
+        return
+    write_site_assets(chart_mode)
+    render_site_pages(companies, PAGE_TITLE, chart_formats, multi_page=multi_page, full_rebuild=full_rebuild,
+                      chart_mode=chart_mode, portfolio=portfolios.get('default'))
+    if optimize_assets:
+        build_deploy_output()
+
+
+# --- Varios dashboards con una sola capa de datos ---
+# --dashboards dashboards.json construye varios dashboards que comparten tickers. Formato:
+#   {"dashboards": [{"name": "urbana", "title": "<b>Public Tenants Urbana</b>",
+#                    "tickers": "tickers.txt", "output_dir": "public", "multi_page": false}, ...]}
+# Los datos, resúmenes y gráficos se obtienen una sola vez para la unión de los tickers (los
+# gráficos en public/img y public/data, como siempre) y luego cada dashboard se renderiza en su
+# directorio con sus tickers; los gráficos se enlazan (hard link) en lugar de copiarse.
+# Las rutas relativas de "tickers" se resuelven respecto al directorio del archivo de configuración.
+DASHBOARDS_DATA_PATH = os.path.join(DATA_DIR, 'dashboards_company_data.json')
+PRICE_CHART_SUFFIXES = ('6m', '1y', '5y')
+
+@dataclass(slots=True)
+class DashboardConfig:
+    name: str
+    title: str
+    tickers: list
+    output_dir: str = 'public'
+    multi_page: bool = False
+
+def load_dashboard_configs(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f).get('dashboards', [])
+    if not entries:
+        raise ValueError(f"{path} no define ningún dashboard en la clave 'dashboards'.")
+    dashboards = []
+    config_dir = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        missing = [key for key in ('name', 'tickers', 'output_dir') if key not in entry]
+        if missing:
+            raise ValueError(f"Dashboard {entry.get('name', '?')} en {path}: faltan las claves {', '.join(missing)}.")
+        # Los archivos de tickers se resuelven respecto al archivo de configuración, no al directorio actual
+        tickers_path = entry['tickers']
+        if not os.path.isabs(tickers_path):
+            tickers_path = os.path.join(config_dir, tickers_path)
+        dashboards.append(DashboardConfig(name=entry['name'], title=entry.get('title', entry['name']),
+                                          tickers=read_tickers(tickers_path),
+                                          output_dir=os.path.normpath(entry['output_dir']),
+                                          multi_page=bool(entry.get('multi_page', False))))
+    output_dirs = [dashboard.output_dir for dashboard in dashboards]
+    if len(set(output_dirs)) != len(output_dirs):
+        raise ValueError(f"Los dashboards de {path} deben tener directorios de salida distintos.")
+    return dashboards
+
+def union_tickers(dashboards):
+    """Tickers de todos los dashboards sin repetir, en orden de primera aparición."""
+    return list(dict.fromkeys(ticker for dashboard in dashboards for ticker in dashboard.tickers))
+
+def link_shared_charts(tickers, output_dir, chart_formats, chart_mode):
+    """
+    Enlaza en output_dir los gráficos (o los datos de precios en modo client) de esos tickers
+    generados en public/, y elimina los de tickers que ya no pertenecen al dashboard.
+    """
+    if os.path.abspath(output_dir) == os.path.abspath('public'):
+        return
+    if chart_mode == 'client':
+        wanted = {f'data/{ticker}.bin' for ticker in tickers}
+    else:
+        wanted = {f'img/{ticker}_{suffix}.{fmt}' for ticker in tickers
+                  for suffix in PRICE_CHART_SUFFIXES + ('financial',) for fmt in chart_formats}
+    for path in sorted(wanted):
+        source, target = os.path.join('public', path), os.path.join(output_dir, path)
+        if not os.path.exists(source) or (os.path.exists(target) and os.path.samefile(source, target)):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temporary = f'{target}.tmp'
+        try:
+            os.link(source, temporary)
+        except OSError:
+            shutil.copyfile(source, temporary)  # Otro sistema de archivos: copia
+        os.replace(temporary, target)
+    for directory in ('img', 'data'):
+        directory_path = os.path.join(output_dir, directory)
+        if not os.path.isdir(directory_path):
+            continue
+        for filename in os.listdir(directory_path):
+            if f'{directory}/{filename}' not in wanted:
+                os.remove(os.path.join(directory_path, filename))
+
+def render_dashboards(dashboards, records_by_ticker, chart_formats, chart_mode, full_rebuild=False, optimize_assets=False,
+                      portfolios=None):
+    """portfolios: analítica de la cartera por nombre de dashboard (sin página de cartera si falta)."""
+    portfolios = portfolios or {}
+    for dashboard in dashboards:
+        print(f"\n--- Dashboard '{dashboard.name}' ({len(dashboard.tickers)} tickers) en {dashboard.output_dir}/ ---")
+        companies = [records_by_ticker[ticker] for ticker in dashboard.tickers if ticker in records_by_ticker]
+        link_shared_charts(dashboard.tickers, dashboard.output_dir, chart_formats, chart_mode)
+        write_site_assets(chart_mode, dashboard.output_dir)
+        render_site_pages(companies, dashboard.title, chart_formats, multi_page=dashboard.multi_page,
+                          full_rebuild=full_rebuild, chart_mode=chart_mode, output_dir=dashboard.output_dir,
+                          portfolio=portfolios.get(dashboard.name))
+        if optimize_assets:
+            with timed_stage('deploy_assets', ticker=BUILD_SCOPE):
+                build_deploy_output(dashboard.output_dir, os.path.join(DEPLOY_DIR, dashboard.name))
+
+def generate_dashboards(config_path, concurrent=False, batch_summaries=False, full_rebuild=False, chart_formats=None,
+                        chart_mode=None, optimize_assets=False):
+    """Construye todos los dashboards de config_path con una sola obtención de datos por ticker."""
+    BUILD_METRICS.reset()
+    chart_formats, chart_mode = resolve_chart_options(chart_formats, chart_mode)
+    dashboards = load_dashboard_configs(config_path)
+    tickers = union_tickers(dashboards)
+    total = sum(len(dashboard.tickers) for dashboard in dashboards)
+    print(f"Construyendo {len(dashboards)} dashboards: {total} tickers en total, {len(tickers)} distintos.")
+
+    price_histories = load_price_history(tickers)
+    companies = collect_company_records(tickers, price_histories, concurrent=concurrent, batch_summaries=batch_summaries,
+                                        full_rebuild=full_rebuild, chart_formats=chart_formats, chart_mode=chart_mode)
+    record_ticker_data_hashes(companies)
+    records_by_ticker = {record.ticker: record for record in companies}
+
+    # Analítica de cada dashboard sobre su propio subconjunto (el índice de referencia se descarga una vez)
+    with timed_stage('portfolio_analytics', ticker=BUILD_SCOPE):
+        benchmark_series = load_benchmark_series()
+        portfolios = {
+            dashboard.name: compute_portfolio_analytics(
+                price_histories, [records_by_ticker[t] for t in dashboard.tickers if t in records_by_ticker],
+                benchmark_series)
+            for dashboard in dashboards
+        }
+
+    render_dashboards(dashboards, records_by_ticker, chart_formats, chart_mode,
+                      full_rebuild=full_rebuild, optimize_assets=optimize_assets, portfolios=portfolios)
+    save_company_data(companies, chart_formats, chart_mode, path=DASHBOARDS_DATA_PATH, portfolios=portfolios)
+    print(f"\nDashboards generados: {', '.join(f'{d.name} ({d.output_dir}/)' for d in dashboards)}")
+    write_build_report(options={
+        'dashboards': [dashboard.name for dashboard in dashboards], 'concurrent': concurrent,
+        'batch_summaries': batch_summaries, 'full_rebuild': full_rebuild, 'chart_formats': chart_formats,
+        'chart_mode': chart_mode, 'optimize_assets': optimize_assets, 'tickers': len(tickers),
+    })
+
+
+# --- Modo servidor (Flask): datos en memoria y actualizaciones programadas ---
+# python main.py --serve abre el puerto enseguida y construye los datos en segundo plano
+# (hasta entonces las páginas responden 503 con una página de espera), y después los
+# mantiene en memoria. Las páginas se renderizan desde memoria (una vez por versión de los
+# datos) y se sirven con ETag; los gráficos, la hoja de estilos y los datos de precios se
+# sirven desde public/. La aplicación se sirve con waitress (servidor WSGI de producción).
+# Tres tareas en segundo plano actualizan los registros con su propia frecuencia:
+#   precios (descarga en bloque incremental, variaciones y gráficos de precios),
+#   fundamentales (info y estados financieros, con su cache) y noticias/resúmenes.
+# Estas tareas necesitan CPU entre peticiones: en Cloud Run hay que desplegar con la CPU
+# siempre asignada (--no-cpu-throttling) y al menos una instancia (--min-instances=1);
+# con CPU solo durante las peticiones las actualizaciones se quedan paradas. En Replit se
+# despliega como Reserved VM (deploymentTarget = "gce" en .replit) por el mismo motivo.
+SERVER_PORT = int(os.environ.get('PORT', 81))
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+# Segundos entre reintentos si la construcción inicial del servidor falla
+INITIAL_BUILD_RETRY_SECONDS = float(os.environ.get('INITIAL_BUILD_RETRY_SECONDS', 300))
+PRICE_REFRESH_MINUTES = float(os.environ.get('PRICE_REFRESH_MINUTES', 5))
+FUNDAMENTALS_REFRESH_HOURS = float(os.environ.get('FUNDAMENTALS_REFRESH_HOURS', 24))
+NEWS_REFRESH_MINUTES = float(os.environ.get('NEWS_REFRESH_MINUTES', 60))
+
+class DashboardState:
+    """Registros, historiales y páginas renderizadas que comparten el servidor y las tareas."""
+    def __init__(self, tickers, chart_formats, chart_mode, multi_page=False):
+        self.lock = threading.Lock()
+        self.tickers = tickers
+        self.chart_formats = chart_formats
+        self.chart_mode = chart_mode
+        self.multi_page = multi_page
+        self.records = {}  # ticker -> CompanyRecord; se reemplazan, nunca se modifican in situ
+        self.price_histories = {}
+        self.portfolio = None  # analítica de la cartera; se recalcula con cada actualización de precios
+        self.version = 0
+        self.refreshed_at = {}  # tarea -> fecha (epoch) de su última ejecución
+        self.ready = threading.Event()  # se activa al terminar la construcción inicial
+        self._pages = {}  # página -> (versión, html, etag)
+
+    def companies(self):
+        with self.lock:
+            return [self.records[ticker] for ticker in self.tickers if ticker in self.records]
+
+    def set_records(self, records, job):
+        with self.lock:
+            for record in records:
+                self.records[record.ticker] = record
+            self.version += 1
+            self.refreshed_at[job] = time.time()
+
+    def update_records(self, changes, job):
+        """changes: {ticker: {campo: valor}}; se aplican sobre el registro vigente para no pisar otras tareas."""
+        with self.lock:
+            for ticker, fields_changed in changes.items():
+                if ticker in self.records:
+                    self.records[ticker] = self.records[ticker].updated(**fields_changed)
+            self.version += 1
+            self.refreshed_at[job] = time.time()
+
+    def page(self, name):
+        """(html, etag) de la página 'index', 'cartera' o 'empresa:<ticker>', renderizada una vez por versión."""
+        with self.lock:
+            cached = self._pages.get(name)
+            if cached is not None and cached[0] == self.version:
+                return cached[1], cached[2]
+            version = self.version
+        html = self._render(name)
+        etag = hashlib.sha256(html.encode('utf-8')).hexdigest()[:32]
+        with self.lock:
+            self._pages[name] = (version, html, etag)
+        return html, etag
+
+    def _render(self, name):
+        companies = self.companies()
+        portfolio = self.portfolio
+        context = dict(page_title=PAGE_TITLE, chart_formats=self.chart_formats, chart_mime_types=CHART_MIME_TYPES,
+                       company_pages=self.multi_page)
+        with timed_stage('jinja_render', ticker=BUILD_SCOPE):
+            if name == 'cartera':
+                return env.get_template('portfolio.html').render(portfolio=portfolio, base_path='', **context)
+            context['portfolio_page'] = portfolio is not None
+            if name.startswith('empresa:'):
+                company = self.records[name.split(':', 1)[1]]
+                return env.get_template('company.html').render(company=company, base_path='../',
+                                                               chart_mode=self.chart_mode, **context)
+            if self.multi_page:
+                # Como en render_site_pages, el índice multipágina no lleva gráficos
+                return env.get_template('summary.html').render(companies=companies, base_path='', **context)
+            return env.get_template('index.html').render(companies=companies, base_path='',
+                                                         chart_mode=self.chart_mode, **context)
+
+def refresh_price_charts(ticker, hist, chart_formats, chart_mode):
+    if chart_mode == 'client':
+        write_price_data(ticker, hist)
+        return
+    with metrics_ticker(ticker), timed_stage('charts'):
+        generate_chart(slice_history(hist, '6mo'), f'Precio de Cierre (6 Meses) - {ticker}', f'{ticker}_6m', period='6mo', formats=chart_formats)
+        generate_chart(slice_history(hist, '1y'), f'Precio de Cierre (1 Año) - {ticker}', f'{ticker}_1y', period='1y', formats=chart_formats)
+        generate_chart(slice_history(hist, '5y'), f'Precio de Cierre (5 Años) - {ticker}', f'{ticker}_5y', period='5y', formats=chart_formats)
+
+def refresh_prices(state):
+    """Precios actuales (PriceSeries.last_close, como en la construcción completa), variaciones y gráficos."""
+    price_histories = load_price_history(state.tickers)
+    updates = {}
+    for chunk in chunked(state.tickers):
+        close_matrix = build_close_matrix(price_histories, chunk)
+        histories = {ticker: price_histories.get(ticker) for ticker in chunk if ticker in price_histories}
+        current_prices = pd.Series({ticker: hist.last_close() for ticker, hist in histories.items()}, dtype=float)
+        changes = compute_percentage_changes(compute_anchor_prices(close_matrix), current_prices)
+        for ticker, hist in histories.items():
+            if hist.empty:
+                continue
+            try:
+                refresh_price_charts(ticker, hist, state.chart_formats, state.chart_mode)
+            except Exception as e:
+                print(f"Error al actualizar los gráficos de precios de {ticker}: {e}")
+            updates[ticker] = {'current_price': current_prices.get(ticker), 'changes': changes.loc[ticker].to_dict()}
+    with timed_stage('portfolio_analytics', ticker=BUILD_SCOPE):
+        portfolio = compute_portfolio_analytics(price_histories, state.companies(), load_benchmark_series())
+    with state.lock:
+        state.price_histories = price_histories
+        state.portfolio = portfolio
+    state.update_records(updates, 'prices')
+
+def refresh_fundamentals(state):
+    """Nombre, sector e industria (info) y estados financieros; estos últimos pasan por su cache."""
+    updates = {}
+    for record in state.companies():
+        ticker = record.ticker
+        try:
+            stock = yf.Ticker(ticker)
+            with metrics_ticker(ticker), PROVIDER_LIMITERS['yahoo'], timed_stage('yahoo_info'):
+                info = stock.info
+            with metrics_ticker(ticker):
+                financials, cash_flow = load_fundamentals(ticker, stock, info)
+            if state.chart_mode == 'client':
+                financial_chart = financial_chart_data(financials, ticker)
+            else:
+                financial_chart = None
+                with metrics_ticker(ticker), timed_stage('charts'):
+                    generate_financial_chart(financials, ticker, formats=state.chart_formats)
+            updates[ticker] = {
+                'name': info.get('longName', ticker),
+                'sector': info.get('sector', 'N/A'),
+                'industry': info.get('industry', 'N/A'),
+                'operating_income': latest_statement_value(financials, 'Operating Income'),
+                'net_income': latest_statement_value(financials, 'Net Income'),
+                'ebitda': latest_statement_value(cash_flow, 'EBITDA'),
+                'financial_chart': financial_chart,
+            }
+        except Exception as e:
+            print(f"Error al actualizar los fundamentales de {ticker}: {e}")
+    state.update_records(updates, 'fundamentals')
+
+def refresh_news(state):
+    """Noticias y resumen de Gemini de cada empresa con sus datos vigentes."""
+    updates = {}
+    for record in state.companies():
+        with metrics_ticker(record.ticker):
+            news_summary, news_articles = get_news_summary_with_gemini(
+                company_name=record.name, ticker=record.ticker, max_links=3,
+                current_price=record.current_price, change_1y=record.changes.get('1y'),
+                operating_income=record.operating_income, net_income=record.net_income)
+        updates[record.ticker] = {'news_summary': news_summary, 'news_articles': news_articles}
+    state.update_records(updates, 'news')
+
+def schedule_refresh(name, interval_seconds, job, state, stop_event):
+    """Ejecuta job(state) cada interval_seconds en un hilo en segundo plano hasta que se active stop_event."""
+    def loop():
+        while not stop_event.wait(interval_seconds):
+            started = time.time()
+            try:
+                job(state)
+                print(f"Actualización '{name}' completada en {time.time() - started:.1f} s.")
+            except Exception as e:
+                print(f"ERROR EN LA ACTUALIZACIÓN '{name}': {e}")
+    thread = threading.Thread(target=loop, name=f'refresh-{name}', daemon=True)
+    thread.start()
+    return thread
+
+def create_app(state):
+    from flask import Flask, Response, abort, jsonify, request, send_from_directory
+
+    app = Flask(__name__, static_folder=None)
+    public_dir = os.path.abspath('public')
+
+    def page_response(name):
+        if not state.ready.is_set():
+            html = env.get_template('building.html').render(page_title=PAGE_TITLE, base_path='')
+            return Response(html, status=503, mimetype='text/html', headers={'Retry-After': '30'})
+        html, etag = state.page(name)
+        response = Response(html, mimetype='text/html')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'  # Revalidar siempre: con ETag la respuesta es un 304
+        return response.make_conditional(request)
+
+    @app.route('/')
+    @app.route('/index.html')
+    def index():
+        return page_response('index')
+
+    @app.route('/empresas/<ticker>.html')
+    def company_page(ticker):
+        if not state.multi_page or (state.ready.is_set() and ticker not in state.records):
+            abort(404)
+        return page_response(f'empresa:{ticker}')
+
+    @app.route(f'/{PORTFOLIO_PAGE}')
+    def portfolio_page():
+        if state.ready.is_set() and state.portfolio is None:
+            abort(404)
+        return page_response('cartera')
+
+    @app.route('/healthz')
+    def healthz():
+        # Responde 200 también durante la construcción inicial para que no fallen las sondas de arranque
+        with state.lock:
+            return jsonify(status='ok' if state.ready.is_set() else 'building', version=state.version,
+                           tickers=len(state.records), refreshed_at=state.refreshed_at)
+
+    @app.route('/<path:filename>')
+    def public_file(filename):
+        # Gráficos, CSS, JS y datos de precios; send_from_directory responde con ETag y Last-Modified
+        return send_from_directory(public_dir, filename)
+
+    return app
+
+def build_initial_state(state, stop_event, concurrent=False, batch_summaries=False):
+    """
+    Construye los datos iniciales del servidor (con el puerto ya abierto) y después programa
+    las actualizaciones. Si la construcción falla, se reintenta cada INITIAL_BUILD_RETRY_SECONDS.
+    """
+    while not stop_event.is_set():
+        print("Construyendo los datos iniciales del servidor...")
+        started = time.time()
+        try:
+            BUILD_METRICS.reset()
+            price_histories = load_price_history(state.tickers)
+            records = collect_company_records(state.tickers, price_histories, concurrent=concurrent,
+                                              batch_summaries=batch_summaries, chart_formats=state.chart_formats,
+                                              chart_mode=state.chart_mode)
+            write_site_assets(state.chart_mode)
+            portfolio = compute_portfolio_analytics(price_histories, records, load_benchmark_series())
+            with state.lock:
+                state.price_histories = price_histories
+                state.portfolio = portfolio
+            state.set_records(records, 'initial')
+            write_build_report(options={'serve': True, 'concurrent': concurrent, 'batch_summaries': batch_summaries,
+                                        'chart_formats': state.chart_formats, 'chart_mode': state.chart_mode,
+                                        'tickers': len(state.tickers)})
+            break
+        except Exception as e:
+            print(f"ERROR EN LA CONSTRUCCIÓN INICIAL DEL SERVIDOR: {e}; se reintentará en {INITIAL_BUILD_RETRY_SECONDS:.0f} s.")
+            if stop_event.wait(INITIAL_BUILD_RETRY_SECONDS):
+                return
+    else:
+        return
+    state.ready.set()
+    print(f"Datos iniciales del servidor listos en {time.time() - started:.1f} s.")
+
+    schedule_refresh('precios', PRICE_REFRESH_MINUTES * 60, refresh_prices, state, stop_event)
+    schedule_refresh('fundamentales', FUNDAMENTALS_REFRESH_HOURS * 3600, refresh_fundamentals, state, stop_event)
+    schedule_refresh('noticias', NEWS_REFRESH_MINUTES * 60, refresh_news, state, stop_event)
+
+def serve(concurrent=False, batch_summaries=False, chart_formats=None, chart_mode=None, multi_page=False, port=SERVER_PORT):
+    global NEWS_CACHE_MAX_AGE_HOURS
+    chart_formats, chart_mode = resolve_chart_options(chart_formats, chart_mode)
+    if 'NEWS_CACHE_MAX_AGE_HOURS' not in os.environ:
+        # Que la cache de NewsAPI no impida la actualización horaria de las noticias
+        NEWS_CACHE_MAX_AGE_HOURS = NEWS_REFRESH_MINUTES / 60
+    state = DashboardState(read_tickers(), chart_formats, chart_mode, multi_page)
+    stop_event = threading.Event()
+    threading.Thread(target=build_initial_state, args=(state, stop_event, concurrent, batch_summaries),
+                     name='initial-build', daemon=True).start()
+
+    from waitress import serve as serve_wsgi
+    print(f"Servidor del dashboard escuchando en el puerto {port}.")
+    try:
+        serve_wsgi(create_app(state), host='0.0.0.0', port=port, threads=SERVER_THREADS)
+    finally:
+        stop_event.set()
 
 # Ejecutar la función principal
 if __name__ == '__main__':
-    generate_static_site()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Genera el dashboard estático en la carpeta 'public/'.")
+    parser.add_argument('--concurrent', action='store_true',
+                        help='Procesa los tickers en paralelo respetando los límites de cada proveedor.')
+    parser.add_argument('--batch-summaries', action='store_true',
+                        help='Pide los resúmenes de Gemini por lotes de varias empresas (respuesta JSON).')
+    parser.add_argument('--chart-formats', default=','.join(CHART_FORMATS),
+                        help="Formatos de los gráficos separados por comas, en orden de preferencia "
+                             "(png, webp, svg). Ej.: 'webp,png' genera <picture> con WebP y PNG de respaldo.")
+    parser.add_argument('--chart-mode', choices=CHART_MODES, default=CHART_MODE,
+                        help="'images' genera los gráficos con matplotlib; 'client' escribe los precios "
+                             "en public/data/ y los gráficos se dibujan en el navegador.")
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help='Regenera todos los archivos aunque el manifiesto indique que no cambiaron.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Perfila con cProfile la fase de renderizado y guarda las estadísticas.')
+    parser.add_argument('--multi-page', action='store_true',
+                        help='Genera un índice con la tabla resumen y una página por empresa en public/empresas/.')
+    parser.add_argument('--serve', action='store_true',
+                        help='Modo servidor: mantiene los datos en memoria, sirve el dashboard con Flask y lo '
+                             'actualiza periódicamente (precios, fundamentales y noticias).')
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help='Puerto del modo servidor (por defecto $PORT u 81).')
+    parser.add_argument('--render-only', action='store_true',
+                        help='Solo vuelve a renderizar el HTML con los datos de la última construcción '
+                             '(sin claves de API ni consultas a proveedores).')
+    parser.add_argument('--optimize-assets', action='store_true',
+                        help='Copia public/ a DEPLOY_DIR (dist/ por defecto) con recursos con hash en el nombre, '
+                             'versiones .gz/.br y un manifiesto de cabeceras de cache.')
+    parser.add_argument('--dashboards', metavar='CONFIG',
+                        help='Construye todos los dashboards de este archivo JSON (cada uno con sus tickers, '
+                             'título y directorio de salida) obteniendo los datos de cada ticker una sola vez.')
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', metavar='CASETE',
+                                help='Graba en este archivo (zip) todas las respuestas de Yahoo, NewsAPI y Gemini '
+                                     'que consume la construcción.')
+    cassette_group.add_argument('--replay', metavar='CASETE',
+                                help='Construye solo con las respuestas grabadas con --record, sin red ni claves.')
+    args = parser.parse_args()
+    if args.render_only:
+        render_only_site(multi_page=args.multi_page, full_rebuild=args.full_rebuild, optimize_assets=args.optimize_assets,
+                         dashboards_config=args.dashboards)
+        raise SystemExit
+    if (args.record or args.replay) and args.serve:
+        parser.error('--record y --replay no se pueden usar con --serve.')
+    cassette = None
+    if args.replay:
+        cassette = use_cassette(args.replay, 'replay')
+    else:
+        configure_providers()
+        if args.record:
+            cassette = use_cassette(args.record, 'record')
+    try:
+        if args.dashboards:
+            generate_dashboards(args.dashboards, concurrent=args.concurrent, batch_summaries=args.batch_summaries,
+                                full_rebuild=args.full_rebuild,
+                                chart_formats=[fmt.strip() for fmt in args.chart_formats.split(',') if fmt.strip()],
+                                chart_mode=args.chart_mode, optimize_assets=args.optimize_assets)
+            raise SystemExit
+        if args.serve:
+            serve(concurrent=args.concurrent, batch_summaries=args.batch_summaries,
+                  chart_formats=[fmt.strip() for fmt in args.chart_formats.split(',') if fmt.strip()],
+                  chart_mode=args.chart_mode, multi_page=args.multi_page, port=args.port)
+            raise SystemExit
+        generate_static_site(concurrent=args.concurrent, batch_summaries=args.batch_summaries,
+                             full_rebuild=args.full_rebuild,
+                             chart_formats=[fmt.strip() for fmt in args.chart_formats.split(',') if fmt.strip()],
+                             profile=args.profile, multi_page=args.multi_page, chart_mode=args.chart_mode,
+                             optimize_assets=args.optimize_assets)
+    finally:
+        # También si la construcción falla: el casete sirve justo para reproducir esos fallos
+        if args.record:
+            cassette.save()
\ No newline at end of file
@@ -0,0 +1,405 @@
+/*
+ * Gráficos interactivos del dashboard (CHART_MODE=client).
+ *
+ * Cada <canvas class="price-chart" data-src="data/<ticker>.bin"> descarga el historial
+ * completo de cierres en el formato binario PXS1 que escribe main.py (encode_price_series)
+ * cuando entra en pantalla, y lo dibuja para la ventana elegida con los botones
+ * (6m, 1y, 5y, Máx.). Arrastrando sobre el gráfico se amplía un rango; doble clic vuelve
+ * a la ventana activa. Cada <canvas class="financial-chart" data-chart='{...}'> dibuja las
+ * barras de Ingresos Operativos y Beneficio Neto a partir del JSON embebido.
+ */
+(function () {
+    'use strict';
+
+    var DAY_MS = 86400000;
+    var RANGE_DAYS = { '6m': 182, '1y': 365, '5y': 5 * 365, 'max': Infinity };
+    var COLORS = {
+        background: '#F9F9F9', grid: '#DDDDDD', text: '#555555', title: '#333333',
+        line: '#4CAF50', selection: 'rgba(76, 175, 80, 0.15)'
+    };
+    var MARGIN = { left: 70, right: 15, top: 36, bottom: 40 };
+
+    // --- Decodificación del formato PXS1 (ver encode_price_series en main.py) ---
+    function decodePriceSeries(buffer) {
+        var view = new DataView(buffer);
+        var magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+        if (magic !== 'PXS1') {
+            throw new Error('Formato de precios desconocido: ' + magic);
+        }
+        var n = view.getUint32(4, true);
+        var times = new Float64Array(n);
+        var values = new Float64Array(n);
+        if (n === 0) {
+            return { times: times, values: values };
+        }
+        var day = view.getInt32(8, true);
+        var scale = view.getInt32(12, true);
+        var units = view.getInt32(16, true);
+        var valueOffset = 20;
+        var dayOffset = valueOffset + 4 * (n - 1);
+        times[0] = day * DAY_MS;
+        values[0] = units / scale;
+        for (var i = 1; i < n; i++) {
+            units += view.getInt32(valueOffset + 4 * (i - 1), true);
+            day += view.getUint16(dayOffset + 2 * (i - 1), true);
+            times[i] = day * DAY_MS;
+            values[i] = units / scale;
+        }
+        return { times: times, values: values };
+    }
+
+    // --- Utilidades de dibujo ---
+    function setupCanvas(canvas) {
+        var ratio = window.devicePixelRatio || 1;
+        var width = canvas.clientWidth || 600;
+        var height = canvas.clientHeight || Math.round(width * 0.6);
+        if (canvas.width !== Math.round(width * ratio) || canvas.height !== Math.round(height * ratio)) {
+            canvas.width = Math.round(width * ratio);
+            canvas.height = Math.round(height * ratio);
+        }
+        var ctx = canvas.getContext('2d');
+        ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+        ctx.clearRect(0, 0, width, height);
+        ctx.fillStyle = COLORS.background;
+        ctx.fillRect(0, 0, width, height);
+        return { ctx: ctx, width: width, height: height };
+    }
+
+    // Marcas "redondas" (1, 2, 5 x 10^k) entre min y max
+    function niceTicks(min, max, count) {
+        if (!(max > min)) {
+            return [min];
+        }
+        var rawStep = (max - min) / count;
+        var magnitude = Math.pow(10, Math.floor(Math.log10(rawStep)));
+        var step = [1, 2, 5, 10].map(function (m) { return m * magnitude; })
+            .filter(function (s) { return s >= rawStep; })[0];
+        var ticks = [];
+        for (var tick = Math.ceil(min / step) * step; tick <= max + step * 1e-9; tick += step) {
+            ticks.push(tick);
+        }
+        return ticks;
+    }
+
+    function formatPrice(value) {
+        return '$' + value.toLocaleString('en-US', { maximumFractionDigits: value < 10 ? 2 : 0 });
+    }
+
+    // Mismo formato que format_financial_value en main.py
+    function formatFinancial(value) {
+        var abs = Math.abs(value);
+        if (abs >= 1e9) return '$' + (value / 1e9).toFixed(2) + 'B';
+        if (abs >= 1e6) return '$' + (value / 1e6).toFixed(2) + 'M';
+        return '$' + value.toLocaleString('en-US', { maximumFractionDigits: 2 });
+    }
+
+    function formatDate(ms, spanDays) {
+        var date = new Date(ms);
+        var month = ('0' + (date.getUTCMonth() + 1)).slice(-2);
+        var label = date.getUTCFullYear() + '-' + month;
+        return spanDays < 120 ? label + '-' + ('0' + date.getUTCDate()).slice(-2) : label;
+    }
+
+    function drawTitle(ctx, title, width) {
+        ctx.fillStyle = COLORS.title;
+        ctx.font = '15px "Helvetica Neue", Arial, sans-serif';
+        ctx.textAlign = 'center';
+        ctx.textBaseline = 'middle';
+        ctx.fillText(title, width / 2, MARGIN.top / 2);
+    }
+
+    function drawYAxis(ctx, ticks, toY, width, format) {
+        ctx.strokeStyle = COLORS.grid;
+        ctx.fillStyle = COLORS.text;
+        ctx.font = '11px "Helvetica Neue", Arial, sans-serif';
+        ctx.textAlign = 'right';
+        ctx.textBaseline = 'middle';
+        ctx.setLineDash([4, 4]);
+        ticks.forEach(function (tick) {
+            var y = Math.round(toY(tick)) + 0.5;
+            ctx.beginPath();
+            ctx.moveTo(MARGIN.left, y);
+            ctx.lineTo(width - MARGIN.right, y);
+            ctx.stroke();
+            ctx.fillText(format(tick), MARGIN.left - 6, y);
+        });
+        ctx.setLineDash([]);
+    }
+
+    // Primer índice con times[i] >= target (búsqueda binaria)
+    function lowerBound(times, target) {
+        var lo = 0, hi = times.length;
+        while (lo < hi) {
+            var mid = (lo + hi) >>> 1;
+            if (times[mid] < target) lo = mid + 1; else hi = mid;
+        }
+        return lo;
+    }
+
+    // --- Gráfico de precios ---
+    function PriceChart(canvas) {
+        this.canvas = canvas;
+        this.title = canvas.getAttribute('data-title') || '';
+        this.range = canvas.getAttribute('data-range') || '1y';
+        this.buttons = canvas.parentNode.querySelectorAll('.chart-ranges button');
+        this.series = null;
+        this.view = null;       // [inicio, fin] en milisegundos
+        this.dragStart = null;
+        this.hoverX = null;
+    }
+
+    PriceChart.prototype.load = function () {
+        var chart = this;
+        return fetch(this.canvas.getAttribute('data-src'))
+            .then(function (response) {
+                if (!response.ok) throw new Error('HTTP ' + response.status);
+                return response.arrayBuffer();
+            })
+            .then(function (buffer) {
+                chart.series = decodePriceSeries(buffer);
+                chart.bindEvents();
+                chart.setRange(chart.range);
+            })
+            .catch(function (error) {
+                var surface = setupCanvas(chart.canvas);
+                surface.ctx.fillStyle = COLORS.text;
+                surface.ctx.textAlign = 'center';
+                surface.ctx.fillText('No se pudieron cargar los precios (' + error.message + ')',
+                                     surface.width / 2, surface.height / 2);
+            });
+    };
+
+    PriceChart.prototype.setRange = function (range) {
+        var times = this.series.times;
+        this.range = range;
+        if (times.length) {
+            var end = times[times.length - 1];
+            var days = RANGE_DAYS[range] || RANGE_DAYS['1y'];
+            this.view = [isFinite(days) ? Math.max(times[0], end - days * DAY_MS) : times[0], end];
+        }
+        Array.prototype.forEach.call(this.buttons, function (button) {
+            button.classList.toggle('active', button.getAttribute('data-range') === range);
+        });
+        this.draw();
+    };
+
+    PriceChart.prototype.plotArea = function () {
+        var width = this.canvas.clientWidth, height = this.canvas.clientHeight;
+        return { left: MARGIN.left, right: width - MARGIN.right, top: MARGIN.top, bottom: height - MARGIN.bottom };
+    };
+
+    PriceChart.prototype.timeAt = function (clientX) {
+        var area = this.plotArea();
+        var x = clientX - this.canvas.getBoundingClientRect().left;
+        var fraction = Math.min(1, Math.max(0, (x - area.left) / (area.right - area.left)));
+        return this.view[0] + fraction * (this.view[1] - this.view[0]);
+    };
+
+    PriceChart.prototype.bindEvents = function () {
+        var chart = this;
+        Array.prototype.forEach.call(this.buttons, function (button) {
+            button.addEventListener('click', function () { chart.setRange(button.getAttribute('data-range')); });
+        });
+        this.canvas.addEventListener('mousedown', function (event) {
+            chart.dragStart = chart.timeAt(event.clientX);
+            chart.dragEnd = chart.dragStart;
+        });
+        this.canvas.addEventListener('mousemove', function (event) {
+            chart.hoverX = event.clientX;
+            if (chart.dragStart !== null) chart.dragEnd = chart.timeAt(event.clientX);
+            chart.draw();
+        });
+        this.canvas.addEventListener('mouseleave', function () {
+            chart.hoverX = null;
+            chart.dragStart = null;
+            chart.draw();
+        });
+        window.addEventListener('mouseup', function () {
+            if (chart.dragStart === null) return;
+            var start = Math.min(chart.dragStart, chart.dragEnd);
+            var end = Math.max(chart.dragStart, chart.dragEnd);
+            chart.dragStart = null;
+            // Ampliar solo si el rango seleccionado cubre al menos unos días
+            if (end - start > 3 * DAY_MS) chart.view = [start, end];
+            chart.draw();
+        });
+        this.canvas.addEventListener('dblclick', function () { chart.setRange(chart.range); });
+        window.addEventListener('resize', function () { chart.draw(); });
+    };
+
+    PriceChart.prototype.draw = function () {
+        var surface = setupCanvas(this.canvas);
+        var ctx = surface.ctx;
+        var area = this.plotArea();
+        drawTitle(ctx, this.title, surface.width);
+        var times = this.series.times, values = this.series.values;
+        var first = lowerBound(times, this.view[0]);
+        var last = Math.min(times.length, lowerBound(times, this.view[1] + 1));
+        if (last - first < 1) return;
+
+        var min = Infinity, max = -Infinity;
+        for (var i = first; i < last; i++) {
+            if (values[i] < min) min = values[i];
+            if (values[i] > max) max = values[i];
+        }
+        var padding = (max - min) * 0.05 || Math.abs(max) * 0.05 || 1;
+        min -= padding;
+        max += padding;
+        var span = this.view[1] - this.view[0] || DAY_MS;
+        var view = this.view;
+        var toX = function (t) { return area.left + (t - view[0]) / span * (area.right - area.left); };
+        var toY = function (v) { return area.bottom - (v - min) / (max - min) * (area.bottom - area.top); };
+
+        drawYAxis(ctx, niceTicks(min, max, 5), toY, surface.width, formatPrice);
+        ctx.fillStyle = COLORS.text;
+        ctx.textAlign = 'center';
+        ctx.textBaseline = 'top';
+        var spanDays = span / DAY_MS;
+        var labelCount = Math.max(2, Math.floor((area.right - area.left) / 90));
+        for (var k = 0; k <= labelCount; k++) {
+            var t = view[0] + span * k / labelCount;
+            ctx.fillText(formatDate(t, spanDays), toX(t), area.bottom + 8);
+        }
+
+        // Un trazo por columna de píxeles (mínimo y máximo) para series de miles de puntos
+        ctx.save();
+        ctx.beginPath();
+        ctx.rect(area.left, area.top, area.right - area.left, area.bottom - area.top);
+        ctx.clip();
+        ctx.strokeStyle = COLORS.line;
+        ctx.lineWidth = 1.5;
+        ctx.beginPath();
+        var column = null, columnMin = 0, columnMax = 0, started = false;
+        for (var j = first; j < last; j++) {
+            var x = Math.round(toX(times[j]));
+            if (x !== column) {
+                if (column !== null) {
+                    ctx.lineTo(column, toY(columnMin));
+                    ctx.lineTo(column, toY(columnMax));
+                }
+                column = x;
+                columnMin = columnMax = values[j];
+                if (!started) {
+                    ctx.moveTo(x, toY(values[j]));
+                    started = true;
+                }
+            } else {
+                if (values[j] < columnMin) columnMin = values[j];
+                if (values[j] > columnMax) columnMax = values[j];
+            }
+        }
+        if (column !== null) {
+            ctx.lineTo(column, toY(columnMin));
+            ctx.lineTo(column, toY(columnMax));
+            ctx.lineTo(column, toY(values[last - 1]));
+        }
+        ctx.stroke();
+        ctx.restore();
+
+        if (this.dragStart !== null) {
+            var x0 = toX(Math.min(this.dragStart, this.dragEnd)), x1 = toX(Math.max(this.dragStart, this.dragEnd));
+            ctx.fillStyle = COLORS.selection;
+            ctx.fillRect(x0, area.top, x1 - x0, area.bottom - area.top);
+        } else if (this.hoverX !== null) {
+            var index = Math.min(last - 1, Math.max(first, lowerBound(times, this.timeAt(this.hoverX))));
+            var hx = toX(times[index]), hy = toY(values[index]);
+            ctx.strokeStyle = COLORS.grid;
+            ctx.beginPath();
+            ctx.moveTo(hx, area.top);
+            ctx.lineTo(hx, area.bottom);
+            ctx.stroke();
+            ctx.fillStyle = COLORS.line;
+            ctx.beginPath();
+            ctx.arc(hx, hy, 3, 0, 2 * Math.PI);
+            ctx.fill();
+            ctx.fillStyle = COLORS.title;
+            ctx.textAlign = hx > (area.left + area.right) / 2 ? 'right' : 'left';
+            ctx.textBaseline = 'bottom';
+            ctx.fillText(formatDate(times[index], 0) + '  ' + formatPrice(values[index]),
+                         hx + (ctx.textAlign === 'right' ? -8 : 8), area.top + 14);
+        }
+    };
+
+    // --- Gráfico financiero (barras agrupadas) ---
+    function drawFinancialChart(canvas) {
+        var data = JSON.parse(canvas.getAttribute('data-chart'));
+        var surface = setupCanvas(canvas);
+        var ctx = surface.ctx;
+        var area = { left: MARGIN.left, right: surface.width - MARGIN.right, top: MARGIN.top, bottom: surface.height - MARGIN.bottom };
+        drawTitle(ctx, data.title, surface.width);
+
+        var min = 0, max = 0;
+        data.series.forEach(function (series) {
+            series.values.forEach(function (value) {
+                if (value === null) return;
+                min = Math.min(min, value);
+                max = Math.max(max, value);
+            });
+        });
+        if (max === min) max = min + 1;
+        var ticks = niceTicks(min, max, 5);
+        min = Math.min(min, ticks[0]);
+        max = Math.max(max, ticks[ticks.length - 1]);
+        var toY = function (v) { return area.bottom - (v - min) / (max - min) * (area.bottom - area.top); };
+        drawYAxis(ctx, ticks, toY, surface.width, formatFinancial);
+
+        var slot = (area.right - area.left) / data.labels.length;
+        var barWidth = slot * 0.5 / data.series.length;
+        data.labels.forEach(function (label, i) {
+            var center = area.left + slot * (i + 0.5);
+            data.series.forEach(function (series, s) {
+                var value = series.values[i] || 0;
+                var x = center + (s - (data.series.length - 1) / 2) * barWidth - barWidth / 2;
+                ctx.fillStyle = series.color;
+                ctx.fillRect(x, Math.min(toY(value), toY(0)), barWidth, Math.abs(toY(value) - toY(0)));
+            });
+            ctx.fillStyle = COLORS.text;
+            ctx.textAlign = 'center';
+            ctx.textBaseline = 'top';
+            ctx.fillText(label, center, area.bottom + 8);
+        });
+
+        // Leyenda
+        ctx.textAlign = 'left';
+        ctx.textBaseline = 'middle';
+        data.series.forEach(function (series, s) {
+            var y = area.top + 10 + s * 16;
+            ctx.fillStyle = series.color;
+            ctx.fillRect(area.right - 130, y - 5, 10, 10);
+            ctx.fillStyle = COLORS.text;
+            ctx.fillText(series.name, area.right - 115, y);
+        });
+    }
+
+    // --- Carga diferida: cada gráfico se prepara cuando entra en pantalla ---
+    function initChart(canvas) {
+        if (canvas.classList.contains('price-chart')) {
+            new PriceChart(canvas).load();
+        } else {
+            drawFinancialChart(canvas);
+            window.addEventListener('resize', function () { drawFinancialChart(canvas); });
+        }
+    }
+
+    function init() {
+        var canvases = document.querySelectorAll('canvas.price-chart, canvas.financial-chart');
+        if (!('IntersectionObserver' in window)) {
+            Array.prototype.forEach.call(canvases, initChart);
+            return;
+        }
+        var observer = new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                if (!entry.isIntersecting) return;
+                observer.unobserve(entry.target);
+                initChart(entry.target);
+            });
+        }, { rootMargin: '200px' });
+        Array.prototype.forEach.call(canvases, function (canvas) { observer.observe(canvas); });
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', init);
+    } else {
+        init();
+    }
+})();
@@ -0,0 +1,45 @@
+import types
+
+import main
+
+
+def summary_request(ticker, news_source='newsapi', news=('Título: Noticia', [])):
+    return {'ticker': ticker, 'company_name': f'{ticker} Corp', 'news': news, 'news_source': news_source,
+            'current_price': 10.0, 'change_1y': 5.0, 'operating_income': None, 'net_income': None}
+
+
+def test_only_batched_tickers_count_as_retries(monkeypatch):
+    metrics = []
+    individual_calls = []
+    response = types.SimpleNamespace(text='{"AAA": "Resumen de AAA"}')
+    monkeypatch.setattr(main, 'count_metric', lambda stage, ticker=None, **values: metrics.append((stage, values)))
+    monkeypatch.setattr(main, 'genai', types.SimpleNamespace(GenerativeModel=lambda *args, **kwargs: types.SimpleNamespace(generate_content=None)))
+    monkeypatch.setattr(main, 'call_provider', lambda *args, **kwargs: response)
+    monkeypatch.setattr(main, 'get_cached_summary', lambda prompt: None)
+    monkeypatch.setattr(main, 'store_cached_summary', lambda prompt, summary: None)
+    monkeypatch.setattr(main, 'get_news_summary_with_gemini',
+                        lambda **request: individual_calls.append(request['ticker']) or ('Individual', []))
+
+    requests = [summary_request('AAA'), summary_request('BBB'),
+                summary_request('YHO', news_source='yahoo'), summary_request('NON', news=('', []))]
+    results = main.summarize_news_in_batches(requests, batch_size=5)
+
+    assert results['AAA'] == ('Resumen de AAA', [])
+    assert sorted(individual_calls) == ['BBB', 'NON', 'YHO']
+    assert sum(values.get('retries', 0) for stage, values in metrics if stage == 'gemini') == 1
+
+
+def test_parse_batch_response_keeps_only_valid_entries():
+    text = '{"AAA": " Resumen A ", "BBB": "", "CCC": 42, "ZZZ": "No pedido"}'
+    assert main.parse_batch_summary_response(text, ['AAA', 'BBB', 'CCC', 'DDD']) == {'AAA': 'Resumen A'}
+
+
+def test_parse_batch_response_in_code_fence():
+    text = '```json\n{"AAA": "Resumen A"}\n```'
+    assert main.parse_batch_summary_response(text, ['AAA']) == {'AAA': 'Resumen A'}
+
+
+def test_parse_batch_response_malformed_or_truncated():
+    assert main.parse_batch_summary_response('{"AAA": "Resumen A", "BBB": "Resu', ['AAA', 'BBB']) == {}
+    assert main.parse_batch_summary_response('["Resumen A"]', ['AAA']) == {}
+    assert main.parse_batch_summary_response('', ['AAA']) == {}
@@ -0,0 +1,78 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import main
+
+
+def make_series(days, closes):
+    return main.PriceSeries(np.array(days, dtype=np.int32), np.array(closes, dtype=np.float32))
+
+
+def decode_price_series(payload):
+    """Decodificador del formato PXS1, igual que el de static/charts.js."""
+    assert payload[:4] == main.PRICE_DATA_MAGIC
+    n = int(np.frombuffer(payload, dtype='<u4', count=1, offset=4)[0])
+    first_day, scale, first_value = np.frombuffer(payload, dtype='<i4', count=3, offset=8)
+    if n == 0:
+        return np.array([], dtype=np.int64), np.array([])
+    value_deltas = np.frombuffer(payload, dtype='<i4', count=n - 1, offset=20)
+    day_deltas = np.frombuffer(payload, dtype='<u2', count=n - 1, offset=20 + 4 * (n - 1))
+    days = first_day + np.concatenate([[0], np.cumsum(day_deltas, dtype=np.int64)])
+    values = (first_value + np.concatenate([[0], np.cumsum(value_deltas, dtype=np.int64)])) / scale
+    return days, values
+
+
+def test_lttb_keeps_endpoints_and_threshold_length():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 25.0) * 10 + x / 100.0
+    sampled_x, sampled_y = main.lttb_downsample(x, y, 100)
+    assert len(sampled_x) == len(sampled_y) == 100
+    assert sampled_x[0] == x[0] and sampled_x[-1] == x[-1]
+    assert sampled_y[0] == y[0] and sampled_y[-1] == y[-1]
+    assert np.all(np.diff(sampled_x) > 0)
+
+
+def test_lttb_keeps_the_spike():
+    x = np.arange(500, dtype=float)
+    y = np.zeros(500)
+    y[250] = 100.0
+    _, sampled_y = main.lttb_downsample(x, y, 50)
+    assert sampled_y.max() == 100.0
+
+
+def test_lttb_returns_short_series_unchanged():
+    x, y = np.arange(10, dtype=float), np.arange(10, dtype=float)
+    sampled_x, sampled_y = main.lttb_downsample(x, y, 20)
+    assert sampled_x is x and sampled_y is y
+
+
+def test_price_data_round_trip():
+    days = [19000, 19001, 19004, 19005, 19006]
+    closes = [123.45, 124.01, 119.99, 120.0, 131.37]
+    decoded_days, decoded_values = decode_price_series(main.encode_price_series(make_series(days, closes)))
+    assert decoded_days.tolist() == days
+    assert np.allclose(decoded_values, closes, atol=0.005)
+
+
+def test_price_data_uses_finer_scale_below_ten_dollars():
+    closes = [1.2345, 1.2401, 0.9999]
+    payload = main.encode_price_series(make_series([19000, 19001, 19002], closes))
+    assert np.frombuffer(payload, dtype='<i4', count=1, offset=12)[0] == 10000
+    assert np.allclose(decode_price_series(payload)[1], closes, atol=0.00005)
+
+
+def test_price_data_empty_series():
+    payload = main.encode_price_series(make_series([], []))
+    assert len(payload) == 20
+    assert len(decode_price_series(payload)[0]) == 0
+
+
+def test_percentage_changes_against_window_average():
+    index = pd.date_range('2024-01-01', '2025-06-30', freq='D')
+    closes = pd.DataFrame({'AAA': np.where(index < pd.Timestamp('2024-06-01'), 50.0, 100.0)}, index=index)
+    anchors = main.compute_anchor_prices(closes, horizons=['1y'], today=date(2025, 6, 30))
+    assert anchors.loc['AAA', '1y'] == 100.0
+    changes = main.compute_percentage_changes(anchors, pd.Series({'AAA': 150.0}))
+    assert changes.loc['AAA', '1y'] == 50.0
@@ -0,0 +1,49 @@
+import json
+import os
+
+import main
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb' if isinstance(content, bytes) else 'w') as f:
+        f.write(content)
+
+
+def test_rewrite_src_href_srcset_and_data_src():
+    asset_paths = {'css/style.css': 'css/style.0123456789ab.css', 'img/AAA_1y.png': 'img/AAA_1y.aaaaaaaaaaaa.png',
+                   'img/AAA_1y.webp': 'img/AAA_1y.bbbbbbbbbbbb.webp', 'data/AAA.bin': 'data/AAA.cccccccccccc.bin'}
+    html = ('<link rel="stylesheet" href="../css/style.css">'
+            '<source srcset="../img/AAA_1y.webp 1x, ../img/AAA_1y.webp 2x">'
+            '<img src="../img/AAA_1y.png?v=1#top">'
+            '<div data-src="../data/AAA.bin"></div>'
+            '<a href="https://example.com/img/AAA_1y.png">x</a><a href="#arriba">y</a>')
+    rewritten = main.rewrite_asset_references(html, 'empresas/AAA.html', asset_paths)
+    assert 'href="../css/style.0123456789ab.css"' in rewritten
+    assert 'srcset="../img/AAA_1y.bbbbbbbbbbbb.webp 1x, ../img/AAA_1y.bbbbbbbbbbbb.webp 2x"' in rewritten
+    assert 'src="../img/AAA_1y.aaaaaaaaaaaa.png"' in rewritten
+    assert 'data-src="../data/AAA.cccccccccccc.bin"' in rewritten
+    assert 'href="https://example.com/img/AAA_1y.png"' in rewritten and 'href="#arriba"' in rewritten
+
+
+def test_deploy_output_publishes_referenced_assets_with_hashes(tmp_path):
+    source, deploy = str(tmp_path / 'public'), str(tmp_path / 'dist')
+    write(f'{source}/index.html', '<link href="css/style.css"><img src="img/AAA_1y.png"><div data-src="data/AAA.bin"></div>')
+    write(f'{source}/css/style.css', 'body { background: url("../img/fondo.png"); }')
+    write(f'{source}/img/AAA_1y.png', b'png')
+    write(f'{source}/img/fondo.png', b'fondo')
+    write(f'{source}/img/RETIRADO_1y.png', b'viejo')
+    write(f'{source}/data/AAA.bin', b'PXS1')
+
+    cache_headers = main.build_deploy_output(source, deploy)
+
+    published = set(cache_headers)
+    png = main.fingerprinted_path('img/AAA_1y.png', b'png')
+    assert '/' + png in published and '/' + main.fingerprinted_path('img/fondo.png', b'fondo') in published
+    assert not any('RETIRADO' in path for path in published)
+    assert cache_headers['/' + png]['Cache-Control'] == main.IMMUTABLE_CACHE_CONTROL
+    with open(f'{deploy}/index.html') as f:
+        index = f.read()
+    assert f'src="{png}"' in index and 'data-src="data/AAA.' in index
+    with open(f'{deploy}/{main.CACHE_MANIFEST_NAME}') as f:
+        assert json.load(f) == cache_headers
@@ -0,0 +1,33 @@
+import types
+from datetime import timedelta
+
+import main
+
+
+def test_query_stays_incremental_across_days(tmp_path, monkeypatch):
+    path = str(tmp_path / 'news.sqlite')
+    requests = []
+    responses = [
+        [{'url': 'https://example.com/old', 'title': 'Old', 'source': {'name': 'P'}, 'publishedAt': '2000-01-01T00:00:00Z'},
+         {'url': 'https://example.com/a', 'title': 'A', 'source': {'name': 'P'}, 'publishedAt': '2999-01-01T00:00:00Z'}],
+        [{'url': 'https://example.com/b', 'title': 'B', 'source': {'name': 'P'}, 'publishedAt': '2999-01-02T00:00:00Z'}],
+    ]
+
+    def fake_call_provider(provider, stage, function, **params):
+        requests.append(params['from_param'])
+        return {'articles': responses[len(requests) - 1]}
+
+    open_news_cache = main.open_news_cache
+    monkeypatch.setattr(main, 'open_news_cache', lambda: open_news_cache(path))
+    monkeypatch.setattr(main, 'call_provider', fake_call_provider)
+    monkeypatch.setattr(main, 'newsapi', types.SimpleNamespace(get_everything=None))
+    monkeypatch.setattr(main, 'NEWS_CACHE_MAX_AGE_HOURS', 0)
+
+    first = main.get_everything_cached('"Acme"')
+    assert [a['url'] for a in first['articles']] == ['https://example.com/a']
+
+    # Al día siguiente la consulta sigue siendo incremental (desde la última petición, no desde el inicio de la ventana)
+    monkeypatch.setattr(main, 'BUILD_CLOCK_OFFSET', -timedelta(days=1))
+    second = main.get_everything_cached('"Acme"')
+    assert 'T' not in requests[0] and 'T' in requests[1]
+    assert [a['url'] for a in second['articles']] == ['https://example.com/b', 'https://example.com/a']
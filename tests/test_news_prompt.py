@@ -0,0 +1,53 @@
+import main
+
+
+def article(title, url='https://example.com/a'):
+    return {'title': title, 'url': url, 'publisher': 'Example'}
+
+
+def format_article(item):
+    return f"Título: {item['title']}\nEnlace: {item['url']}"
+
+
+def test_oversized_duplicate_does_not_end_the_selection():
+    articles = [
+        article('Acme Corp reports record quarterly revenue growth'),
+        article('Acme Corp reports record quarterly revenue growth today', 'https://example.com/' + 'x' * 400),
+        article('Regulators open probe into Acme Corp pricing'),
+    ]
+    lines, links = main.select_prompt_articles(articles, format_article, token_budget=60, max_articles=5)
+    assert len(lines) == 2
+    assert [item['title'] for item in links] == [articles[0]['title'], articles[2]['title']]
+
+
+def test_articles_that_do_not_fit_are_skipped_for_shorter_ones():
+    articles = [
+        article('Acme Corp reports record quarterly revenue growth'),
+        article('Acme Corp names a new chief executive officer', 'https://example.com/' + 'x' * 400),
+        article('Regulators open probe into Acme Corp pricing'),
+    ]
+    lines, links = main.select_prompt_articles(articles, format_article, token_budget=60, max_articles=5)
+    assert [item['title'] for item in links] == [articles[0]['title'], articles[2]['title']]
+
+
+def test_links_cite_only_articles_sent_in_the_prompt():
+    articles = [article('Acme Corp reports record quarterly revenue growth'),
+                article('Regulators open probe into Acme Corp pricing'),
+                article('Acme shares slide after analyst downgrade'),
+                article('New factory opens in Ohio for the robotics unit')]
+    lines, links = main.select_prompt_articles(articles, format_article, token_budget=1000, max_articles=2)
+    assert len(lines) == 2
+    assert links == articles[:2]
+
+
+def test_duplicate_savings_count_only_what_the_naive_prompt_would_send(capsys):
+    articles = [
+        article('Acme Corp reports record quarterly revenue growth'),
+        article('Acme Corp reports record quarterly revenue growth today'),
+        article('Regulators open probe into Acme Corp pricing'),
+    ]
+    main.select_prompt_articles(articles, format_article, token_budget=1000, max_articles=1)
+    assert '0 casi duplicados' in capsys.readouterr().out
+
+    main.select_prompt_articles(articles, format_article, token_budget=1000, max_articles=2)
+    assert '1 casi duplicados' in capsys.readouterr().out
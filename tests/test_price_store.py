@@ -0,0 +1,51 @@
+import numpy as np
+
+import main
+
+
+def make_series(days, closes):
+    return main.PriceSeries(np.array(days, dtype=np.int32), np.array(closes, dtype=np.float32))
+
+
+def test_intraday_last_bar_is_not_a_restatement():
+    stored = make_series([100, 101, 102], [10.0, 11.0, 12.0])
+    fresh = make_series([100, 101, 102, 103], [10.0, 11.0, 12.036, 12.5])  # 0.3% sobre la barra intradía
+    assert not main._history_was_restated(stored, fresh)
+
+
+def test_changed_settled_close_is_a_restatement():
+    stored = make_series([100, 101, 102], [10.0, 11.0, 12.0])
+    fresh = make_series([100, 101, 102], [5.0, 5.5, 6.0])  # Split 2:1
+    assert main._history_was_restated(stored, fresh)
+
+
+def test_no_overlap_is_a_restatement():
+    stored = make_series([100, 101], [10.0, 11.0])
+    fresh = make_series([105, 106], [12.0, 13.0])
+    assert main._history_was_restated(stored, fresh)
+
+
+def test_merge_replaces_the_intraday_tail():
+    stored = make_series([100, 101, 102], [10.0, 11.0, 12.0])
+    fresh = make_series([101, 102, 103], [11.0, 12.036, 12.5])
+    merged = main.merge_price_series(stored, fresh)
+    assert merged.days.tolist() == [100, 101, 102, 103]
+    assert np.allclose(merged.close, [10.0, 11.0, 12.036, 12.5])
+
+
+def test_incremental_downloads_are_grouped_by_last_stored_day(tmp_path, monkeypatch):
+    today = int(np.datetime64('2026-01-30', 'D').astype(np.int64))
+    stale = int(np.datetime64('2022-06-01', 'D').astype(np.int64))
+    for ticker, last_day in (('AAA', today), ('BBB', today), ('OLD', stale)):
+        main.write_price_series(ticker, make_series([last_day - 1, last_day], [10.0, 11.0]), str(tmp_path))
+
+    requests = []
+
+    def fake_download(tickers, period='max', start=None):
+        requests.append((sorted(tickers), start))
+        return {}
+
+    monkeypatch.setattr(main, 'download_price_history', fake_download)
+    main.load_price_history(['AAA', 'OLD', 'BBB'], directory=str(tmp_path))
+
+    assert sorted(requests) == [(['AAA', 'BBB'], '2026-01-16'), (['OLD'], '2022-05-18')]